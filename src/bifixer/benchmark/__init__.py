@@ -0,0 +1,5 @@
+#!/usr/bin/env python
+
+from . import corpus
+from . import micro
+from . import end_to_end
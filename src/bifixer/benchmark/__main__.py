@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import shlex
+import argparse
+import tempfile
+
+from .. import util
+from . import corpus
+from . import micro
+from . import end_to_end
+
+
+def check_language_pair(value):
+    langs = value.split("-")
+    if len(langs) != 2 or not all(langs):
+        raise argparse.ArgumentTypeError("%s is not a language pair like en-es" % value)
+    return tuple(langs)
+
+
+def initialization():
+    parser = argparse.ArgumentParser(prog="python -m bifixer.benchmark", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Benchmarks of Bifixer and Monofixer on synthetic noisy corpora")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    corpus_parser = subparsers.add_parser("corpus", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                          help="Writes a synthetic noisy parallel corpus")
+    corpus_parser.add_argument("output", type=str, help="Output TSV file (source URL, target URL, source sentence, target sentence)")
+    corpus_parser.add_argument("srclang", type=str, help="Source language")
+    corpus_parser.add_argument("trglang", type=str, help="Target language")
+    corpus_parser.add_argument("--lines", type=util.check_positive, default=100000, help="Number of lines")
+    for name, rate in corpus.DEFAULT_RATES.items():
+        corpus_parser.add_argument("--" + name, type=float, default=rate, help="Rate of %s" % name)
+
+    micro_parser = subparsers.add_parser("micro", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                         help="Times the cleaning functions, the segmenter and the dedup hashing")
+    micro_parser.add_argument("--lines", type=util.check_positive, default=2000, help="Number of sentence pairs of each language pair")
+    micro_parser.add_argument("--repeat", type=util.check_positive, default=5, help="Number of runs (the best one is reported)")
+    micro_parser.add_argument("--segmenter", default="nltk", choices=["nltk", "loomchild", "regex"], help="Segmenter module")
+
+    segmenters_parser = subparsers.add_parser("segmenters", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                              help="Times the segmenters on long lines, and compares their segments with the NLTK ones")
+    segmenters_parser.add_argument("--lines", type=util.check_positive, default=20000, help="Number of sentence pairs of each language pair (about 1 in 20 is a long line)")
+    segmenters_parser.add_argument("--repeat", type=util.check_positive, default=3, help="Number of runs (the best one is reported)")
+    segmenters_parser.add_argument("--segmenters", nargs="+", default=["nltk", "regex"], choices=["nltk", "loomchild", "regex"], help="Segmenter modules")
+
+    startup_parser = subparsers.add_parser("startup", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                           help="Times loading the Punkt parameters of the NLTK segmenter from the NLTK data and from the Punkt cache files")
+    startup_parser.add_argument("--repeat", type=util.check_positive, default=20, help="Number of runs (the best one is reported)")
+
+    e2e_parser = subparsers.add_parser("end_to_end", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                       help="Runs bifixer and monofixer on synthetic corpora, reporting lines/s and peak RSS")
+    e2e_parser.add_argument("--lines", type=util.check_positive, default=20000, help="Number of lines of each corpus")
+    e2e_parser.add_argument("--tmp_dir", type=str, default=tempfile.gettempdir(), help="Directory for the corpora and outputs")
+    e2e_parser.add_argument("--args", type=str, default="", help="Extra arguments for bifixer and monofixer, like --args='--processes 4'")
+
+    for subparser in (micro_parser, segmenters_parser, startup_parser, e2e_parser):
+        subparser.add_argument("--pairs", type=check_language_pair, nargs="+", default=[("en", "es"), ("en", "de"), ("en", "mt")],
+                               help="Language pairs")
+        subparser.add_argument("--json", type=argparse.FileType("w"), help="Also write the results as JSON to this file")
+
+    for subparser in (corpus_parser, micro_parser, segmenters_parser, e2e_parser):
+        subparser.add_argument("--seed", type=int, default=1, help="Random seed of the corpus generator")
+
+    return parser.parse_args()
+
+
+def main():
+    args = initialization()
+
+    if args.command == "corpus":
+        rates = {name: getattr(args, name) for name in corpus.DEFAULT_RATES}
+        corpus.write_corpus(args.output, args.lines, args.srclang, args.trglang, args.seed, **rates)
+        return
+
+    if args.command == "micro":
+        results = []
+        for srclang, trglang in args.pairs:
+            results += micro.run_micro(srclang, trglang, args.lines, args.repeat, args.seed, args.segmenter)
+        sys.stdout.write(micro.format_micro(results))
+    elif args.command == "segmenters":
+        results = []
+        for srclang, trglang in args.pairs:
+            results += micro.run_segmenters(srclang, trglang, args.lines, args.repeat, args.seed, args.segmenters)
+        sys.stdout.write(micro.format_segmenters(results))
+    elif args.command == "startup":
+        langs = list(dict.fromkeys(lang for pair in args.pairs for lang in pair))
+        results = micro.run_startup(langs, args.repeat)
+        sys.stdout.write(micro.format_startup(results))
+    else:
+        with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+            results = end_to_end.run_end_to_end(args.pairs, tmp_dir, args.lines, args.seed, shlex.split(args.args))
+        sys.stdout.write(end_to_end.format_end_to_end(results))
+
+    if args.json:
+        json.dump(results, args.json, indent=2)
+        args.json.write("\n")
+        args.json.close()
+
+
+if __name__ == '__main__':
+    main()
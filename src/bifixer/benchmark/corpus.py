@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+import random
+
+from .. import restorative_cleaning
+
+
+# Common words of each language, with enough accents and special characters for the character fixing and
+# the mojibake to have something to work on. The correct forms in the replacements.* files are added to them.
+WORDS = {
+    "en": "the of and to in is that for it with as was on be by this are from at or have an they which one "
+          "you had not but what all were when we there can more time year people into café naïve résumé "
+          "piñata déjà vu fiancée coöperate façade €5 £10 1,000",
+    "es": "el la de que y en un una los las se del por con no para es al lo como más pero sus le ya o "
+          "año niño pequeño también están información después aquí había según señor corazón ¿qué? ¡sí! "
+          "cigüeña bebía café",
+    "de": "der die und in den von zu das mit sich des auf für ist im dem nicht ein eine als auch es an "
+          "über für größer Mädchen schön Straße Grüße Fuß müssen können während weiß",
+    "fr": "le de un être et à il avoir ne je son que se qui ce dans en du elle au pour pas très déjà "
+          "été où français garçon élève fenêtre naïf cœur Noël hôpital château",
+    "mt": "il ta u li ma fil bħala kien huwa jew minn għal dan din kull fuq aktar ukoll meta Malta "
+          "għandu ħafna żmien ċentru xogħol qiegħed tiegħu tagħhom Ġunju",
+    "pt": "o de a e que do da em um para é com não uma os no se na por mais as dos como mas ao "
+          "ação não também coração você além número informação está",
+    "nl": "de het een en van in is dat op te zijn met voor niet die aan er ook als bij of maar "
+          "één café geïnteresseerd coördinatie ideeën",
+    "da": "og i at det en til er som på de med han af for ikke der var mig sig men et "
+          "på være år også når få blåbær øl",
+    "nb": "og i det er på som en til av at for med ikke var han jeg de har den "
+          "år også være når blåbær øl",
+    "tr": "bir ve bu da de için ile çok ne daha gibi olan kadar ama her ben sen o "
+          "değil ağaç güzel öğrenci şehir İstanbul ılık",
+}
+
+# Pieces of HTML found in crawled text
+HTML_TAGS = [("<b>", "</b>"), ("<i>", "</i>"), ("<strong>", "</strong>"), ('<a href="https://www.example.com/">', "</a>"),
+             ("<span class=\"text\">", "</span>"), ("<br/>", ""), ("<p>", "</p>")]
+HTML_ENTITIES = ["&amp;", "&quot;", "&#39;", "&nbsp;", "&lt;", "&gt;", "&eacute;", "&#8217;", "&copy;"]
+
+# Spaces and punctuation that the normalization fixes
+ODD_SPACES = ["  ", " ", " ", " ​", "   "]
+ODD_PUNCTUATION = [" .", " ,", " ?", " !", " :", ",,", "''"]
+
+END_PUNCTUATION = [".", ".", ".", "?", "!"]
+
+# Probability of each kind of noise, per sentence (or per pair for the duplicates)
+DEFAULT_RATES = {
+    "mojibake": 0.05,
+    "html": 0.10,
+    "entities": 0.10,
+    "spaces": 0.15,
+    "misspellings": 0.20,
+    "detok": 0.30,
+    "long": 0.05,
+    "duplicates": 0.10,
+}
+
+
+def get_vocabulary(lang):
+    words = WORDS.get(lang.lower(), WORDS["en"]).split()
+    # Correct single-word forms of the orthographic replacements
+    words += [word for word in restorative_cleaning.getReplacements(lang).values() if word and " " not in word]
+    return words
+
+
+def get_misspellings(lang):
+    return [wrong for wrong, right in restorative_cleaning.getReplacements(lang).items() if wrong and " " not in wrong]
+
+
+def mojibake(text):
+    # Text encoded as UTF-8 and decoded as Windows-1252 (or Latin-1 for the bytes Windows-1252 doesn't define)
+    encoded = text.encode("utf-8")
+    try:
+        return encoded.decode("cp1252")
+    except UnicodeDecodeError:
+        return encoded.decode("latin-1")
+
+
+# Generates noisy sentence pairs: sentences made of random words of each language with the kinds of noise that
+# Bifixer fixes added at the given rates. The same seed always generates the same corpus.
+class CorpusGenerator:
+    def __init__(self, srclang, trglang, seed=1, **rates):
+        unknown = set(rates) - set(DEFAULT_RATES)
+        if unknown:
+            raise TypeError("Unknown noise rates: {}".format(", ".join(sorted(unknown))))
+
+        self.srclang = srclang
+        self.trglang = trglang
+        self.rates = dict(DEFAULT_RATES, **rates)
+        self.random = random.Random(seed)
+
+        self.vocabulary = {lang: get_vocabulary(lang) for lang in (srclang, trglang)}
+        self.misspellings = {lang: get_misspellings(lang) for lang in (srclang, trglang)}
+        self.detoks = {lang: sorted(restorative_cleaning.getDetokenizations(lang).items()) for lang in (srclang, trglang)}
+
+        # Pairs already generated, to repeat some of them
+        self.seen = []
+
+    def sentence(self, lang, min_words=6, max_words=18):
+        words = self.random.choices(self.vocabulary[lang], k=self.random.randint(min_words, max_words))
+        words[0] = words[0][0].upper() + words[0][1:]
+        return " ".join(words) + self.random.choice(END_PUNCTUATION)
+
+    def add_noise(self, lang, text):
+        rnd = self.random
+        words = text.split(" ")
+
+        if self.misspellings[lang] and rnd.random() < self.rates["misspellings"]:
+            for i in rnd.sample(range(len(words)), k=min(len(words), rnd.randint(1, 3))):
+                words[i] = rnd.choice(self.misspellings[lang])
+
+        if self.detoks[lang] and rnd.random() < self.rates["detok"]:
+            # Tokenized Maltese articles and apostrophes: "il - belt", "ta ' Malta"
+            word, detok = rnd.choice(self.detoks[lang])
+            i = rnd.randrange(len(words))
+            words.insert(i, " ".join((word,) + detok).rstrip())
+
+        if rnd.random() < self.rates["html"]:
+            start, end = rnd.choice(HTML_TAGS)
+            i = rnd.randrange(len(words))
+            j = rnd.randint(i, len(words) - 1)
+            words[i] = start + words[i]
+            words[j] = words[j] + end
+
+        if rnd.random() < self.rates["entities"]:
+            words.insert(rnd.randrange(len(words)), rnd.choice(HTML_ENTITIES))
+
+        text = " ".join(words)
+
+        if rnd.random() < self.rates["spaces"]:
+            # Between two words, or before the final punctuation
+            i = rnd.choice([i for i, char in enumerate(text) if char == " "] + [len(text) - 1])
+            text = text[:i] + rnd.choice(ODD_SPACES + ODD_PUNCTUATION) + text[i:]
+
+        if rnd.random() < self.rates["mojibake"]:
+            text = mojibake(text)
+
+        return text
+
+    def pair(self):
+        rnd = self.random
+
+        if self.seen and rnd.random() < self.rates["duplicates"]:
+            source, target = rnd.choice(self.seen)
+            # Some of the duplicates only differ in casing or spaces, for the aggressive dedup
+            if rnd.random() < 0.5:
+                source = source.lower()
+                target = target + " "
+            return source, target
+
+        if rnd.random() < self.rates["long"]:
+            # Long lines with the same number of sentences in both sides, for the segmenters
+            n = rnd.randint(3, 8)
+            source = " ".join(self.add_noise(self.srclang, self.sentence(self.srclang)) for _ in range(n))
+            target = " ".join(self.add_noise(self.trglang, self.sentence(self.trglang)) for _ in range(n))
+        else:
+            source = self.add_noise(self.srclang, self.sentence(self.srclang))
+            target = self.add_noise(self.trglang, self.sentence(self.trglang))
+
+        if len(self.seen) < 10000:
+            self.seen.append((source, target))
+        return source, target
+
+    def pairs(self, n):
+        for _ in range(n):
+            yield self.pair()
+
+    def rows(self, n):
+        # Rows in the default Bifixer format: source URL, target URL, source sentence, target sentence
+        for i, (source, target) in enumerate(self.pairs(n)):
+            url = "https://www.example.com/{}.html".format(i % 1000)
+            yield "\t".join((url, url, source, target)) + "\n"
+
+
+def write_corpus(path, n, srclang, trglang, seed=1, **rates):
+    generator = CorpusGenerator(srclang, trglang, seed, **rates)
+    with open(path, "w", encoding="utf-8") as output:
+        output.writelines(generator.rows(n))
+
+
+def write_mono_corpus(path, n, lang, seed=1, **rates):
+    # Rows in the default Monofixer format: URL and sentence
+    generator = CorpusGenerator(lang, lang, seed, **rates)
+    with open(path, "w", encoding="utf-8") as output:
+        for i, (sentence, _) in enumerate(generator.pairs(n)):
+            output.write("https://www.example.com/{}.html\t{}\n".format(i % 1000, sentence))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import subprocess
+
+from . import corpus
+
+
+# Runs a command, returning its wall time in seconds and its peak resident memory in MiB
+# (of the largest of the process and its children)
+def run_command(command):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # Read stderr before waiting, so that a verbose run doesn't block on a full pipe
+    errors = process.stderr.read()
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    process.stderr.close()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=errors)
+    # ru_maxrss is in KiB on Linux
+    return elapsed, rusage.ru_maxrss / 1024
+
+
+# End-to-end runs of bifixer on a synthetic corpus of each language pair, and of monofixer on each of its languages.
+# Extra command line arguments (for example ["--processes", "4"]) are passed to both tools.
+# Returns a list of dicts with the tool, languages, number of lines, time, lines/s and peak RSS in MiB.
+def run_end_to_end(language_pairs, tmp_dir, n=20000, seed=1, extra_args=()):
+    results = []
+
+    def add(tool, langs, command):
+        elapsed, peak_rss = run_command(command)
+        results.append({"tool": tool, "langs": langs, "lines": n, "time": elapsed,
+                        "lines_per_second": n / elapsed, "peak_rss": peak_rss})
+
+    langs_done = set()
+    for srclang, trglang in language_pairs:
+        input_path = os.path.join(tmp_dir, "corpus.{}-{}.tsv".format(srclang, trglang))
+        output_path = os.path.join(tmp_dir, "fixed.{}-{}.tsv".format(srclang, trglang))
+        corpus.write_corpus(input_path, n, srclang, trglang, seed)
+        add("bifixer", "{}-{}".format(srclang, trglang),
+            [sys.executable, "-m", "bifixer.bifixer", "-q", *extra_args, input_path, output_path, srclang, trglang])
+
+        for lang in (srclang, trglang):
+            if lang in langs_done:
+                continue
+            langs_done.add(lang)
+            input_path = os.path.join(tmp_dir, "corpus.{}.tsv".format(lang))
+            output_path = os.path.join(tmp_dir, "fixed.{}.tsv".format(lang))
+            corpus.write_mono_corpus(input_path, n, lang, seed)
+            add("monofixer", lang,
+                [sys.executable, "-m", "bifixer.monofixer", "-q", *extra_args, input_path, output_path, lang])
+
+    return results
+
+
+def format_end_to_end(results):
+    lines = ["{:<12}{:<10}{:>10}{:>12}{:>12}{:>16}".format("Tool", "Langs", "Lines", "Time (s)", "lines/s", "Peak RSS (MiB)")]
+    for result in results:
+        lines.append("{:<12}{:<10}{:>10}{:>12.2f}{:>12.0f}{:>16.1f}".format(result["tool"], result["langs"], result["lines"],
+                result["time"], result["lines_per_second"], result["peak_rss"]))
+    return "\n".join(lines) + "\n"
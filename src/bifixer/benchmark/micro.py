@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import os
+import time
+import tempfile
+
+from .. import restorative_cleaning
+from .. import segmenter
+from .. import bifixer
+from . import corpus
+
+
+# Best time of several runs of func over all the items, in seconds per call
+def time_calls(func, items, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(*item)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(items), 1)
+
+
+def get_texts(srclang, trglang, n, seed=1):
+    # Noisy sentences of each side, the same sentences after each cleaning step, and clean (noise-free) sentences
+    generator = corpus.CorpusGenerator(srclang, trglang, seed)
+    pairs = list(generator.pairs(n))
+    clean = corpus.CorpusGenerator(srclang, trglang, seed, **dict.fromkeys(corpus.DEFAULT_RATES, 0))
+    long_generator = corpus.CorpusGenerator(srclang, trglang, seed, long=1, duplicates=0)
+
+    texts = {}
+    for lang, side in ((srclang, 0), (trglang, 1)):
+        profile = restorative_cleaning.get_language_profile(lang)
+        noisy = [pair[side] for pair in pairs]
+        fixed = [profile.fix(text) for text in noisy]
+        no_html = [restorative_cleaning.remove_html_tags(text) for text in fixed]
+        normalized = [profile.normalize(text) for text in no_html]
+        texts[side] = {
+            "noisy": noisy,
+            "clean": [pair[side] for pair in clean.pairs(n)],
+            "fixed": fixed,
+            "no_html": no_html,
+            "normalized": normalized,
+            "long": [pair[side] for pair in long_generator.pairs(max(n // 20, 1))],
+        }
+    return texts
+
+
+# Microbenchmarks of the cleaning functions, the segmenter and the dedup hashing for a language pair.
+# Each function runs on the output of the previous step, as it does in Bifixer.
+# Returns a list of dicts with the function, language, number of calls and seconds per call.
+def run_micro(srclang, trglang, n=2000, repeat=5, seed=1, segmenter_module="nltk"):
+    texts = get_texts(srclang, trglang, n, seed)
+    results = []
+
+    def add(name, lang, func, items):
+        results.append({"function": name, "lang": lang, "calls": len(items), "time": time_calls(func, items, repeat)})
+
+    for lang, side in ((srclang, 0), (trglang, 1)):
+        profile = restorative_cleaning.get_language_profile(lang)
+        side_texts = texts[side]
+        add("fix", lang, profile.fix, [(text,) for text in side_texts["noisy"]])
+        add("fix (clean)", lang, profile.fix, [(text,) for text in side_texts["clean"]])
+        add("remove_html_tags", lang, restorative_cleaning.remove_html_tags, [(text,) for text in side_texts["fixed"]])
+        add("normalize", lang, profile.normalize, [(text,) for text in side_texts["no_html"]])
+        add("collapse_spaces", lang, restorative_cleaning.collapse_spaces, [(text,) for text in side_texts["no_html"]])
+        add("ortho_detok_fix", lang, profile.ortho_detok_fix, [(text,) for text in side_texts["normalized"]])
+        add("NaiveSegmenter", lang, segmenter.NaiveSegmenter(lang, segmenter_module), [(text,) for text in side_texts["long"]])
+        # Every run after the first one finds all the long lines in the cache
+        add("NaiveSegmenter (cache)", lang, segmenter.NaiveSegmenter(lang, segmenter_module, len(side_texts["long"])), [(text,) for text in side_texts["long"]])
+
+    pairs = list(zip(texts[0]["normalized"], texts[1]["normalized"]))
+    pair_name = "{}-{}".format(srclang, trglang)
+    engine = bifixer.BifixerEngine(srclang, trglang, ignore_segmentation=True)
+    add("get_hash", pair_name, engine.get_hash, pairs)
+    engine = bifixer.BifixerEngine(srclang, trglang, ignore_segmentation=True, aggressive_dedup=True)
+    add("get_hash (aggressive)", pair_name, engine.get_hash, pairs)
+
+    return results
+
+
+# Speed of each segmenter on the long multi-sentence lines of each language of a pair, and its agreement with
+# NLTK (Punkt): the share of lines that are split into exactly the same segments
+def run_segmenters(srclang, trglang, n=2000, repeat=5, seed=1, modules=("nltk", "regex")):
+    texts = get_texts(srclang, trglang, n, seed)
+    results = []
+
+    for lang, side in ((srclang, 0), (trglang, 1)):
+        lines = texts[side]["long"]
+        punkt = segmenter.NaiveSegmenter(lang, "nltk")
+        expected = [punkt(line) for line in lines]
+        for module in modules:
+            side_segmenter = segmenter.NaiveSegmenter(lang, module)
+            agreement = sum(side_segmenter(line) == segments for line, segments in zip(lines, expected))
+            results.append({"segmenter": module, "lang": lang, "lines": len(lines),
+                            "time": time_calls(side_segmenter, [(line,) for line in lines], repeat),
+                            "agreement": agreement / max(len(lines), 1)})
+    return results
+
+
+# Time to get the Punkt parameters of the NLTK segmenter of each language, in seconds: parsing the NLTK data, reading
+# them from a Punkt cache file, and creating a NaiveSegmenter once they are loaded in the process
+def run_startup(langs, repeat=5):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for lang in langs:
+            langname = segmenter.NLTKSegmenter.getLanguageName(lang.lower())
+            cache_file = os.path.join(tmp_dir, "punkt.{}.pickle".format(langname))
+            with open(cache_file, "wb") as punkt_file:
+                punkt_file.write(segmenter.dump_punkt_parameters(segmenter.load_punkt_tab(langname)))
+
+            def read_cache_file():
+                with open(cache_file, "rb") as punkt_file:
+                    return segmenter.read_punkt_parameters(punkt_file)
+
+            segmenter.NaiveSegmenter(lang, "nltk")
+            for source, func, item in (("NLTK data", segmenter.load_punkt_tab, (langname,)), ("cache file", read_cache_file, ()),
+                                       ("loaded", segmenter.NaiveSegmenter, (lang, "nltk"))):
+                results.append({"lang": lang, "source": source, "time": time_calls(func, [item], repeat)})
+    return results
+
+
+def format_startup(results):
+    lines = ["{:<8}{:<14}{:>12}".format("Lang", "Source", "ms")]
+    for result in results:
+        lines.append("{:<8}{:<14}{:>12.3f}".format(result["lang"], result["source"], result["time"] * 1e3))
+    return "\n".join(lines) + "\n"
+
+
+def format_segmenters(results):
+    lines = ["{:<12}{:<8}{:>8}{:>12}{:>14}{:>12}".format("Segmenter", "Lang", "Lines", "us/line", "lines/s", "Agreement")]
+    for result in results:
+        lines.append("{:<12}{:<8}{:>8}{:>12.2f}{:>14.0f}{:>11.2f}%".format(result["segmenter"], result["lang"], result["lines"],
+                result["time"] * 1e6, 1 / result["time"] if result["time"] else 0, result["agreement"] * 100))
+    return "\n".join(lines) + "\n"
+
+
+def format_micro(results):
+    lines = ["{:<24}{:<8}{:>8}{:>12}{:>14}".format("Function", "Lang", "Calls", "us/call", "calls/s")]
+    for result in results:
+        lines.append("{:<24}{:<8}{:>8}{:>12.2f}{:>14.0f}".format(result["function"], result["lang"], result["calls"],
+                result["time"] * 1e6, 1 / result["time"] if result["time"] else 0))
+    return "\n".join(lines) + "\n"
@@ -12,12 +12,10 @@ __version__ = "Version 0.8 # 15/06/2022 # Remove HTML tags # Marta Bañón"
 import os
 import sys
 import argparse
-import copy
-import traceback
+import functools
 import logging
 from importlib.metadata import version
 
-from unicodedata import category as cat
 from unidecode import unidecode
 from tempfile import gettempdir
 from timeit import default_timer
@@ -25,23 +23,23 @@ from xxhash import xxh64
 
 try:
     from . import util
+    from . import fileio
+    from . import rows
+    from . import engine
+    from . import near_dedup
     from . import restorative_cleaning
     from . import segmenter
 except (ImportError, SystemError):
     import util
+    import fileio
+    import rows
+    import engine
+    import near_dedup
     import restorative_cleaning
     import segmenter
 
-# Translate table to remove non alphabetic characters
-tbl = [chr(i) for i in range(sys.maxunicode) if not cat(chr(i)).startswith('L')]
-remove_non_alpha = str.maketrans('', '', ''.join(tbl))
 
 def initialization():
-    global ilines
-    global olines
-
-    ilines = 0
-    olines = 0
     header = "--header" in sys.argv
 
     logging.info("Processing arguments...")
@@ -49,9 +47,9 @@ def initialization():
 
     # Mandatory parameters
     # Input file
-    parser.add_argument('input', type=argparse.FileType('rt', encoding='UTF-8'), default=None, help="Tab-separated files to be bifixed")
+    parser.add_argument('input', type=str, help="Tab-separated files to be bifixed, '-' for stdin. gzip, xz and zstd compressed files are detected and decompressed")
     # Output file (corpus)
-    parser.add_argument('output', type=argparse.FileType('w', encoding='UTF-8'), default=sys.stdout, help="Fixed corpus")
+    parser.add_argument('output', type=str, help="Fixed corpus, '-' for stdout. Compressed if the name ends in .gz, .xz or .zst")
     # Source language
     parser.add_argument("srclang", type=str, help="Source language (SL) of the input")
     # Target language
@@ -90,13 +88,30 @@ def initialization():
     # Deduplication
     groupO.add_argument('--ignore_duplicates', default=False, action='store_true', help="Doesn't obtain the hashes of parallel sentences")
     groupO.add_argument('--aggressive_dedup', default=False, action='store_true', help="Treats similar sentences as duplicates (marking them with the same hash)")
+    groupO.add_argument('--drop_duplicates', default=False, action='store_true', help="Drops the rows whose hash was already seen, instead of only tagging them")
+    groupO.add_argument('--keep_best', default=False, action='store_true', help="With --drop_duplicates, keeps the row with the highest ranking of each hash instead of the first one. Rows are kept in a temporary file in --tmp_dir until the end")
+    groupO.add_argument('--hash_index', type=str, default=None, help="Index file with the hashes of earlier runs. With --drop_duplicates, the rows whose hash is in the index are dropped too, and the new hashes are added to the index at the end (it is created if it doesn't exist)")
+    groupO.add_argument('--hash_index_readonly', default=False, action='store_true', help="Doesn't add the new hashes to the --hash_index file")
+    groupO.add_argument('--near_dedup', default=False, action='store_true', help="Adds a column with the cluster of near-duplicated sentence pairs of each row (the hash of the first row of the cluster), found with MinHash and LSH over the normalized sentences")
+    groupO.add_argument('--near_dedup_window', default=500000, type=util.check_positive, help="Number of recent rows whose MinHash bands are kept in memory to find the near-duplicates of the next ones (up to twice as many are kept, as the index is dropped in two halves)")
 
     # Segmentation
     groupO.add_argument('--ignore_segmentation', default=False, action='store_true', help="Doesn't change segmentation of long sentences")
     groupO.add_argument('--words_before_segmenting', default=15, type=util.check_positive, help="Max words allowed in one side of a parallel sentence before trying to segmentate it. Set to 0 to applicate segmentation on everything.")
-    groupO.add_argument('--segmenter', default="nltk", type=str, choices=["nltk", "loomchild"], help="Segmenter module.")
+    groupO.add_argument('--segmenter', default="nltk", type=str, choices=["nltk", "loomchild", "regex"], help="Segmenter module. 'regex' is a faster rule-based segmenter that mostly agrees with 'nltk'")
     groupO.add_argument('--tmp_dir', default=gettempdir(), help="Temporary directory where creating the temporary files of this program")
     
+    # Parallelization
+    groupO.add_argument('--processes', default=1, type=util.check_positive, help="Number of worker processes used to fix the sentences")
+    groupO.add_argument('--threads', default=1, type=util.check_positive, help="Number of threads used to fix the sentences, sharing the language resources. Cannot be combined with --processes")
+    groupO.add_argument('--pipeline', default=False, action='store_true', help="Read the input, fix the sentences and write the output in separate threads connected by bounded queues, so waiting for the input or the output overlaps with the fixing. The time split of each stage is logged at the end")
+    groupO.add_argument('--profile', default=False, action='store_true', help="Print a table with the time, calls and changed sentences of each stage of the fixing at the end")
+    groupO.add_argument('--profile_json', type=str, default=None, help="Write the profile of each stage of the fixing to this JSON file instead of printing it (implies --profile)")
+    groupO.add_argument('--cache_size', default=0, type=util.check_positive_or_zero, help="Number of cleaned sentences kept in memory, so repeated sentences are only cleaned once. Set to 0 to disable the cache")
+    groupO.add_argument('--segmentation_cache_size', default=10000, type=util.check_positive_or_zero, help="Number of segmented sentences kept in memory for each language, so repeated long sentences are only segmented once. Set to 0 to disable the cache")
+    groupO.add_argument('--batch_size', default=1000, type=util.check_positive, help="Number of lines fixed at once, so the long sentences of each batch are segmented together. Batches are sent to the worker processes or threads when using more than one")
+    groupO.add_argument('--compression_level', default=None, type=util.check_positive_or_zero, help="Compression level of the output when it is compressed. If not set, 6 is used for gzip and xz, and 3 for zstd")
+
     # Annotation
     groupO.add_argument('--annotated_output', default=False, action='store_true', help="Adds an extra column indicating if the sentence pair was modified ('Yes' if it was modified, otherwise 'No')")
 
@@ -109,6 +124,21 @@ def initialization():
 
     # Validating & parsing
     args = parser.parse_args()
+    if args.processes > 1 and args.threads > 1:
+        parser.error("--processes and --threads cannot be combined")
+    if args.profile_json:
+        args.profile = True
+    if args.drop_duplicates and args.ignore_duplicates:
+        parser.error("--drop_duplicates cannot be combined with --ignore_duplicates")
+    if args.keep_best and not args.drop_duplicates:
+        parser.error("--keep_best requires --drop_duplicates")
+    if args.hash_index and not args.drop_duplicates:
+        parser.error("--hash_index requires --drop_duplicates")
+    if args.hash_index_readonly and not args.hash_index:
+        parser.error("--hash_index_readonly requires --hash_index")
+    if args.near_dedup and args.ignore_duplicates:
+        parser.error("--near_dedup cannot be combined with --ignore_duplicates")
+    fileio.open_files(parser, args)
     util.logging_setup(args)
     args.dedup = not args.ignore_duplicates  # more friendly usage of the ignore_duplicates flag
 
@@ -119,245 +149,162 @@ def initialization():
     return args
 
 
-def fix_sentences(args):
-    if ('ilines' in globals() and 'olines' in globals()):
-        global ilines
-        global olines
-    else:
-        ilines = 0
-        olines = 0
-
-    if not args.ignore_characters:
-        chars_slang, charsRe_slang = restorative_cleaning.getCharsReplacements(args.srclang)
-        chars_tlang, charsRe_tlang = restorative_cleaning.getCharsReplacements(args.trglang)
-
-    if not args.ignore_normalization:
-        punctChars_slang, punctRe_slang = restorative_cleaning.getNormalizedPunctReplacements(args.srclang)
-        punctChars_tlang, punctRe_tlang = restorative_cleaning.getNormalizedPunctReplacements(args.trglang)
-        
-    if not args.ignore_orthography:
-        replacements_slang = restorative_cleaning.getReplacements(args.srclang)
-        replacements_tlang = restorative_cleaning.getReplacements(args.trglang)
-
-    if not args.ignore_detokenization:
-        detoks_slang = restorative_cleaning.getDetokenizations(args.srclang)
-        detoks_tlang = restorative_cleaning.getDetokenizations(args.trglang)
-    else:
-        detoks_slang = {}
-        detoks_tlang = {}
-
-    if not args.ignore_segmentation:
-        source_segmenter = segmenter.NaiveSegmenter(args.srclang, args.segmenter)
-        target_segmenter = segmenter.NaiveSegmenter(args.trglang, args.segmenter)
-
-    if args.header:
-        header = next(args.input).strip().split("\t")
-
-        # Transform fields to idxs
-        if args.scol not in header:
-            raise Exception(f"The provided --scol '{args.scol}' is not in the input header")
-        if args.tcol not in header:
-            raise Exception(f"The provided --tcol '{args.tcol}' is not in the input header")
-
-        args.scol = int(header.index(args.scol)) + 1
-        args.tcol = int(header.index(args.tcol)) + 1
-
-        if args.sdeferredcol:
-            if args.sdeferredcol not in header:
-                raise Exception(f"The provided --sdeferredcol '{args.sdeferredcol}' is not in the input header")
-
-            args.sdeferredcol = int(header.index(args.sdeferredcol)) + 1
-        if args.tdeferredcol:
-            if args.tdeferredcol not in header:
-                raise Exception(f"The provided --tdeferredcol '{args.tdeferredcol}' is not in the input header")
-
-            args.tdeferredcol = int(header.index(args.tdeferredcol)) + 1
-        if args.sparagraphid:
-            if args.sparagraphid not in header:
-                raise Exception(f"The provided --sparagraphid '{args.sparagraphid}' is not in the input header")
-
-            args.sparagraphid = int(header.index(args.sparagraphid)) + 1
-        if args.tparagraphid:
-            if args.tparagraphid not in header:
-                raise Exception(f"The provided --tparagraphid '{args.tparagraphid}' is not in the input header")
-
-            args.tparagraphid = int(header.index(args.tparagraphid)) + 1
-
-        # Write the output header once
-        args.output.write("\t".join(header))
-
-        if args.dedup:
-            args.output.write("\tbifixer_hash\tbifixer_score")
-        if args.annotated_output:
-            args.output.write("\tbifixed")
-        args.output.write("\n")
-
-    for i in args.input:
-        ilines += 1
-        parts = i.split("\t")
-
-        try:
-            source_sentence = parts[args.scol - 1]
-            target_sentence = parts[args.tcol - 1]
-
-            # Check optional indexes
-            if args.sdeferredcol and args.tdeferredcol:
-                parts[args.sdeferredcol - 1]
-                parts[args.tdeferredcol - 1]
-            if args.sparagraphid and args.tparagraphid:
-                parts[args.sparagraphid - 1]
-                parts[args.tparagraphid - 1]
-        except IndexError:
-            logging.error(traceback.format_exc())
-            logging.error("Wrong column index on line " + str(ilines))
-            continue
+class BifixerEngine(engine.FixerEngine):
+    # Fixes parallel sentences in memory, without going through TSV files.
+    # Language resources and segmenters are loaded only once, when the engine is created.
+    lang_args = ("srclang", "trglang")
+    unfixed_chars = " \n"
+
+    def __init__(self, srclang, trglang, **options):
+        super().__init__(**options)
+        self.srclang = srclang
+        self.trglang = trglang
+
+        # Language tables are shared by all the engines of the process
+        self.source_profile = restorative_cleaning.get_language_profile(srclang)
+        self.target_profile = restorative_cleaning.get_language_profile(trglang)
+
+        if not self.ignore_segmentation:
+            self.source_segmenter = segmenter.NaiveSegmenter(srclang, self.segmenter, self.segmentation_cache_size)
+            self.target_segmenter = segmenter.NaiveSegmenter(trglang, self.segmenter, self.segmentation_cache_size)
+
+    def fix_pair(self, source_sentence, target_sentence, stats=None):
+        # Returns the fixed segments of a sentence pair, as a list of dicts with the "source_segment" and
+        # "target_segment" keys, plus "hash" and "ranking" if dedup is enabled, and "bands" (the keys of the MinHash
+        # bands of the pair) if near_dedup is enabled too.
+        # The list is empty if the pair is discarded because one of its sides is empty.
+        # Threads sharing the engine pass their own stats counter.
+        if stats is None:
+            stats = self.stats
+
+        cleaned = self.clean_pair(source_sentence, target_sentence, stats)
+        if cleaned is None:
+            return []
+        corrected_source, corrected_target, long_pair = cleaned
+
+        if long_pair:
+            # The naive_segmenter must return an array of tuples (source sentence, target sentence)
+            if segmenter.keeps_pair(self.source_segmenter, self.target_segmenter, corrected_source, corrected_target):
+                # Neither side is segmented, as the pair would be kept as it is anyway
+                stats["segmentation_avoided"] += 2
+                segments = [{"source_segment": corrected_source, "target_segment": corrected_target}]
+            else:
+                if self.profile:
+                    source_segmenter = functools.partial(self.profile_segmentation, self.source_segmenter, stats, "source")
+                    target_segmenter = functools.partial(self.profile_segmentation, self.target_segmenter, stats, "target")
+                else:
+                    source_segmenter = functools.partial(self.source_segmenter, stats=stats)
+                    target_segmenter = functools.partial(self.target_segmenter, stats=stats)
+                segments = segmenter.naive_segmenter(source_segmenter, target_segmenter, corrected_source, corrected_target)
+        else:
+            # keep original segmentation
+            segments = [{"source_segment": corrected_source, "target_segment": corrected_target}]
 
-        very_long = False
+        return self.hash_segments(segments, stats)
 
-        # None of source or target sentences is empty:
-        if args.ignore_empty or (source_sentence and target_sentence):
-            if not args.ignore_long and (len(source_sentence) > 5000 or len(target_sentence) > 5000):
-                very_long = True
+    def clean_pair(self, source_sentence, target_sentence, stats):
+        # Cleans both sides of a pair, returning them and whether the pair is long enough to be segmented,
+        # or None if the pair is discarded because one of its sides is empty
+        if not (self.ignore_empty or (source_sentence and target_sentence)):
+            return None
 
-            if not args.ignore_characters and not very_long:
-                fixed_source = restorative_cleaning.fix(source_sentence, args.srclang, chars_slang, charsRe_slang)
-                fixed_target = restorative_cleaning.fix(target_sentence, args.trglang, chars_tlang, charsRe_tlang)
-            else:
-                fixed_source = source_sentence.strip(" \n") 
-                fixed_target = target_sentence.strip(" \n") 
-
-            if not args.ignore_html and not very_long:
-                fixed_source = restorative_cleaning.remove_html_tags(fixed_source)
-                fixed_target = restorative_cleaning.remove_html_tags(fixed_target)            
-                
-            if not args.ignore_normalization and not very_long:
-                fixed_source = restorative_cleaning.normalize(fixed_source, args.srclang, punctChars_slang, punctRe_slang)
-                fixed_target = restorative_cleaning.normalize(fixed_target, args.trglang, punctChars_tlang, punctRe_tlang)
-
-            if not args.ignore_orthography and not very_long:
-                corrected_source = restorative_cleaning.ortho_detok_fix(fixed_source, replacements_slang, detoks_slang)
-                corrected_target = restorative_cleaning.ortho_detok_fix(fixed_target, replacements_tlang, detoks_tlang)
-            else:
-                corrected_source = fixed_source
-                corrected_target = fixed_target
+        very_long = False
+        if not self.ignore_long and (len(source_sentence) > 5000 or len(target_sentence) > 5000):
+            very_long = True
 
-            if not args.ignore_segmentation and (len(fixed_source.split()) > args.words_before_segmenting or len(fixed_target.split()) > args.words_before_segmenting) and not very_long:
-                # The naive_segmenter must return an array of tuples (source sentence, target sentence)
-                segments = segmenter.naive_segmenter(source_segmenter, target_segmenter, corrected_source, corrected_target)
+        if not very_long:
+            corrected_source, source_words = self.clean_text(source_sentence, self.source_profile, stats, "source")
+            corrected_target, target_words = self.clean_text(target_sentence, self.target_profile, stats, "target")
+        else:
+            corrected_source = source_sentence.strip(" \n")
+            corrected_target = target_sentence.strip(" \n")
+
+        long_pair = not self.ignore_segmentation and not very_long and (source_words > self.words_before_segmenting or target_words > self.words_before_segmenting)
+        return corrected_source, corrected_target, long_pair
+
+    def hash_segments(self, segments, stats):
+        # Drops the empty segments, and adds the hash, ranking and MinHash bands to the rest of them
+        fixed_segments = []
+        for segment in segments:
+            if not self.ignore_empty and (len(segment["source_segment"]) == 0 or len(segment["target_segment"]) == 0):
+                continue
+            if self.dedup:
+                if self.profile:
+                    start = default_timer()
+                segment["hash"], segment["ranking"] = self.get_hash(segment["source_segment"], segment["target_segment"])
+                if self.near_dedup:
+                    segment["bands"] = self.get_band_keys(segment["source_segment"], segment["target_segment"])
+                if self.profile:
+                    util.profile_stage(stats, "hash", "pair", start, False)
+            fixed_segments.append(segment)
+
+        return fixed_segments
+
+    def fix_batch(self, sentence_pairs, stats=None):
+        # Fixes an iterable of (source, target) sentence pairs, returning the list of segments of each pair.
+        # The long pairs of the batch are segmented together with naive_segmenter_batch, unless profiling, as the
+        # segmentation of each side is timed apart then.
+        if stats is None:
+            stats = self.stats
+        if self.ignore_segmentation or self.profile:
+            return [self.fix_pair(source_sentence, target_sentence, stats) for source_sentence, target_sentence in sentence_pairs]
+
+        cleaned = [self.clean_pair(source_sentence, target_sentence, stats) for source_sentence, target_sentence in sentence_pairs]
+        long_pairs = [(corrected_source, corrected_target) for corrected_source, corrected_target, long_pair in filter(None, cleaned) if long_pair]
+        segmented = iter(segmenter.naive_segmenter_batch(self.source_segmenter, self.target_segmenter, long_pairs, stats))
+
+        results = []
+        for pair in cleaned:
+            if pair is None:
+                results.append([])
+                continue
+            corrected_source, corrected_target, long_pair = pair
+            if long_pair:
+                segments = next(segmented)
             else:
-                # keep original segmentation
                 segments = [{"source_segment": corrected_source, "target_segment": corrected_target}]
+            results.append(self.hash_segments(segments, stats))
+        return results
 
-            sent_num = 0
-            for segment in segments:
-                if not args.ignore_empty and (len(segment["source_segment"]) == 0 or len(segment["target_segment"]) == 0):
-                    continue
-                if args.dedup:
-                    if args.aggressive_dedup:
-                        normalized_src = unidecode(segment["source_segment"].lower().translate(remove_non_alpha))
-                        normalized_trg = unidecode(segment["target_segment"].lower().translate(remove_non_alpha))
-
-                        segment_hash = xxh64(normalized_src + "\t" + normalized_trg).hexdigest()
-
-                        charsum = sum(ord(ch) for ch in segment["source_segment"] + segment["target_segment"])
-                        ranking = round(charsum / (float(len(segment["source_segment"] + segment["target_segment"]))+0.00001), 2) #the  0.00001 is for the case that length is 0 :D
-
-                    else:
-                        segment_hash = xxh64(segment["source_segment"] + "\t" + segment["target_segment"]).hexdigest()
-                        ranking = 1
-                # if  dedupping: Add extra columnsn with hash and ranking in output file
-                # Restored parts object, with the fixed segment, overwritten for each pair of extra segments,
-                new_parts = copy.deepcopy(parts)
-
-                new_parts[args.scol - 1] = segment["source_segment"]
-                new_parts[args.tcol - 1] = segment["target_segment"]
-
-                if len(segments) > 1:
-                    sent_num += 1
-
-                    if args.sdeferredcol and args.tdeferredcol:
-                        if "#" in parts[args.sdeferredcol - 1] or "#" in parts[args.tdeferredcol - 1]:
-                            # Reconstruction
-                            if "#" in parts[args.sdeferredcol - 1]:
-                                if sent_num != int(parts[args.sdeferredcol - 1].split('#')[1]):
-                                    continue
-                            elif "#" in parts[args.tdeferredcol - 1]:
-                                if sent_num != int(parts[args.tdeferredcol - 1].split('#')[1]):
-                                    continue
-                        else:
-                            new_parts[args.sdeferredcol - 1] = parts[args.sdeferredcol - 1].rstrip("\n") + "#" + str(sent_num)
-                            new_parts[args.tdeferredcol - 1] = parts[args.tdeferredcol - 1].rstrip("\n") + "#" + str(sent_num)
-                    if args.sparagraphid and args.tparagraphid:
-                        new_parts[args.sparagraphid - 1] = parts[args.sparagraphid - 1].rstrip("\n") + "#" + str(sent_num)
-                        new_parts[args.tparagraphid - 1] = parts[args.tparagraphid - 1].rstrip("\n") + "#" + str(sent_num)
-
-                # sentence sides may be empty now because it contained only spaces or similar weird thing
-                # for sentences containing only spaces but not normalized, strip them
-                if args.ignore_empty or (new_parts[args.scol - 1].strip() and new_parts[args.tcol - 1].strip()):
-                    if (args.dedup):
-                        # Remove the "/n" at the end of the last item
-                        new_parts[-1] = str(new_parts[-1]).strip("\n")
-
-                        new_parts.append(segment_hash)  # hash and ranking are added at the end
-                        new_parts.append(ranking)
-                        if args.annotated_output:
-                            if (new_parts[args.scol - 1] != source_sentence or new_parts[args.tcol - 1] != target_sentence.strip("\n")) :
-                                new_parts.append('Yes')
-                            else:
-                                new_parts.append('No')
-                                                        
-                        args.output.write("\t".join(str(v) for v in new_parts) + "\n")  # Convert to strings
-                        # Remove hash, ranking and bifixed for next iterations of loop
-                        new_parts.pop()
-                        new_parts.pop()
-                        if args.annotated_output:
-                            new_parts.pop()
-                    else:
-                        # When no deduplicating:
-                        new_parts[-1] = str(new_parts[-1]).strip("\n")
-                        if args.annotated_output:
-                            if (new_parts[args.scol - 1] != source_sentence or new_parts[args.tcol - 1] != target_sentence.strip("\n")) :
-                                new_parts.append('Yes')
-                            else:
-                                new_parts.append('No')
-                        args.output.write("\t".join(str(v) for v in new_parts) + "\n")
-                        if args.annotated_output:
-                            new_parts.pop()
-                    olines += 1
-                else:
-                    # empty sides after processing
-                    continue
+    def get_hash(self, source_segment, target_segment):
+        if self.aggressive_dedup:
+            normalized_src = unidecode(source_segment.lower().translate(self.remove_non_alpha))
+            normalized_trg = unidecode(target_segment.lower().translate(self.remove_non_alpha))
+
+            segment_hash = xxh64(normalized_src + "\t" + normalized_trg).hexdigest()
 
+            charsum = sum(ord(ch) for ch in source_segment + target_segment)
+            ranking = round(charsum / (float(len(source_segment + target_segment))+0.00001), 2) #the  0.00001 is for the case that length is 0 :D
         else:
-            # source and/or target is empty
-            continue
+            segment_hash = xxh64(source_segment + "\t" + target_segment).hexdigest()
+            ranking = 1
 
+        return segment_hash, ranking
 
-def perform_fixing(args):
-    global ilines
-    global olines
+    def get_band_keys(self, source_segment, target_segment):
+        # Same normalization as aggressive_dedup except unidecode, which would take longer than the MinHash itself:
+        # a few accents only change a few shingles
+        normalized_src = source_segment.lower().translate(self.remove_non_alpha)
+        normalized_trg = target_segment.lower().translate(self.remove_non_alpha)
+        return near_dedup.get_band_keys(normalized_src + "\t" + normalized_trg)
 
-    time_start = default_timer()
-    logging.info("Starting fixing text")
-    fix_sentences(args)
-    logging.info("Text fixing finished")
 
-    # Stats
-    logging.info("Finished")
-    elapsed_time = default_timer() - time_start
-    logging.info("Input lines: {0} rows".format(ilines))
-    logging.info("Output lines: {0} rows".format(olines))
-    logging.info("Elapsed time {0:.2f} s".format(elapsed_time))
-    logging.info("Troughput: {0} rows/s".format(int((ilines * 1.0) / elapsed_time)))
+# Arguments with the columns of the input rows (see rows.RowFormat)
+SENTENCE_COLUMNS = (("scol", "source_segment"), ("tcol", "target_segment"))
+DEFERRED_COLUMNS = ("sdeferredcol", "tdeferredcol")
+PARAGRAPH_COLUMNS = ("sparagraphid", "tparagraphid")
 
-    logging.info("Output file: {0}".format(os.path.abspath(args.output.name)))
+
+def fix_sentences(args):
+    return rows.fix_rows(args, BifixerEngine, SENTENCE_COLUMNS, DEFERRED_COLUMNS, PARAGRAPH_COLUMNS)
 
 
 def main():
     util.logging_setup()
     args = initialization()  # Parsing parameters
     logging.info("Executing main program...")
-    perform_fixing(args)
+    rows.perform_fixing(args, fix_sentences)
+    fileio.close_files(args)
     logging.info("Program finished")
 
 
@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import mmap
+import array
+import heapq
+import struct
+import argparse
+import contextlib
+import collections
+import logging
+import tempfile
+from importlib.metadata import version
+
+from timeit import default_timer
+
+try:
+    from . import util
+    from . import fileio
+except (ImportError, SystemError):
+    import util
+    import fileio
+
+
+def check_column(value):
+    ivalue = int(value)
+    if ivalue == 0:
+        raise argparse.ArgumentTypeError("%s is an invalid column, they start in 1 (or -1 from the end)" % value)
+    return ivalue
+
+
+def initialization():
+    header = "--header" in sys.argv
+
+    logging.info("Processing arguments...")
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Keeps only the row with the highest ranking of each hash of a corpus tagged by Bifixer or Monofixer. "
+                                                 "The rows are split into partitions in temporary files by their hash, so corpora much larger than the memory can be deduplicated")
+
+    # Mandatory parameters
+    parser.add_argument('input', type=str, help="Tab-separated file tagged by bifixer or monofixer, '-' for stdin. gzip, xz and zstd compressed files are detected and decompressed")
+    parser.add_argument('output', type=str, help="Deduplicated corpus, in the same order as the input, '-' for stdout. Compressed if the name ends in .gz, .xz or .zst")
+
+    # Options group
+    groupO = parser.add_argument_group('Optional')
+    groupO.add_argument("--header", action='store_true', help="Input file will have header")
+    groupO.add_argument("--hcol", type=check_column if not header else str, default=-2 if not header else "bifixer_hash", help="Hash column (starting in 1, or in -1 from the end). The name of the field is expected instead of the position if --header is set")
+    groupO.add_argument("--rcol", type=check_column if not header else str, default=-1 if not header else "bifixer_score", help="Ranking column (starting in 1, or in -1 from the end). The name of the field is expected instead of the position if --header is set")
+    groupO.add_argument('--partitions', default=64, type=util.check_positive, help="Number of partitions (temporary files) the rows are split into. Only the hashes of one partition are kept in memory at a time")
+    groupO.add_argument('--tmp_dir', default=tempfile.gettempdir(), help="Temporary directory where creating the temporary files of this program. It needs about as much free space as the uncompressed input")
+    groupO.add_argument('--batch_size', default=1000, type=util.check_positive, help="Number of lines written to the output at once")
+    groupO.add_argument('--compression_level', default=None, type=util.check_positive_or_zero, help="Compression level of the output when it is compressed. If not set, 6 is used for gzip and xz, and 3 for zstd")
+
+    # Logging group
+    groupL = parser.add_argument_group('Logging')
+    groupL.add_argument('-q', '--quiet', action='store_true', help='Silent logging mode')
+    groupL.add_argument('--debug', action='store_true', help='Debug logging mode')
+    groupL.add_argument('--logfile', type=argparse.FileType('a'), default=sys.stderr, help="Store log to a file")
+    groupL.add_argument('-v', '--version', action='version', version="%(prog)s " + version('bifixer'), help="show version of this script and exit")
+
+    # Validating & parsing
+    args = parser.parse_args()
+    fileio.open_files(parser, args)
+    util.logging_setup(args)
+
+    logging.debug("Arguments processed: {}".format(str(args)))
+    logging.info("Arguments processed.")
+
+    return args
+
+
+# Set of 64-bit hashes in an open-addressing table with linear probing, backed by an array of unsigned 64-bit
+# integers (8 bytes per slot instead of the ~100 bytes of each hex string in a Python set). The table doubles when
+# it is 3/4 full. 0 marks the empty slots, so the hash 0 has its own slot after the table, set to 1 when it is added.
+# With a value_type (an array typecode), a value is also kept for each hash in a parallel array.
+class HashSet:
+    def __init__(self, capacity=1 << 16, value_type=None):
+        self.value_type = value_type
+        self.size = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.mask = capacity - 1
+        self.keys = array.array("Q", bytes(8 * (capacity + 1)))
+        if self.value_type:
+            self.values = array.array(self.value_type, bytes(array.array(self.value_type).itemsize * (capacity + 1)))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return self.keys[self.find(key)] != 0
+
+    def __iter__(self):
+        zero_slot = self.mask + 1
+        if self.keys[zero_slot]:
+            yield 0
+        yield from filter(None, self.keys[:zero_slot])
+
+    # Slot of the key, or the empty slot where it would be inserted
+    def find(self, key):
+        if key == 0:
+            return self.mask + 1
+        keys = self.keys
+        mask = self.mask
+        slot = key & mask
+        while True:
+            stored = keys[slot]
+            if stored == key or stored == 0:
+                return slot
+            slot = (slot + 1) & mask
+
+    # Returns the slot of the key and whether it was added (False if it was already in the set)
+    def add(self, key):
+        keys = self.keys
+        mask = self.mask
+        if key == 0:
+            slot = mask + 1
+            if keys[slot]:
+                return slot, False
+            keys[slot] = 1
+            self.size += 1
+            return slot, True
+
+        # Same as find(), inlined as this is called for every row
+        slot = key & mask
+        while True:
+            stored = keys[slot]
+            if stored == key:
+                return slot, False
+            if stored == 0:
+                break
+            slot = (slot + 1) & mask
+        if 4 * (self.size + 1) > 3 * (mask + 1):
+            self.grow()
+            slot = self.find(key)
+        self.keys[slot] = key
+        self.size += 1
+        return slot, True
+
+    def grow(self):
+        keys = self.keys
+        values = self.values if self.value_type else None
+        zero_slot = self.mask + 1
+        self.allocate(2 * zero_slot)
+        for old_slot in range(zero_slot + 1):
+            key = keys[old_slot]
+            if key:
+                slot = self.find(0 if old_slot == zero_slot else key)
+                self.keys[slot] = key
+                if values is not None:
+                    self.values[slot] = values[old_slot]
+
+
+# HashSet stored in a file, so the hashes of earlier runs can be checked without loading them: the file is
+# memory-mapped, and only the slots that are probed are read from disk. The file is the header (magic, capacity and
+# number of hashes) followed by the slots of the table, in the byte order of the machine.
+# update() writes a new file with the new hashes (doubling the table if it would be more than 3/4 full) and replaces
+# the old one at once, so the index is never left half written.
+HASH_INDEX_MAGIC = b"BFXHASH1"
+HASH_INDEX_HEADER = struct.Struct("=8sQQ")
+
+
+class HashIndex(HashSet):
+    def __init__(self, path):
+        self.path = path
+        self.value_type = None
+        self.mmap = None
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.load()
+        else:
+            self.size = 0
+            self.allocate(1 << 16)
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, capacity, self.size = HASH_INDEX_HEADER.unpack_from(mapped) if len(mapped) >= HASH_INDEX_HEADER.size else (None, 0, 0)
+        if magic != HASH_INDEX_MAGIC or len(mapped) != HASH_INDEX_HEADER.size + 8 * (capacity + 1):
+            mapped.close()
+            raise ValueError("{} is not a bifixer hash index".format(self.path))
+        self.mmap = mapped
+        self.mask = capacity - 1
+        self.keys = memoryview(self.mmap)[HASH_INDEX_HEADER.size:].cast("Q")
+
+    def close(self):
+        if self.mmap is not None:
+            self.keys.release()
+            self.mmap.close()
+            self.mmap = None
+
+    # Adds the hashes (a HashSet, or any collection that can be iterated twice) that are not in the index yet,
+    # returning how many of them were added
+    def update(self, hashes):
+        added = sum(1 for key in hashes if key not in self)
+        if not added:
+            return 0
+
+        capacity = self.mask + 1
+        while 4 * (self.size + added) > 3 * capacity:
+            capacity *= 2
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + ".")
+        try:
+            # mkstemp creates the file only readable by its owner
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, os.stat(self.path).st_mode if self.mmap is not None else 0o666 & ~umask)
+            with os.fdopen(fd, "w+b") as f:
+                f.truncate(HASH_INDEX_HEADER.size + 8 * (capacity + 1))
+                with mmap.mmap(f.fileno(), 0) as target:
+                    table = HashSet.__new__(HashSet)
+                    table.value_type = None
+                    table.mask = capacity - 1
+                    table.keys = memoryview(target)[HASH_INDEX_HEADER.size:].cast("Q")
+                    if capacity == self.mask + 1:
+                        # Same table: the slots are copied as they are
+                        table.keys[:] = self.keys
+                        table.size = self.size
+                    else:
+                        table.size = 0
+                        for key in self:
+                            table.add(key)
+                    for key in hashes:
+                        table.add(key)
+                    HASH_INDEX_HEADER.pack_into(target, 0, HASH_INDEX_MAGIC, capacity, table.size)
+                    table.keys.release()
+                    target.flush()
+            self.close()
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.load()
+        return added
+
+
+# Drops the output rows whose hash was already seen. The hash and the ranking are read back from the columns
+# added at the end of each row (before the cluster and the annotation, if any).
+# By default the first row of each hash is kept as soon as it is seen. With keep_best the one with the highest
+# ranking (the first of them if there is a tie) is kept: rows are spilled to a temporary file while only the best
+# ranking of each hash is kept in memory, and the best rows are written at the end by finish().
+# The hashes of a HashIndex count as seen before the first row, and the new ones are added to it by finish()
+# unless update_index is False.
+class Deduplicator:
+    def __init__(self, keep_best=False, annotated=False, tmp_dir=None, batch_size=1000, clustered=False, index=None, update_index=True):
+        self.keep_best = keep_best
+        self.extra_columns = 2 + annotated + clustered
+        self.tmp_dir = tmp_dir
+        self.batch_size = batch_size
+        self.index = index
+        self.update_index = update_index
+        self.hashes = HashSet(value_type="d" if keep_best else None)
+        self.spill = None
+        self.binary = False
+        self.stats = collections.Counter()
+
+    def parse(self, row):
+        fields = row.rsplit(b"\t" if self.binary else "\t", self.extra_columns)
+        return int(fields[1], 16), float(fields[2])
+
+    # Returns the rows that have to be written now
+    def filter(self, rows):
+        if not rows:
+            return rows
+        self.binary = isinstance(rows[0], bytes)
+        self.stats["dedup_rows"] += len(rows)
+
+        if self.index is not None:
+            rows = self.drop_known(rows)
+
+        if not self.keep_best:
+            kept = [row for row in rows if self.hashes.add(self.parse(row)[0])[1]]
+            self.stats["dedup_dropped"] += len(rows) - len(kept)
+            return kept
+
+        for row in rows:
+            key, ranking = self.parse(row)
+            slot, added = self.hashes.add(key)
+            # The values array is replaced when the table grows
+            values = self.hashes.values
+            if added or ranking > values[slot]:
+                values[slot] = ranking
+
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(dir=self.tmp_dir)
+        self.spill.writelines(rows if self.binary else (row.encode("utf-8") for row in rows))
+        return []
+
+    def drop_known(self, rows):
+        index = self.index
+        kept = [row for row in rows if self.parse(row)[0] not in index]
+        self.stats["dedup_known"] += len(rows) - len(kept)
+        self.stats["dedup_dropped"] += len(rows) - len(kept)
+        return kept
+
+    # Writes the rows kept with keep_best and updates the index, returning how many rows were written
+    def finish(self, write):
+        written = self.write_best(write) if self.spill is not None else 0
+        if self.index is not None:
+            if self.update_index:
+                self.stats["hash_index_added"] += self.index.update(self.hashes)
+            self.stats["hash_index_size"] = len(self.index)
+            self.index.close()
+        return written
+
+    def write_best(self, write):
+        self.spill.seek(0)
+        values = self.hashes.values
+        written = 0
+        batch = []
+        for row in self.spill:
+            if not self.binary:
+                row = row.decode("utf-8")
+            key, ranking = self.parse(row)
+            slot = self.hashes.find(key)
+            if values[slot] == ranking:
+                # Later rows with the same ranking are duplicates too
+                values[slot] = float("inf")
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    write(batch)
+                    written += len(batch)
+                    batch = []
+        if batch:
+            write(batch)
+            written += len(batch)
+
+        self.spill.close()
+        self.spill = None
+        self.stats["dedup_dropped"] += self.stats["dedup_rows"] - self.stats["dedup_known"] - written
+        return written
+
+
+def log_dedup_stats(stats):
+    logging.info("Duplicates dropped: {0} of {1} rows ({2:.2f}%)".format(stats["dedup_dropped"], stats["dedup_rows"], 100.0 * stats["dedup_dropped"] / stats["dedup_rows"]))
+    if "hash_index_size" in stats:
+        logging.info("Hash index: {0} rows dropped as already in the index, {1} new hashes added, {2} hashes in the index".format(stats["dedup_known"], stats["hash_index_added"], stats["hash_index_size"]))
+
+
+# Partition of a hash: its top bits, as the low bits choose its slot in the HashSet of the partition
+def get_partition(key, partitions):
+    return (key * partitions) >> 64
+
+
+# Keeps the row with the highest ranking of each hash (the first one if there is a tie), writing the kept rows in
+# the same order as the input. Rows are bytes, and the columns are indexes starting in 0 (negative from the end).
+# 1. Each row is written to the partition of its hash, prefixed by its row number, hash and ranking.
+# 2. Each partition is read twice: first to find the best ranking of each of its hashes, that are kept in a HashSet,
+#    and then to write the best rows to a sorted run.
+# 3. The sorted runs are merged by row number.
+# Only the hashes of one partition are in memory at a time, and each partition is deleted once its run is written,
+# so at most the size of the input plus the size of the output is needed in tmp_dir.
+def dedup_best(rows, write, hash_column, ranking_column, tmp_dir=None, partitions=64, batch_size=1000, first_line=1):
+    stats = collections.Counter()
+    inf = float("inf")
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir, prefix="bifixer-dedup.") as spill_dir, contextlib.ExitStack() as stack:
+        spill_paths = [os.path.join(spill_dir, "partition.{}".format(p)) for p in range(partitions)]
+        spills = [stack.enter_context(open(path, "w+b")) for path in spill_paths]
+
+        for row_num, row in enumerate(rows, first_line):
+            fields = row.split(b"\t")
+            try:
+                key = int(fields[hash_column], 16)
+                ranking = float(fields[ranking_column])
+            except (IndexError, ValueError):
+                logging.error("Wrong hash or ranking column on line " + str(row_num))
+                continue
+            if not row.endswith(b"\n"):
+                row += b"\n"
+            spills[get_partition(key, partitions)].write(b"%d\t%d\t%r\t" % (row_num, key, ranking) + row)
+            stats["dedup_rows"] += 1
+
+        run_paths = []
+        for partition, spill in enumerate(spills):
+            spill.seek(0)
+            best = HashSet(value_type="d")
+            for line in spill:
+                _, key, ranking, _ = line.split(b"\t", 3)
+                slot, added = best.add(int(key))
+                ranking = float(ranking)
+                if added or ranking > best.values[slot]:
+                    best.values[slot] = ranking
+
+            spill.seek(0)
+            run_path = os.path.join(spill_dir, "run.{}".format(partition))
+            with open(run_path, "wb") as run:
+                values = best.values
+                for line in spill:
+                    row_num, key, ranking, row = line.split(b"\t", 3)
+                    slot = best.find(int(key))
+                    if values[slot] == float(ranking):
+                        # Later rows with the same ranking are duplicates too
+                        values[slot] = inf
+                        run.write(row_num + b"\t" + row)
+            run_paths.append(run_path)
+
+            spill.close()
+            os.remove(spill_paths[partition])
+
+        runs = [stack.enter_context(open(path, "rb")) for path in run_paths]
+        batch = []
+        for _, row in heapq.merge(*(read_run(run) for run in runs)):
+            batch.append(row)
+            if len(batch) == batch_size:
+                write(batch)
+                stats["dedup_kept"] += len(batch)
+                batch = []
+        if batch:
+            write(batch)
+            stats["dedup_kept"] += len(batch)
+
+    stats["dedup_dropped"] = stats["dedup_rows"] - stats["dedup_kept"]
+    return stats
+
+
+def read_run(run):
+    for line in run:
+        row_num, row = line.split(b"\t", 1)
+        yield int(row_num), row
+
+
+def get_column(header, column, option):
+    if column not in header:
+        raise Exception(f"The provided {option} '{column}' is not in the input header")
+    return header.index(column)
+
+
+def perform_dedup(args):
+    time_start = default_timer()
+    logging.info("Starting deduplication")
+
+    rows = fileio.read_lines(args.input)
+    first_line = 1
+    if args.header:
+        header_line = next(rows)
+        header = header_line.decode("utf-8").rstrip("\n").split("\t")
+        hash_column = get_column(header, args.hcol, "--hcol")
+        ranking_column = get_column(header, args.rcol, "--rcol")
+        args.output.write(header_line)
+        first_line = 2
+    else:
+        hash_column = args.hcol - 1 if args.hcol > 0 else args.hcol
+        ranking_column = args.rcol - 1 if args.rcol > 0 else args.rcol
+
+    stats = dedup_best(rows, args.output.writelines, hash_column, ranking_column, args.tmp_dir, args.partitions, args.batch_size, first_line)
+
+    logging.info("Deduplication finished")
+    elapsed_time = default_timer() - time_start
+    logging.info("Input lines: {0} rows".format(stats["dedup_rows"]))
+    logging.info("Output lines: {0} rows".format(stats["dedup_kept"]))
+    logging.info("Elapsed time {0:.2f} s".format(elapsed_time))
+    if stats["dedup_rows"]:
+        log_dedup_stats(stats)
+
+    return stats
+
+
+def main():
+    util.logging_setup()
+    args = initialization()  # Parsing parameters
+    logging.info("Executing main program...")
+    perform_dedup(args)
+    fileio.close_files(args)
+    logging.info("Program finished")
+
+
+if __name__ == '__main__':
+    main()  # Running main program
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import collections
+
+from timeit import default_timer
+
+try:
+    from . import util
+    from . import restorative_cleaning
+except (ImportError, SystemError):
+    import util
+    import restorative_cleaning
+
+
+class FixerEngine:
+    # Options and sentence cleaning shared by BifixerEngine and MonofixerEngine, that only differ in how many sentences
+    # they fix at once, and in how they segment and hash them.
+    # Language resources are loaded only once, when the engine is created.
+    defaults = {
+        "ignore_characters": False,
+        "ignore_normalization": False,
+        "ignore_html": False,
+        "ignore_empty": False,
+        "ignore_long": False,
+        "ignore_orthography": False,
+        "ignore_detokenization": False,
+        "ignore_segmentation": False,
+        "words_before_segmenting": 15,
+        "segmenter": "nltk",
+        "dedup": True,
+        "aggressive_dedup": False,
+        "near_dedup": False,
+        "cache_size": 0,
+        "segmentation_cache_size": 10000,
+        "profile": False,
+    }
+    # Arguments with the languages of the engine, in the order the constructor takes them
+    lang_args = ()
+    # Characters stripped from the sentences when their characters are not fixed
+    unfixed_chars = ""
+
+    def __init__(self, **options):
+        unknown = set(options) - set(self.defaults)
+        if unknown:
+            raise TypeError("Unknown {} options: {}".format(type(self).__name__, ", ".join(sorted(unknown))))
+
+        for option, default in self.defaults.items():
+            setattr(self, option, options.get(option, default))
+
+        # Counters of how the sentences were processed, reported at the end
+        self.stats = collections.Counter()
+
+        # Cleaned versions of the last sentences seen, as boilerplate sentences are repeated many times
+        self.cache = util.LRUCache(self.cache_size) if self.cache_size > 0 else None
+
+        if self.dedup and (self.aggressive_dedup or self.near_dedup):
+            self.remove_non_alpha = util.get_remove_non_alpha()
+
+    @classmethod
+    def from_args(cls, args):
+        # Options not present in args take their default value
+        options = {option: getattr(args, option) for option in cls.defaults if hasattr(args, option)}
+        return cls(*(getattr(args, lang) for lang in cls.lang_args), **options)
+
+    def clean_text(self, sentence, profile, stats, side, very_long=False):
+        # Cleans a sentence with the language profile of its side, returning the cleaned text and its number of words
+        # before the orthographic fixes (used to decide whether to segment it). Very long sentences are only normalized
+        if self.cache is not None:
+            key = (profile.lang, sentence)
+            cached = self.cache.get(key)
+            if cached is not None:
+                stats["cache_hit"] += 1
+                return cached
+            stats["cache_miss"] += 1
+
+        if self.profile:
+            fixed, corrected = self.profile_cleaning(sentence, profile, stats, side, very_long)
+        else:
+            if not self.ignore_characters and not very_long:
+                fixed = profile.fix(sentence, stats)
+            else:
+                fixed = sentence.strip(self.unfixed_chars)
+
+            if not self.ignore_html and not very_long:
+                fixed = restorative_cleaning.remove_html_tags(fixed)
+
+            if not self.ignore_normalization:
+                fixed = profile.normalize(fixed)
+
+            if not self.ignore_orthography and not very_long:
+                corrected = profile.ortho_detok_fix(fixed, not self.ignore_detokenization)
+            else:
+                corrected = fixed
+
+        result = (corrected, len(fixed.split()) if not self.ignore_segmentation else 0)
+        if self.cache is not None and self.cache.put(key, result):
+            stats["cache_eviction"] += 1
+
+        return result
+
+    def profile_cleaning(self, sentence, profile, stats, side, very_long):
+        # Same steps as clean_text, profiling each of them (kept apart so they cost nothing when not profiling)
+        if not self.ignore_characters and not very_long:
+            fixed = util.profile_call(stats, "characters", side, profile.fix, sentence, stats, unchanged=util.get_unfixed(sentence))
+        else:
+            fixed = sentence.strip(self.unfixed_chars)
+
+        if not self.ignore_html and not very_long:
+            fixed = util.profile_call(stats, "html", side, restorative_cleaning.remove_html_tags, fixed)
+
+        if not self.ignore_normalization:
+            fixed = util.profile_call(stats, "normalization", side, profile.normalize, fixed)
+
+        if not self.ignore_orthography and not very_long:
+            corrected = util.profile_call(stats, "orthography", side, profile.ortho_detok_fix, fixed, not self.ignore_detokenization)
+        else:
+            corrected = fixed
+
+        return fixed, corrected
+
+    def profile_segmentation(self, side_segmenter, stats, side, sentence):
+        start = default_timer()
+        segments = side_segmenter(sentence, stats)
+        util.profile_stage(stats, "segmentation", side, start, len(segments) > 1)
+        return segments
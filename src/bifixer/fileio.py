@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import gzip
+import lzma
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compressed files: the codec of the input is detected by its magic bytes, the codec of the output by its extension
+COMPRESSION_MAGIC = [(b"\x1f\x8b", "gzip"), (b"\xfd7zXZ\x00", "xz"), (b"\x28\xb5\x2f\xfd", "zstd")]
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".xz": "xz", ".zst": "zstd", ".zstd": "zstd"}
+# Default, minimum and maximum compression level of each codec
+COMPRESSION_LEVELS = {"gzip": (6, 1, 9), "xz": (6, 0, 9), "zstd": (3, 1, 22)}
+IO_CHUNK_SIZE = 1 << 20
+IO_MAX_CHUNKS = 8
+
+
+def check_codec(codec):
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("the zstandard module is needed to read or write zstd files, install it with 'pip install zstandard'")
+
+
+def detect_compression(head):
+    for magic, codec in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+# Reads a binary stream on a background thread, so decompression overlaps with the fixing of the sentences
+class BackgroundReader(io.RawIOBase):
+    def __init__(self, stream, name, close_streams=()):
+        super().__init__()
+        self.stream = stream
+        self.name = name
+        self.close_streams = close_streams
+        self.queue = queue.Queue(IO_MAX_CHUNKS)
+        self.stopped = threading.Event()
+        self.chunk = memoryview(b"")
+        self.eof = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                chunk = self.stream.read(IO_CHUNK_SIZE)
+                self.queue.put(chunk)
+                if not chunk:
+                    break
+        except BaseException as e:
+            self.queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.chunk:
+            if self.eof:
+                return 0
+            item = self.queue.get()
+            if isinstance(item, BaseException):
+                self.eof = True
+                raise item
+            if not item:
+                self.eof = True
+                return 0
+            self.chunk = memoryview(item)
+        n = min(len(b), len(self.chunk))
+        b[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            # Make room in the queue so the thread is not blocked and can see that it has to stop.
+            # When reading from stdin the thread could be waiting for more input, so it is not waited for
+            self.stopped.set()
+            while self.close_streams and self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            if self.close_streams:
+                self.stream.close()
+                for stream in self.close_streams:
+                    stream.close()
+        super().close()
+
+
+# Writes to a binary stream on a background thread, so compression overlaps with the fixing of the sentences
+class BackgroundWriter(io.RawIOBase):
+    def __init__(self, stream, name, close_streams=()):
+        super().__init__()
+        self.stream = stream
+        self.name = name
+        self.close_streams = close_streams
+        self.queue = queue.Queue(IO_MAX_CHUNKS)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                self.stream.write(data)
+        except BaseException as e:
+            self.error = e
+            # Keep consuming the queue, so the writing side is never blocked and gets the error instead
+            while self.queue.get() is not None:
+                pass
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.check_error()
+        data = bytes(b)
+        self.queue.put(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                super().flush()
+                self.queue.put(None)
+                self.thread.join()
+                self.stream.close()
+                for stream in self.close_streams:
+                    stream.close()
+            finally:
+                super().close()
+            self.check_error()
+
+
+# Raw stream that returns the bytes already read from the start of a buffered stream, and then the rest of it.
+# The buffered stream is closed with it only if close_stream is set
+class PrefixedReader(io.RawIOBase):
+    def __init__(self, prefix, stream, close_stream=True):
+        super().__init__()
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+        self.name = getattr(stream, "name", None)
+        self.close_stream = close_stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.prefix:
+            n = min(len(b), len(self.prefix))
+            b[:n] = self.prefix[:n]
+            self.prefix = self.prefix[n:]
+            return n
+        data = self.stream.read1(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed and self.close_stream:
+            self.stream.close()
+        super().close()
+
+
+# Open the input file ("-" for stdin), decompressing it on a background thread if it is compressed.
+# With binary=True the lines are returned as bytes, to be read with read_lines
+def open_input(path, binary=False):
+    if path == "-":
+        buffer = getattr(sys.stdin, "buffer", None)
+        if buffer is None or not hasattr(buffer, "peek"):
+            return sys.stdin
+        raw = buffer
+        close_streams = ()
+    else:
+        raw = open(path, "rb", buffering=IO_CHUNK_SIZE)
+        close_streams = (raw,)
+
+    head = raw.peek(8)[:8]
+    if len(head) < 8:
+        # peek only returns what one read gives, that can be a single byte from a pipe
+        head = raw.read(8)
+        raw = io.BufferedReader(PrefixedReader(head, raw, bool(close_streams)), IO_CHUNK_SIZE)
+        close_streams = (raw,) if close_streams else ()
+
+    codec = detect_compression(head)
+    if codec is None:
+        if binary:
+            return raw
+        if path == "-" and raw is buffer:
+            return sys.stdin
+        return io.TextIOWrapper(raw, encoding="UTF-8")
+
+    try:
+        check_codec(codec)
+    except ValueError:
+        for stream in close_streams:
+            stream.close()
+        raise
+    if codec == "gzip":
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif codec == "xz":
+        stream = lzma.LZMAFile(raw, "rb")
+    else:
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=False)
+
+    reader = io.BufferedReader(BackgroundReader(stream, getattr(raw, "name", path), close_streams), IO_CHUNK_SIZE)
+    if binary:
+        return reader
+    return io.TextIOWrapper(reader, encoding="UTF-8")
+
+
+# Open the output file ("-" for stdout), compressing it on a background thread if its extension is .gz, .xz or .zst
+def open_output(path, compression_level=None, binary=False):
+    if path == "-":
+        return sys.stdout.buffer if binary else sys.stdout
+
+    codec = COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if codec is None:
+        if binary:
+            return open(path, "wb", buffering=IO_CHUNK_SIZE)
+        return open(path, "w", encoding="UTF-8")
+
+    check_codec(codec)
+    default_level, min_level, max_level = COMPRESSION_LEVELS[codec]
+    if compression_level is None:
+        compression_level = default_level
+    elif not min_level <= compression_level <= max_level:
+        raise ValueError("the compression level of {} must be between {} and {}".format(codec, min_level, max_level))
+
+    raw = open(path, "wb")
+    if codec == "gzip":
+        stream = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=compression_level)
+    elif codec == "xz":
+        stream = lzma.LZMAFile(raw, "wb", preset=compression_level)
+    else:
+        stream = zstandard.ZstdCompressor(level=compression_level).stream_writer(raw, closefd=False)
+
+    writer = io.BufferedWriter(BackgroundWriter(stream, path, (raw,)), IO_CHUNK_SIZE)
+    if binary:
+        return writer
+    return io.TextIOWrapper(writer, encoding="UTF-8")
+
+
+# True if the input file was opened in binary mode, so its lines have to be read with read_lines
+def is_binary(f):
+    return isinstance(f, (io.RawIOBase, io.BufferedIOBase))
+
+
+# Read the lines of a binary file without decoding them. The files are opened with a large buffer, so the lines are
+# found in big blocks of bytes. Like in text mode, "\r\n" and "\r" also end a line, and they are returned as "\n"
+def read_lines(input):
+    for line in input:
+        if b"\r" in line:
+            yield from map(normalize_newline, line.splitlines(True))
+        else:
+            yield line
+
+
+def normalize_newline(line):
+    if line.endswith(b"\r\n"):
+        return line[:-2] + b"\n"
+    if line.endswith(b"\r"):
+        return line[:-1] + b"\n"
+    return line
+
+
+# Open the input and output files given as paths in the arguments
+def open_files(parser, args):
+    try:
+        args.input = open_input(args.input, binary=True)
+    except (OSError, ValueError) as e:
+        parser.error("can't open '{}': {}".format(args.input, e))
+    try:
+        args.output = open_output(args.output, args.compression_level, binary=True)
+    except (OSError, ValueError) as e:
+        parser.error("can't open '{}': {}".format(args.output, e))
+
+
+# Close the input and output files, waiting for the background threads to finish the compressed output
+def close_files(args):
+    if args.input not in (sys.stdin, getattr(sys.stdin, "buffer", None)):
+        args.input.close()
+    if args.output in (sys.stdout, getattr(sys.stdout, "buffer", None)):
+        args.output.flush()
+    else:
+        args.output.close()
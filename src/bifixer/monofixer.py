@@ -3,12 +3,10 @@
 import os
 import sys
 import argparse
-import copy
-import traceback
+import functools
 import logging
 from importlib.metadata import version
 
-from unicodedata import category as cat
 from unidecode import unidecode
 from tempfile import gettempdir
 from timeit import default_timer
@@ -16,25 +14,23 @@ from xxhash import xxh64
 
 try:
     from . import util
+    from . import fileio
+    from . import rows
+    from . import engine
+    from . import near_dedup
     from . import restorative_cleaning
     from . import segmenter
 except (ImportError, SystemError):
     import  util    
+    import fileio
+    import rows
+    import engine
+    import near_dedup
     import restorative_cleaning
     import segmenter
 
-# Translate table to remove non alphabetic characters
-tbl = [chr(i) for i in range(sys.maxunicode) if not cat(chr(i)).startswith('L')]
-remove_non_alpha = str.maketrans('', '', ''.join(tbl))
-
 
 def initialization():
-    global ilines
-    global olines
-
-    
-    ilines = 0    
-    olines = 0
     header = "--header" in sys.argv
     
     logging.info("Processing arguments...")
@@ -42,9 +38,9 @@ def initialization():
     
     # Mandatory parameters
     #Input file
-    parser.add_argument('input', type=argparse.FileType('rt', encoding='UTF-8'), default=None, help="Tab-separated file to be fixed")
+    parser.add_argument('input', type=str, help="Tab-separated file to be fixed, '-' for stdin. gzip, xz and zstd compressed files are detected and decompressed")
     #Output file (corpus)
-    parser.add_argument('output', type=argparse.FileType('w', encoding='UTF-8'), default=sys.stdout, help="Fixed corpus")
+    parser.add_argument('output', type=str, help="Fixed corpus, '-' for stdout. Compressed if the name ends in .gz, .xz or .zst")
     #Language
     parser.add_argument("lang", type=str, help="Language of the input")
 
@@ -80,13 +76,29 @@ def initialization():
     groupO.add_argument('--ignore_duplicates', default=False, action='store_true', help="Doesn't obtain the hashes of sentences")    
 
     groupO.add_argument('--aggressive_dedup', default=False, action='store_true', help="Treats similar sentences as duplicates (marking them with the same hash)")
+    groupO.add_argument('--drop_duplicates', default=False, action='store_true', help="Drops the rows whose hash was already seen, instead of only tagging them")
+    groupO.add_argument('--keep_best', default=False, action='store_true', help="With --drop_duplicates, keeps the row with the highest ranking of each hash instead of the first one. Rows are kept in a temporary file until the end")
+    groupO.add_argument('--hash_index', type=str, default=None, help="Index file with the hashes of earlier runs. With --drop_duplicates, the rows whose hash is in the index are dropped too, and the new hashes are added to the index at the end (it is created if it doesn't exist)")
+    groupO.add_argument('--hash_index_readonly', default=False, action='store_true', help="Doesn't add the new hashes to the --hash_index file")
+    groupO.add_argument('--near_dedup', default=False, action='store_true', help="Adds a column with the cluster of near-duplicated sentences of each row (the hash of the first row of the cluster), found with MinHash and LSH over the normalized sentences")
+    groupO.add_argument('--near_dedup_window', default=500000, type=util.check_positive, help="Number of recent rows whose MinHash bands are kept in memory to find the near-duplicates of the next ones (up to twice as many are kept, as the index is dropped in two halves)")
 
     #Segmentation
     groupO.add_argument('--ignore_segmentation' , default=False, action='store_true', help="Doesn't change segmentation of long sentences")
     groupO.add_argument('--words_before_segmenting', default=15, type=util.check_positive, help="Max words allowed in a parallel sentence before trying to segmentate it. Set to 0 to applicate segmentation on everyt33hing.")
-    groupO.add_argument('--segmenter', default="nltk", type=str, choices=["nltk", "loomchild"], help="Segmenter module.")    
+    groupO.add_argument('--segmenter', default="nltk", type=str, choices=["nltk", "loomchild", "regex"], help="Segmenter module. 'regex' is a faster rule-based segmenter that mostly agrees with 'nltk'")    
     groupO.add_argument('--tmp_dir', default=gettempdir(), help="Temporary directory where creating the temporary files of this program")
 
+    #Parallelization
+    groupO.add_argument('--processes', default=1, type=util.check_positive, help="Number of worker processes used to fix the sentences")
+    groupO.add_argument('--threads', default=1, type=util.check_positive, help="Number of threads used to fix the sentences, sharing the language resources. Cannot be combined with --processes")
+    groupO.add_argument('--pipeline', default=False, action='store_true', help="Read the input, fix the sentences and write the output in separate threads connected by bounded queues, so waiting for the input or the output overlaps with the fixing. The time split of each stage is logged at the end")
+    groupO.add_argument('--profile', default=False, action='store_true', help="Print a table with the time, calls and changed sentences of each stage of the fixing at the end")
+    groupO.add_argument('--profile_json', type=str, default=None, help="Write the profile of each stage of the fixing to this JSON file instead of printing it (implies --profile)")
+    groupO.add_argument('--cache_size', default=0, type=util.check_positive_or_zero, help="Number of cleaned sentences kept in memory, so repeated sentences are only cleaned once. Set to 0 to disable the cache")
+    groupO.add_argument('--segmentation_cache_size', default=10000, type=util.check_positive_or_zero, help="Number of segmented sentences kept in memory for each language, so repeated long sentences are only segmented once. Set to 0 to disable the cache")
+    groupO.add_argument('--batch_size', default=1000, type=util.check_positive, help="Number of lines fixed at once, so the long sentences of each batch are segmented together. Batches are sent to the worker processes or threads when using more than one")
+    groupO.add_argument('--compression_level', default=None, type=util.check_positive_or_zero, help="Compression level of the output when it is compressed. If not set, 6 is used for gzip and xz, and 3 for zstd")
 
     # Annotation
     groupO.add_argument('--annotated_output', default=False, action='store_true', help="Adds an extra column indicating if the sentence was modified ('Yes' if it was modified, otherwise 'No')")
@@ -100,6 +112,21 @@ def initialization():
  
     # Validating & parsing
     args = parser.parse_args()
+    if args.processes > 1 and args.threads > 1:
+        parser.error("--processes and --threads cannot be combined")
+    if args.profile_json:
+        args.profile = True
+    if args.drop_duplicates and args.ignore_duplicates:
+        parser.error("--drop_duplicates cannot be combined with --ignore_duplicates")
+    if args.keep_best and not args.drop_duplicates:
+        parser.error("--keep_best requires --drop_duplicates")
+    if args.hash_index and not args.drop_duplicates:
+        parser.error("--hash_index requires --drop_duplicates")
+    if args.hash_index_readonly and not args.hash_index:
+        parser.error("--hash_index_readonly requires --hash_index")
+    if args.near_dedup and args.ignore_duplicates:
+        parser.error("--near_dedup cannot be combined with --ignore_duplicates")
+    fileio.open_files(parser, args)
     util.logging_setup(args)
     args.dedup = not args.ignore_duplicates  #more friendly usage of the ignore_duplicates flag
 
@@ -112,212 +139,128 @@ def initialization():
     return args
 
 
-def fix_sentences(args):
-    if ('ilines' in globals() and 'olines' in globals()):
-        global ilines
-        global olines        
-    else:
-        ilines = 0
-        olines = 0    
-
-    if not args.ignore_characters:
-        chars_lang, charsRe_lang = restorative_cleaning.getCharsReplacements(args.lang)
-
-    if not args.ignore_normalization:
-        punctChars_lang, punctRe_lang = restorative_cleaning.getNormalizedPunctReplacements(args.lang)
-
-    if not args.ignore_orthography:    
-        replacements_lang = restorative_cleaning.getReplacements(args.lang)
-      
-    if not args.ignore_detokenization:
-        detoks_lang = restorative_cleaning.getDetokenizations(args.lang)
-    else:
-        detoks_lang = {}
-        
-    if not args.ignore_segmentation:
-        lang_segmenter = segmenter.NaiveSegmenter(args.lang, args.segmenter)
-
-    if args.header:
-        header = next(args.input).strip().split("\t")
-
-        # Transform fields to idxs
-        if args.scol not in header:
-            raise Exception(f"The provided --scol '{args.scol}' is not in the input header")
-
-        args.scol = int(header.index(args.scol)) + 1
-
-        if args.sdeferredcol:
-            if args.sdeferredcol not in header:
-                raise Exception(f"The provided --sdeferredcol '{args.sdeferredcol}' is not in the input header")
-
-            args.sdeferredcol = int(header.index(args.sdeferredcol)) + 1
-        if args.sparagraphid:
-            if args.sparagraphid not in header:
-                raise Exception(f"The provided --sparagraphid '{args.sparagraphid}' is not in the input header")
-
-            args.sparagraphid = int(header.index(args.sparagraphid)) + 1
-
-        # Write the output header once
-        args.output.write("\t".join(header))
-
-        if args.dedup:
-            args.output.write("\tbifixer_hash\tbifixer_score")
-
-        if args.annotated_output:
-            args.output.write("\tbifixed")
-
-        args.output.write("\n")
-
-    for i in args.input:
-        ilines += 1
-        parts = i.split("\t")
-
-        try:
-            sentence = parts[args.scol-1]
-
-            # Check optional indexes
-            if args.sdeferredcol:
-                parts[args.sdeferredcol-1]
-            if args.sparagraphid:
-                parts[args.sparagraphid-1]
-
-        except IndexError:
-            logging.error(traceback.format_exc())
-            logging.error("Wrong column index on line " + str(ilines))
-            continue
-            
-        very_long = False
+class MonofixerEngine(engine.FixerEngine):
+    # Fixes monolingual sentences in memory, without going through TSV files.
+    # Language resources and the segmenter are loaded only once, when the engine is created.
+    lang_args = ("lang",)
 
-        if not args.ignore_long and (len(sentence) > 5000):
-                very_long = True
+    def __init__(self, lang, **options):
+        super().__init__(**options)
+        self.lang = lang
 
-        if not args.ignore_characters and not very_long:        
-           fixed_sentence = restorative_cleaning.fix(sentence, args.lang, chars_lang, charsRe_lang)
-        else:
-            fixed_sentence = sentence
-
-        if not args.ignore_html and not very_long:
-                fixed_sentence = restorative_cleaning.remove_html_tags(fixed_sentence)
-                
-        if not args.ignore_normalization:
-            fixed_sentence = restorative_cleaning.normalize(fixed_sentence, args.lang, punctChars_lang, punctRe_lang)
-                
-        if not args.ignore_orthography and not very_long:    
-            corrected_sentence = restorative_cleaning.ortho_detok_fix(fixed_sentence, replacements_lang, detoks_lang)
-        else:
-            corrected_sentence = fixed_sentence
-                
-        if not args.ignore_segmentation and (len(fixed_sentence.split()) > args.words_before_segmenting) and not very_long:
-            segments = segmenter.naive_segmenter_mono(lang_segmenter, corrected_sentence) 
+        # Language tables are shared by all the engines of the process
+        self.lang_profile = restorative_cleaning.get_language_profile(lang)
 
+        if not self.ignore_segmentation:
+            self.lang_segmenter = segmenter.NaiveSegmenter(lang, self.segmenter, self.segmentation_cache_size)
+
+    def fix_sentence(self, sentence, stats=None):
+        # Returns the fixed segments of a sentence, as a list of dicts with the "segment" key,
+        # plus "hash" and "ranking" if dedup is enabled, and "bands" (the keys of the MinHash bands of the segment)
+        # if near_dedup is enabled too.
+        # Threads sharing the engine pass their own stats counter.
+        if stats is None:
+            stats = self.stats
+
+        corrected_sentence, long_sentence = self.clean_long_sentence(sentence, stats)
+
+        if long_sentence:
+            if self.lang_segmenter.is_one_segment(corrected_sentence):
+                # The segmenter would return the sentence as it is
+                stats["segmentation_avoided"] += 1
+                segments = [corrected_sentence]
+            elif self.profile:
+                segments = self.profile_segmentation(self.lang_segmenter, stats, "sentence", corrected_sentence)
+            else:
+                segments = segmenter.naive_segmenter_mono(functools.partial(self.lang_segmenter, stats=stats), corrected_sentence)
         else:
-            #keep original segmentation    
+            #keep original segmentation
             segments = [corrected_sentence]
 
-        sent_num = 0        
+        return self.hash_segments(segments, stats)
+
+    def clean_long_sentence(self, sentence, stats):
+        # Cleans a sentence, returning the cleaned text and whether it is long enough to be segmented
+        very_long = False
 
+        if not self.ignore_long and (len(sentence) > 5000):
+            very_long = True
+
+        corrected_sentence, words = self.clean_text(sentence, self.lang_profile, stats, "sentence", very_long)
+        return corrected_sentence, not self.ignore_segmentation and (words > self.words_before_segmenting) and not very_long
+
+    def hash_segments(self, segments, stats):
+        # Drops the empty segments, and adds the hash, ranking and MinHash bands to the rest of them
+        fixed_segments = []
         for segment in segments:
-            if not args.ignore_empty and len(segment) == 0:
+            if not self.ignore_empty and len(segment) == 0:
                 continue
-            if args.dedup:
-                if args.aggressive_dedup:
-                    #normalized_sentence = unidecode.unidecode(segment.lower().replace(" ", "").translate(str.maketrans('', '', string.punctuation+string.digits)))
-                    normalized_sentence = unidecode(segment.lower().translate(remove_non_alpha))
-                    hash = xxh64(normalized_sentence).hexdigest()
-                        
-                    charsum = sum(ord(ch) for ch in segment)
-                    if len(segment) == 0:
-                        ranking = 0.0
-                    else:
-                        ranking = round(charsum/len(segment),2)
-
-                else:
-                    hash = xxh64(segment).hexdigest()
-                    ranking = 1
-            #if  dedupping: Add extra columnsn with hash and ranking in output file
-            #Restored parts object, with the fixed segment, overwritten for each extra segment
-            new_parts = copy.deepcopy(parts)
-            new_parts[args.scol-1] = segment
-            
-            if len(segments) > 1:
-                sent_num += 1
-                if args.sdeferredcol:
-                    if "#" in parts[args.sdeferredcol-1]:
-                        # Reconstruction
-                        if sent_num != int(parts[args.sdeferredcol-1].split('#')[1]):
-                            continue
-                    else:
-                        new_parts[args.sdeferredcol-1] = parts[args.sdeferredcol-1].rstrip("\n")+"#"+str(sent_num)
-
-                if args.sparagraphid:
-                    new_parts[args.sparagraphid-1] = parts[args.sparagraphid-1].rstrip("\n")+"#"+str(sent_num)
-
-            #Remove the "/n" at the end of the last item
-            new_parts[-1]= str(new_parts[-1]).strip("\n")
-
-            # sentence may be empty now because it contained only spaces or similar weird thing
-            # for a sentence containing only spaces but not normalized, strip it
-            if args.ignore_empty or (new_parts[args.scol-1].strip()):
-                if (args.dedup):
-                    new_parts.append(hash) #hash and ranking are added at the end           
-                    new_parts.append(ranking)
-                    
-                    if args.annotated_output:
-                        if (new_parts[args.scol -1].strip("\n") != sentence.strip("\n")):
-                            new_parts.append("Yes")
-                        else:
-                            new_parts.append("No")
-                                
-                    
-                    args.output.write("\t".join(str(v) for v in new_parts)+"\n")  #Convert to strings
-                    #Remove hash and ranking for next iterations of loop
-                    new_parts.pop()
-                    new_parts.pop()
-                    if args.annotated_output:
-                        new_parts.pop()
-                else:                   
-                    #When no deduplicating:
-                    if args.annotated_output:
-                        if (new_parts[args.scol -1].strip("\n") != sentence.strip("\n")):
-                            new_parts.append("Yes")
-                        else:
-                            new_parts.append("No")
-                    args.output.write("\t".join(str(v) for v in new_parts)+"\n")
-                    if args.annotated_output:
-                        new_parts.pop()
-                olines += 1
+            fixed_segment = {"segment": segment}
+            if self.dedup:
+                if self.profile:
+                    start = default_timer()
+                fixed_segment["hash"], fixed_segment["ranking"] = self.get_hash(segment)
+                if self.near_dedup:
+                    fixed_segment["bands"] = self.get_band_keys(segment)
+                if self.profile:
+                    util.profile_stage(stats, "hash", "sentence", start, False)
+            fixed_segments.append(fixed_segment)
+
+        return fixed_segments
+
+    def fix_batch(self, sentences, stats=None):
+        # Fixes an iterable of sentences, returning the list of segments of each sentence.
+        # The long sentences of the batch are segmented together with naive_segmenter_mono_batch, unless profiling,
+        # as the segmentation is timed apart then.
+        if stats is None:
+            stats = self.stats
+        if self.ignore_segmentation or self.profile:
+            return [self.fix_sentence(sentence, stats) for sentence in sentences]
+
+        cleaned = [self.clean_long_sentence(sentence, stats) for sentence in sentences]
+        long_sentences = [corrected_sentence for corrected_sentence, long_sentence in cleaned if long_sentence]
+        segmented = iter(segmenter.naive_segmenter_mono_batch(self.lang_segmenter, long_sentences, stats))
+        return [self.hash_segments(next(segmented) if long_sentence else [corrected_sentence], stats) for corrected_sentence, long_sentence in cleaned]
+
+    def get_hash(self, segment):
+        if self.aggressive_dedup:
+            #normalized_sentence = unidecode.unidecode(segment.lower().replace(" ", "").translate(str.maketrans('', '', string.punctuation+string.digits)))
+            normalized_sentence = unidecode(segment.lower().translate(self.remove_non_alpha))
+            hash = xxh64(normalized_sentence).hexdigest()
+
+            charsum = sum(ord(ch) for ch in segment)
+            if len(segment) == 0:
+                ranking = 0.0
             else:
-                #empty sentence after processing
-                continue    
-                    
-          
-            
-def perform_fixing(args):
-    global ilines
-    global olines
-    
-    
-    time_start=default_timer()
-    logging.info("Starting fixing text")    
-    fix_sentences(args)
-    logging.info("Text fixing finished")
+                ranking = round(charsum/len(segment),2)
+        else:
+            hash = xxh64(segment).hexdigest()
+            ranking = 1
 
-    # Stats
-    logging.info("Finished")
-    elapsed_time = default_timer() - time_start
-    logging.info("Input lines: {0} rows".format(ilines))
-    logging.info("Output lines: {0} rows".format(olines))
-    logging.info("Elapsed time {0:.2f} s".format(elapsed_time))
-    logging.info("Troughput: {0} rows/s".format(int((ilines*1.0)/elapsed_time)))
+        return hash, ranking
+
+    def get_band_keys(self, segment):
+        # Same normalization as aggressive_dedup except unidecode, which would take longer than the MinHash itself:
+        # a few accents only change a few shingles
+        return near_dedup.get_band_keys(segment.lower().translate(self.remove_non_alpha))
+
+
+# Arguments with the columns of the input rows (see rows.RowFormat)
+SENTENCE_COLUMNS = (("scol", "segment"),)
+DEFERRED_COLUMNS = ("sdeferredcol",)
+PARAGRAPH_COLUMNS = ("sparagraphid",)
+
+
+def fix_sentences(args):
+    return rows.fix_rows(args, MonofixerEngine, SENTENCE_COLUMNS, DEFERRED_COLUMNS, PARAGRAPH_COLUMNS)
 
-    logging.info("Output file: {0}".format(os.path.abspath(args.output.name)))
 
-    
 def main():
     util.logging_setup()
     args = initialization() # Parsing parameters
     logging.info("Executing main program...")
-    perform_fixing(args)
+    rows.perform_fixing(args, fix_sentences)
+    fileio.close_files(args)
     logging.info("Program finished")    
 
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import array
+import logging
+import collections
+
+from xxhash import xxh64_intdigest
+
+try:
+    from . import dedup
+except (ImportError, SystemError):
+    import dedup
+
+
+# Near-duplicates: MinHash signatures of the shingles (5 bytes long) of the normalized sentences, grouped with LSH
+# banding. The signature uses one permutation hashing: each shingle is hashed only once and falls in one of the bins,
+# that keeps the minimum hash of its shingles. Empty bins (in short sentences) borrow the value of the next non-empty
+# bin. Two rows share a band key with probability 1 - (1 - J^ROWS)^BANDS for a Jaccard similarity J of their shingles
+# (about 0.98 for J = 0.8, 0.84 for J = 0.7, 0.27 for J = 0.5 and 0.02 for J = 0.3).
+NEAR_DEDUP_SHINGLE = 5
+NEAR_DEDUP_BANDS = 10
+NEAR_DEDUP_ROWS = 5
+NEAR_DEDUP_BINS = NEAR_DEDUP_BANDS * NEAR_DEDUP_ROWS
+EMPTY_BIN = 1 << 64
+BORROWED_BIN = 0x9e3779b97f4a7c15
+
+
+# Returns the key of each band of the MinHash signature of a normalized text
+def get_band_keys(text):
+    n = NEAR_DEDUP_SHINGLE
+    data = text.encode("utf-8")
+    bins = [EMPTY_BIN] * NEAR_DEDUP_BINS
+    for shingle_hash in map(xxh64_intdigest, [data[i:i + n] for i in range(max(len(data) - n, 0) + 1)]):
+        b = shingle_hash % NEAR_DEDUP_BINS
+        if shingle_hash < bins[b]:
+            bins[b] = shingle_hash
+
+    if EMPTY_BIN in bins:
+        filled = bins.copy()
+        for b in range(NEAR_DEDUP_BINS):
+            distance = 1
+            while bins[b] == EMPTY_BIN:
+                borrowed = filled[(b + distance) % NEAR_DEDUP_BINS]
+                if borrowed != EMPTY_BIN:
+                    # Mixed with the distance, so a borrowed value doesn't match the same value in its own bin
+                    bins[b] = (borrowed + distance * BORROWED_BIN) & (EMPTY_BIN - 1)
+                distance += 1
+
+    band_size = 8 * NEAR_DEDUP_ROWS
+    signature = array.array("Q", bins).tobytes()
+    return [xxh64_intdigest(signature[band * band_size:(band + 1) * band_size], band) for band in range(NEAR_DEDUP_BANDS)]
+
+
+# Assigns each output row to a cluster of near-duplicates, in a streaming LSH index kept in the main process.
+# Rows come with the band keys of their signature in the cluster column (after the hash and the ranking, and before
+# the annotation, if any), and the column is replaced by the cluster id: the hash of the first row of the cluster.
+# A row joins the cluster of the first of its bands that was already seen, otherwise it starts its own cluster.
+# The index maps band keys to clusters in two generations of HashSets, so memory is bounded: once the current one
+# holds the bands of window rows it becomes the previous one, and the oldest one is dropped. Bands found only in
+# the previous generation are copied to the current one, so the clusters that keep appearing are never forgotten.
+class ClusterIndex:
+    def __init__(self, annotated=False, window=500000):
+        self.extra_columns = 4 if annotated else 3
+        self.max_keys = window * NEAR_DEDUP_BANDS
+        self.current = dedup.HashSet(value_type="Q")
+        self.previous = None
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def lookup(generation, band_key):
+        if generation is None:
+            return None
+        slot = generation.find(band_key)
+        return generation.values[slot] if generation.keys[slot] else None
+
+    def get_cluster(self, row_hash, band_keys):
+        current = self.current
+        cluster = None
+        new_keys = []
+        for band_key in band_keys:
+            slot, added = current.add(band_key)
+            if not added:
+                found = current.values[slot]
+            else:
+                # The band may belong to a cluster in the previous generation
+                found = self.lookup(self.previous, band_key)
+                if found is None:
+                    new_keys.append(band_key)
+                    continue
+                current.values[slot] = found
+            if cluster is None:
+                cluster = found
+
+        if cluster is None:
+            cluster = row_hash
+        else:
+            self.stats["near_dedup_joined"] += 1
+        # Slots may have moved if the table grew while adding the bands
+        for band_key in new_keys:
+            current.values[current.find(band_key)] = cluster
+
+        if len(current) >= self.max_keys:
+            self.previous = current
+            self.current = dedup.HashSet(value_type="Q")
+            self.stats["near_dedup_rotations"] += 1
+
+        return cluster
+
+    # Returns the rows with their cluster id
+    def assign(self, rows):
+        if not rows:
+            return rows
+        binary = isinstance(rows[0], bytes)
+        separator = b"\t" if binary else "\t"
+        comma = b"," if binary else ","
+        self.stats["near_dedup_rows"] += len(rows)
+
+        clustered = []
+        for row in rows:
+            fields = row[:-1].rsplit(separator, self.extra_columns)
+            band_keys = [int(band_key, 16) for band_key in fields[3].split(comma)]
+            cluster = "{:016x}".format(self.get_cluster(int(fields[1], 16), band_keys))
+            fields[3] = cluster.encode("ascii") if binary else cluster
+            clustered.append(separator.join(fields) + row[-1:])
+        return clustered
+
+
+def log_near_dedup_stats(stats):
+    logging.info("Near-duplicates: {0} of {1} rows joined the cluster of an earlier row ({2:.2f}%)".format(stats["near_dedup_joined"], stats["near_dedup_rows"], 100.0 * stats["near_dedup_joined"] / stats["near_dedup_rows"]))
@@ -0,0 +1,66 @@
+# Non-breaking prefixes for the regex segmenter: a period after one of these words does not end a sentence.
+# Prefixes marked with #NUMERIC_ONLY# only do so when the next word is a number.
+# Single uppercase letters (initials) and acronyms like U.S. never end a sentence, so they are not listed.
+Dr
+Ing
+Mgr
+Bc
+JUDr
+MUDr
+MVDr
+PhDr
+RNDr
+PaedDr
+ThDr
+doc
+prof
+Prof
+gen
+plk
+pplk
+kpt
+por
+atd
+apod
+cca
+čj
+čp
+ev
+hod
+i.e
+kap
+min
+mj
+např
+odd
+popř
+r
+resp
+roč
+sb
+st
+str
+sv
+tj
+tzv
+ul
+vč
+zejm
+led
+únor
+břez
+dub
+květ
+červ
+čvc
+srp
+zář
+říj
+list
+pros
+č #NUMERIC_ONLY#
+Č #NUMERIC_ONLY#
+čl #NUMERIC_ONLY#
+Čl #NUMERIC_ONLY#
+odst #NUMERIC_ONLY#
+s #NUMERIC_ONLY#
@@ -0,0 +1,26 @@
+# Non-breaking prefixes for the regex segmenter: a period after one of these words does not end a sentence.
+# Prefixes marked with #NUMERIC_ONLY# only do so when the next word is a number.
+# Single uppercase letters (initials) and acronyms like U.S. never end a sentence, so they are not listed.
+κ
+κα
+Κ
+Κα
+Δρ
+Καθ
+Αγ
+Οδ
+Λεωφ
+π.χ
+δηλ
+βλ
+κλπ
+κ.λπ
+κ.ά
+κ.τ.λ
+τηλ
+εκ
+χλμ
+αι
+αρ #NUMERIC_ONLY#
+Αρ #NUMERIC_ONLY#
+σελ #NUMERIC_ONLY#
@@ -0,0 +1,82 @@
+# Non-breaking prefixes for the regex segmenter: a period after one of these words does not end a sentence.
+# Prefixes marked with #NUMERIC_ONLY# only do so when the next word is a number.
+# Single uppercase letters (initials) and acronyms like U.S. never end a sentence, so they are not listed.
+Sr
+Sra
+Sres
+Sras
+Srta
+Srtas
+Dr
+Dra
+Dres
+Dras
+Lic
+Lda
+Ldo
+Ing
+Prof
+Profa
+Arq
+Excmo
+Excma
+Ilmo
+Ilma
+Rvdo
+Mons
+Gral
+Cnel
+Tte
+Sto
+Sta
+Dña
+Dª
+Vd
+Vds
+Ud
+Uds
+D
+etc
+aprox
+pág
+págs
+cap
+caps
+vol
+vols
+ed
+eds
+núms
+tel
+fig
+figs
+av
+avda
+Av
+Avda
+c/
+cía
+Cía
+S.A
+Ltda
+ej
+p.ej
+ene
+feb
+abr
+may
+jun
+jul
+ago
+sep
+sept
+oct
+nov
+dic
+No #NUMERIC_ONLY#
+Nº #NUMERIC_ONLY#
+art #NUMERIC_ONLY#
+Art #NUMERIC_ONLY#
+núm #NUMERIC_ONLY#
+Núm #NUMERIC_ONLY#
+pp #NUMERIC_ONLY#
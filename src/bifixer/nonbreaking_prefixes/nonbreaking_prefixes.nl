@@ -0,0 +1,57 @@
+# Non-breaking prefixes for the regex segmenter: a period after one of these words does not end a sentence.
+# Prefixes marked with #NUMERIC_ONLY# only do so when the next word is a number.
+# Single uppercase letters (initials) and acronyms like U.S. never end a sentence, so they are not listed.
+Dhr
+Mevr
+Mw
+Mej
+Dr
+Drs
+Ir
+Ing
+Mr
+Prof
+Ds
+St
+Jhr
+Jkvr
+Bc
+bijv
+bv
+ca
+cf
+dwz
+e.d
+enz
+evt
+etc
+fig
+incl
+m.a.w
+mevr
+nl
+o.a
+resp
+t.a.v
+t.o.v
+vgl
+zgn
+jan
+feb
+mrt
+apr
+jun
+jul
+aug
+sep
+sept
+okt
+nov
+dec
+Nr #NUMERIC_ONLY#
+nr #NUMERIC_ONLY#
+Art #NUMERIC_ONLY#
+art #NUMERIC_ONLY#
+blz #NUMERIC_ONLY#
+p #NUMERIC_ONLY#
+pp #NUMERIC_ONLY#
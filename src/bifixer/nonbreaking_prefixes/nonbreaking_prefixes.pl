@@ -0,0 +1,86 @@
+# Non-breaking prefixes for the regex segmenter: a period after one of these words does not end a sentence.
+# Prefixes marked with #NUMERIC_ONLY# only do so when the next word is a number.
+# Single uppercase letters (initials) and acronyms like U.S. never end a sentence, so they are not listed.
+Dr
+Drs
+Hab
+Inż
+Mgr
+Lic
+Prof
+Doc
+Gen
+Kpt
+Płk
+Por
+Ppłk
+Ks
+Abp
+Bp
+O
+Sz
+św
+Św
+al
+ang
+art
+bm
+cdn
+cyt
+dn
+ds
+dz
+etc
+gr
+im
+inż
+itd
+itp
+jw
+kl
+lic
+m.in
+min
+mjr
+mln
+mld
+nb
+np
+ok
+op
+pkt
+por
+pt
+ryc
+rys
+tj
+tzn
+tzw
+ul
+ur
+wg
+woj
+wyd
+zob
+stycz
+luty
+lut
+mar
+kwiet
+kw
+maj
+czerw
+lip
+sierp
+wrz
+paźdz
+paź
+listop
+lis
+grudz
+gru
+nr #NUMERIC_ONLY#
+Nr #NUMERIC_ONLY#
+s #NUMERIC_ONLY#
+str #NUMERIC_ONLY#
+poz #NUMERIC_ONLY#
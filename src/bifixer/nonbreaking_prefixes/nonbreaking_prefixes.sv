@@ -0,0 +1,64 @@
+# Non-breaking prefixes for the regex segmenter: a period after one of these words does not end a sentence.
+# Prefixes marked with #NUMERIC_ONLY# only do so when the next word is a number.
+# Single uppercase letters (initials) and acronyms like U.S. never end a sentence, so they are not listed.
+Hr
+Fru
+Frk
+Dr
+Prof
+Doc
+Fil
+Kand
+Lic
+Mag
+Gen
+Kapt
+Lt
+St
+Sthlm
+bl.a
+ca
+d.v.s
+dvs
+el
+etc
+ev
+f.d
+f.ö
+fr.o.m
+ggr
+inkl
+jfr
+kl
+m.fl
+m.m
+mfl
+mm
+obs
+osv
+pga
+resp
+s.k
+sk
+st
+t.ex
+tex
+t.o.m
+tel
+jan
+feb
+mar
+apr
+jun
+jul
+aug
+sep
+sept
+okt
+nov
+dec
+nr #NUMERIC_ONLY#
+Nr #NUMERIC_ONLY#
+s #NUMERIC_ONLY#
+S #NUMERIC_ONLY#
+kap #NUMERIC_ONLY#
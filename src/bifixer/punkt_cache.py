@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+import logging
+
+from timeit import default_timer
+
+try:
+    from . import util
+    from . import segmenter
+except (ImportError, SystemError):
+    import util
+    import segmenter
+
+
+# Languages with Punkt parameters of their own
+PUNKT_LANGS = ["cs", "da", "de", "el", "en", "es", "et", "fi", "fr", "it", "nb", "nl", "pl", "pt", "ru", "sl", "sv", "tr"]
+
+
+def initialization():
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]), formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Writes the Punkt parameters of the NLTK segmenter to the cache directory ({}, set BIFIXER_CACHE_DIR to change it), "
+                                                 "so Bifixer and Monofixer load them from there. Copy the directory to workers without NLTK data or internet".format(util.get_cache_dir()))
+    parser.add_argument('langs', nargs='*', default=PUNKT_LANGS, help="Languages (two-letter codes). The English parameters are used for the languages without their own")
+
+    groupL = parser.add_argument_group('Logging')
+    groupL.add_argument('-q', '--quiet', action='store_true', help='Silent logging mode')
+    groupL.add_argument('--debug', action='store_true', help='Debug logging mode')
+    groupL.add_argument('--logfile', type=argparse.FileType('a'), default=sys.stderr, help="Store log to a file")
+
+    args = parser.parse_args()
+    util.logging_setup(args)
+    return args
+
+
+def main():
+    util.logging_setup()
+    args = initialization()
+    for langname in sorted(set(segmenter.NLTKSegmenter.getLanguageName(lang.lower()) for lang in args.langs)):
+        start = default_timer()
+        cache_file = segmenter.get_punkt_cache_file(langname)
+        # Always read from the NLTK data, so outdated cache files are replaced
+        util.save_cache_file(cache_file, segmenter.dump_punkt_parameters(segmenter.load_punkt_tab(langname)))
+        if not os.path.exists(cache_file):
+            sys.exit("Unable to write {}".format(cache_file))
+        logging.info("Punkt parameters for '{}' written to {} in {:.3f} seconds".format(langname, cache_file, default_timer() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,18 +5,28 @@ import os
 import regex
 import re
 import html
+import unicodedata
+import functools
 
-global_chars_lang = {}
+try:
+    from ftfy.badness import is_bad
+except ImportError:
+    # Without ftfy's mojibake detector, only ASCII sentences can take the fast path
+    def is_bad(text):
+        return True
 
-chars3Re = regex.compile("[\uE000-\uFFFF]")
-chars3Re2 = regex.compile("[\u2000-\u200F]")
-chars3Re3 = regex.compile("\u007F|[\u0080-\u009F]")
-chars3_nbsp = regex.compile("\u00A0")
 quotesRegex = regex.compile("(?P<start>[[:alpha:]])\'\'(?P<end>(s|S|t|T|m|M|d|D|re|RE|ll|LL|ve|VE|em|EM)\W)")
 collapse_spaced_entities = regex.compile('([&][ ]*[#][ ]*)([0-9]{2,6})([ ]*[;])')
+ortho_separator_regex = regex.compile(r"([^-'[:alpha:]]+)")
 html_tags_regex = re.compile('<.*?>') 
 remove_tabs_endlines = str.maketrans({k:' ' for k in '\r\n\t'})
 
+# Characters that some step of fix() may change: HTML entities, control characters (C0 except tab and newline,
+# DEL and C1), line and paragraph separators, surrogates, and the format characters that ftfy removes
+fix_unsafe_chars = "&\x00-\x08\x0b-\x1f\x7f-\x9f\u2028\u2029\ud800-\udfff\u206a-\u206f\ufeff\ufff9-\ufffc"
+# Fullwidth and halfwidth forms, and the ideographic space, changed by ftfy when fixing character width
+fix_width_chars = "\u3000\uff01-\uffef"
+
 #https://en.wikipedia.org/wiki/CJK_Symbols_and_Punctuation
 cjk_langs = [
     "ja", #japanese
@@ -25,62 +35,61 @@ cjk_langs = [
     "zh-hant" #traditional chinese
 ]
 
-def getCharsReplacements(lang):
-    # languages that use cyrillic alphabet
-    # Check https://www.tug.org/TUGboat/tb17-2/tb51pisk.pdf and/or
-    # https://www.quora.com/Which-languages-are-written-in-Cyrillic-script
-    # for a comprehensive list
-    # Some of the langs does accept both cyrillic and latin, or is migrating to latin
-    cyrillic_langs = [
-        "ab",  # abkhazian
-        "av",  # avar/avaric
-        "az",  # azerbaijani
-        "ba",  # bashkir
-        "be",  # belarusian
-        "bg",  # bulgarian
-        "bs",  # bosnian
-        "ce",  # chechen
-        "cnr", # montenegrin
-        "cv",  # chuvash
-        "hbs", # serbo-croatian
-        "hbs_cyrillic", # serbo-croatian
-        "hbs_latin", # serbo-croatian latin as it can contain cyrillic we don't want to replace
-        "kk",  # kazakh
-        "ku",  # kurdish
-        "kv",  # komi
-        "ky",  # kirghiz/kyrgyz
-        "me",  # montenegrin
-        "mk",  # macedonian
-        "mn",  # mongolian
-        "os",  # ossetic/ossetian
-        "ru",  # russian
-        "sr",  # serbian
-        "tg",  # tajik/tadzhik
-        "tk",  # turkmen
-        "tt",  # tatar
-        "ug",  # uighur
-        "uk",  # ukranian
-        "uz"  # uzbek
-    ]
-
-    # https://en.wikipedia.org/wiki/Caron
-    # http://diacritics.typo.cz/index.php?id=5
-    langs_with_carons = [
-        "cs",  # czech
-        "et",  # estonian
-        "fi",  # finnish
-        "hr",  # croatian
-        "ln",  # lingala
-        "lt",  # lithuanian
-        "lv",  # latvian
-        "sk",  # slovak
-        "sl",  # slovenian
-        "sr",  # serbian
-        "yo"  # yoruba
-    ]
-    
+# languages that use cyrillic alphabet
+# Check https://www.tug.org/TUGboat/tb17-2/tb51pisk.pdf and/or
+# https://www.quora.com/Which-languages-are-written-in-Cyrillic-script
+# for a comprehensive list
+# Some of the langs does accept both cyrillic and latin, or is migrating to latin
+cyrillic_langs = [
+    "ab",  # abkhazian
+    "av",  # avar/avaric
+    "az",  # azerbaijani
+    "ba",  # bashkir
+    "be",  # belarusian
+    "bg",  # bulgarian
+    "bs",  # bosnian
+    "ce",  # chechen
+    "cnr", # montenegrin
+    "cv",  # chuvash
+    "hbs", # serbo-croatian
+    "hbs_cyrillic", # serbo-croatian
+    "hbs_latin", # serbo-croatian latin as it can contain cyrillic we don't want to replace
+    "kk",  # kazakh
+    "ku",  # kurdish
+    "kv",  # komi
+    "ky",  # kirghiz/kyrgyz
+    "me",  # montenegrin
+    "mk",  # macedonian
+    "mn",  # mongolian
+    "os",  # ossetic/ossetian
+    "ru",  # russian
+    "sr",  # serbian
+    "tg",  # tajik/tadzhik
+    "tk",  # turkmen
+    "tt",  # tatar
+    "ug",  # uighur
+    "uk",  # ukranian
+    "uz"  # uzbek
+]
+
+# https://en.wikipedia.org/wiki/Caron
+# http://diacritics.typo.cz/index.php?id=5
+langs_with_carons = [
+    "cs",  # czech
+    "et",  # estonian
+    "fi",  # finnish
+    "hr",  # croatian
+    "ln",  # lingala
+    "lt",  # lithuanian
+    "lv",  # latvian
+    "sk",  # slovak
+    "sl",  # slovenian
+    "sr",  # serbian
+    "yo"  # yoruba
+]
 
 
+def getCharsReplacements(lang):
     # Annoying characters, common for all languages
     chars = {
         # unicode ligatures
@@ -627,11 +636,69 @@ def getCharsReplacements(lang):
         chars["'"] = '\uFF40'  # ｀
         '''
 
-    charsRe = re.compile("(\\" + '|\\'.join(chars.keys()) + ")")
+    charsRe = CharsReplacer(chars)
 
     return chars, charsRe
 
 
+# Builds a regex that matches any of the keys, with the keys merged as a trie, so that
+# it never has to try more than one alternative for each character
+def trie_regex(keys):
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1:
+            body = alternatives[0]
+        else:
+            body = "(?:" + "|".join(alternatives) + ")"
+        if "" in node:
+            # A key ends here: the longer keys are tried first, the greedy "?" falls back to it
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+# Replaces all the keys of a replacements table in a single pass over the text, with a regex
+# that merges the keys as a trie and no Python callback for each match. Gives the same result
+# as the alternation of all the keys, where the first key in the table wins when several of
+# them match at the same position.
+class CharsReplacer:
+    def __init__(self, chars):
+        self.chars = chars
+        keys = []
+        for key in chars:
+            # Keys after a shorter key that is their prefix would never match
+            if not any(key[:i] in keys for i in range(1, len(key))):
+                keys.append(key)
+        # The trie tries the longest key first, which is the first one in the table now
+        self.trie_pattern = re.compile("(" + trie_regex(keys) + ")")
+        # Patterns of build_fix_unsafe_pattern for this table, built the first time fix() needs them
+        self.fix_unsafe_patterns = {}
+
+    def replace(self, text):
+        parts = self.trie_pattern.split(text)
+        if len(parts) == 1:
+            return text
+        # Matches are at the odd positions
+        parts[1::2] = [self.chars[match] for match in parts[1::2]]
+        return "".join(parts)
+
+    def get_fix_unsafe_pattern(self, is_cjk):
+        pattern = self.fix_unsafe_patterns.get(is_cjk)
+        if pattern is None:
+            pattern = self.fix_unsafe_patterns[is_cjk] = build_fix_unsafe_pattern(is_cjk, self.chars)
+        return pattern
+
+
 def getNormalizedPunctReplacements(lang):
     if lang.lower() == "fr":
         replacements = {
@@ -672,84 +739,159 @@ def getNormalizedPunctReplacements(lang):
         del replacements[' ...']
         del replacements[' :']
 
-    rep = dict((re.escape(k), v) for k, v in replacements.items())
-    pattern = re.compile("|".join(rep.keys()))
-    return rep, pattern
+    return replacements, CharsReplacer(replacements)
 
 
 # Orthographic corrections
 def getReplacements(lang):
     replacements = {}
-    input_replacements = None
 
     if lang.lower() in ["da", "de", "en", "es", "nb", "nl", "pt", "tr"]:
-        input_replacements = open(os.path.dirname(os.path.realpath(__file__)) + "/replacements/replacements." + lang.lower(), "r")
-
-    if input_replacements is not None:
-        for i in input_replacements:
-            field = i.split(u"\t")
-            replacements[field[0]] = field[1].rstrip("\n")
+        with open(os.path.dirname(os.path.realpath(__file__)) + "/replacements/replacements." + lang.lower(), "r") as input_replacements:
+            for i in input_replacements:
+                field = i.split(u"\t")
+                replacements[field[0]] = field[1].rstrip("\n")
 
     return replacements
 
 # Detokenization corrections
 def getDetokenizations(lang):
     detoks = {}
-    input_detoks = None
 
     if lang.lower() in ["mt"]:
-        input_detoks = open(os.path.dirname(os.path.realpath(__file__)) + "/detok/detok." + lang.lower(), "r")
-
-    if input_detoks is not None:
-        for i in input_detoks:
-            fields = i.rstrip('\n').split('\t')
-            detoks[fields[0]] = tuple(fields[1:])
+        with open(os.path.dirname(os.path.realpath(__file__)) + "/detok/detok." + lang.lower(), "r") as input_detoks:
+            for i in input_detoks:
+                fields = i.rstrip('\n').split('\t')
+                detoks[fields[0]] = tuple(fields[1:])
 
     return detoks
 
-def replace_chars(match):
-    global global_chars_lang
-    char = match.group(0)
-    return global_chars_lang[char]
 
+# Everything the cleaning functions need to know about a language: its flags and all its tables,
+# built only once. Use get_language_profile() to share them between engines and calls.
+class LanguageProfile:
+    def __init__(self, lang):
+        self.lang = lang
+        self.is_cjk = lang.lower() in cjk_langs
+        self.is_cyrillic = lang.lower() in cyrillic_langs
+        self.has_carons = lang.lower() in langs_with_carons
+
+        self.chars, self.chars_pattern = getCharsReplacements(lang)
+        self.punct_rep, self.punct_pattern = getNormalizedPunctReplacements(lang)
+        self.replacements = getReplacements(lang)
+        self.detoks = getDetokenizations(lang)
+
+        self.fix_unsafe_pattern = self.chars_pattern.get_fix_unsafe_pattern(self.is_cjk)
+        self.normalize_pattern, self.normalize_table = get_normalize_table(self.is_cjk)
+
+    def fix(self, text, stats=None):
+        return fix_text(text, self.is_cjk, self.chars_pattern, self.fix_unsafe_pattern, stats)
+
+    def normalize(self, text):
+        return normalize_text(text, self.normalize_pattern, self.normalize_table, self.punct_pattern)
 
-def replace_chars3(match):
-    char = match.group(0)
-    return ""
+    def ortho_detok_fix(self, text, detokenize=True):
+        return ortho_detok_fix(text, self.replacements, self.detoks if detokenize else {})
 
-def replace_with_space(match):
-    char = match.group(0)
-    return " "
 
+@functools.lru_cache(maxsize=None)
+def get_language_profile(lang):
+    return LanguageProfile(lang)
 
-def fix(text, lang, chars_rep, chars_pattern):
-    global global_chars_lang
-    global_chars_lang = chars_rep
+
+# Pattern matching any character that would make fix() change a sentence, for a replacements table
+def build_fix_unsafe_pattern(is_cjk, chars):
+    unsafe_chars = fix_unsafe_chars
+    if not is_cjk:
+        unsafe_chars += fix_width_chars
+    # Any replacement starts with one of these characters
+    unsafe_chars += "".join(sorted(set(re.escape(k[0]) for k in chars)))
+    return re.compile("[" + unsafe_chars + "]")
+
+
+def is_fixed_text(text, fix_unsafe_pattern):
+    # Cheap check for sentences that fix() would leave unchanged (besides tabs and newlines, that become spaces):
+    # no HTML entities, control characters or characters from the replacements table,
+    # and either pure ASCII or NFC without mojibake
+    if fix_unsafe_pattern.search(text):
+        return False
+    if text.isascii():
+        return True
+    return unicodedata.is_normalized("NFC", text) and not is_bad(text)
+
+
+def fix(text, lang, chars_rep, chars_pattern, stats=None):
+    is_cjk = lang.lower() in cjk_langs
+    return fix_text(text, is_cjk, chars_pattern, chars_pattern.get_fix_unsafe_pattern(is_cjk), stats)
+
+
+# fix() with the language decisions already taken, see LanguageProfile
+def fix_text(text, is_cjk, chars_pattern, fix_unsafe_pattern, stats=None):
+    if stats is not None:
+        stats["fix"] += 1
+
+    # Most sentences are already clean: skip ftfy and the replacements for them
+    if is_fixed_text(text, fix_unsafe_pattern):
+        if stats is not None:
+            stats["fix_fast_path"] += 1
+        return text.translate(remove_tabs_endlines)
 
     ftfy_fixed_text = ftfy.fix_text_segment(text,
             uncurl_quotes=False,
             fix_latin_ligatures=False,
-            fix_character_width=lang.lower() not in cjk_langs)
+            fix_character_width=not is_cjk)
 
-    replaced_text = chars_pattern.sub(replace_chars, ftfy_fixed_text)
+    replaced_text = chars_pattern.replace(ftfy_fixed_text)
 
     return html.unescape(replaced_text).translate(remove_tabs_endlines)
 
+# Translate table for the characters that normalize() removes or turns into spaces, and a pattern
+# to find them, so that the table is only applied to the sentences that need it
+@functools.lru_cache(maxsize=None)
+def get_normalize_table(is_cjk):
+    table = {}
+    deleted = "\u007F-\u009F"
+    if not is_cjk:
+        table.update(dict.fromkeys(range(0xE000, 0x10000)))
+        deleted += "\uE000-\uFFFF"
+    table.update(dict.fromkeys(range(0x2000, 0x2010), " "))
+    table.update(dict.fromkeys(range(0x7F, 0xA0)))
+    table[0xA0] = " "
+    pattern = re.compile("[" + deleted + "\u00A0\u2000-\u200F]")
+    return pattern, table
+
+
+# Same as re.sub(r"\s+", " ", text), but faster
+def collapse_spaces(text):
+    collapsed = " ".join(text.split())
+    if not collapsed:
+        return " " if text else ""
+    if text[0].isspace():
+        collapsed = " " + collapsed
+    if text[-1].isspace():
+        collapsed += " "
+    return collapsed
+
+
 def normalize(text, lang, punct_rep, punct_pattern):
-    normalized_text = text
-    if lang.lower() not in cjk_langs:
-        normalized_text = chars3Re.sub(replace_chars3, normalized_text)
-    normalized_text = chars3Re2.sub(replace_with_space, normalized_text)
-    normalized_text = chars3Re3.sub(replace_chars3, normalized_text)
-    normalized_text = chars3_nbsp.sub(replace_with_space, normalized_text)
-    normalized_text = quotesRegex.sub("\g<start>\'\g<end>", normalized_text)
-    collapsed_spaces_with_collapsed_spaces = re.sub('\s+', ' ', normalized_text)  # Collapse multiple spaces
-    normalized_text_with_normalized_punct = punct_pattern.sub(lambda m: punct_rep[re.escape(m.group(0))], collapsed_spaces_with_collapsed_spaces)
+    normalize_pattern, normalize_table = get_normalize_table(lang.lower() in cjk_langs)
+    return normalize_text(text, normalize_pattern, normalize_table, punct_pattern)
 
-    collapsed_spaces = re.sub('\s+', ' ', normalized_text_with_normalized_punct)  # Collapse multiple spaces again
-    collapsed_entities = collapse_spaced_entities.sub("&#\\2;", collapsed_spaces)
 
-    return collapsed_entities.strip(" \n")
+# normalize() with the language decisions already taken, see LanguageProfile
+def normalize_text(text, normalize_pattern, normalize_table, punct_pattern):
+    normalized_text = text
+    if normalize_pattern.search(normalized_text):
+        normalized_text = normalized_text.translate(normalize_table)
+    if "''" in normalized_text:
+        normalized_text = quotesRegex.sub("\g<start>\'\g<end>", normalized_text)
+    collapsed_spaces = collapse_spaces(normalized_text)  # Collapse multiple spaces
+    # Punctuation replacements never leave multiple spaces
+    normalized_punct = punct_pattern.replace(collapsed_spaces)
+    if "#" in normalized_punct:
+        normalized_punct = collapse_spaced_entities.sub("&#\\2;", normalized_punct)
+
+    return normalized_punct.strip(" \n")
 
 def preserve_case(orig, dest):
     restored = ""
@@ -767,60 +909,54 @@ def preserve_case(orig, dest):
     return restored
 
 def ortho_detok_fix(text, replacements, detoks):
-    if len(replacements) > 0 or len(detoks) > 0:
-        last = 0
-        line = []
-
-        # Pseudo-tokenization separate words and spaces/punct
-        for j in regex.finditer(r"([^-'[:alpha:]](?:[^-[:alpha:]']*[^-'[:alpha:]])?)", text):
-            if last != j.start():
-                line.append((text[last:j.start()], "w"))
-            line.append((text[j.start():j.end()], "s"))
-            last = j.end()
-        else:
-            if last != len(text):
-                line.append((text[last:], "w"))
-
-        fixed_text = ""
-        skip_space = 0
-        for i, tok in enumerate(line):
-            if tok[1] == "w":
-                # Print replacement if exist, otherwise print word as is
-                # preserve original case if the replacement is lowercase in both sides
-                if tok[0].lower() in replacements and replacements[tok[0].lower()].islower():
-                    replacement = replacements[tok[0].lower()]
-                    fixed_text += preserve_case(tok[0], replacement)
-                elif tok[0] in replacements:
-                    fixed_text += replacements[tok[0]]
-                else:
-                    fixed_text += tok[0]
-
-                # If it is a tokenization issue, mark next space to be skipped
-                # the current word is in the detok list
-                # the words in detok are present and separated by space
-                if tok[0] in detoks \
-                        and len(line) > i+2 \
-                        and detoks[tok[0]][0] == line[i+2][0] \
-                        and line[i+1][0] == ' ':
-
-                    # Check if the detok requires a second space to be skipped
-                    if len(line) > i+4 \
-                            and len(detoks[tok[0]]) == 2 \
-                            and line[i+3][0] == ' ':
-                        skip_space = 2
-                    else:
-                        skip_space = 1
-
-            # Print spaces if they are not marked to be skipped
-            elif not skip_space:
-                fixed_text += tok[0]
+    if len(replacements) == 0 and len(detoks) == 0:
+        return text
+
+    # Pseudo-tokenization separate words and spaces/punct: words are at the even positions
+    # (the first and last ones may be empty), spaces/punct at the odd ones
+    tokens = ortho_separator_regex.split(text)
+
+    # Most sentences don't contain any word from the tables
+    words = tokens[0::2]
+    if replacements.keys().isdisjoint(words) and detoks.keys().isdisjoint(words) \
+            and replacements.keys().isdisjoint(map(str.lower, words)):
+        return text
+
+    # Number of tokens, not counting an empty last word
+    end = len(tokens) - (tokens[-1] == "")
+    skip_space = 0
+    for i in range(0, len(tokens), 2):
+        word = tokens[i]
+        # Print replacement if exist, otherwise print word as is
+        # preserve original case if the replacement is lowercase in both sides
+        lower_word = word.lower()
+        if lower_word in replacements and replacements[lower_word].islower():
+            tokens[i] = preserve_case(word, replacements[lower_word])
+        elif word in replacements:
+            tokens[i] = replacements[word]
+
+        # If it is a tokenization issue, mark next space to be skipped
+        # the current word is in the detok list
+        # the words in detok are present and separated by space
+        if word in detoks \
+                and end > i+2 \
+                and detoks[word][0] == tokens[i+2] \
+                and tokens[i+1] == ' ':
+
+            # Check if the detok requires a second space to be skipped
+            if end > i+4 \
+                    and len(detoks[word]) == 2 \
+                    and tokens[i+3] == ' ':
+                skip_space = 2
             else:
-                skip_space -= 1
+                skip_space = 1
 
-    else:
-        fixed_text = text
+        # Print spaces if they are not marked to be skipped
+        if skip_space and i + 1 < len(tokens):
+            tokens[i+1] = ""
+            skip_space -= 1
 
-    return fixed_text
+    return "".join(tokens)
 
 
 def remove_html_tags(text):
@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+
+import os
+import time
+import queue
+import argparse
+import logging
+import traceback
+import contextlib
+import multiprocessing
+import multiprocessing.pool
+import functools
+import threading
+import collections
+
+try:
+    from . import util
+    from . import fileio
+    from . import dedup
+    from . import near_dedup
+except (ImportError, SystemError):
+    import util
+    import fileio
+    import dedup
+    import near_dedup
+
+
+# Copy of the arguments without the opened files, so they can be sent to worker processes
+def picklable_args(args):
+    return argparse.Namespace(**{k: v for k, v in vars(args).items() if k not in ("input", "output", "logfile")})
+
+
+# Read the input in batches of lines, along with the line number of the first line of each batch
+def read_batches(input, batch_size, first_line=1):
+    batch = []
+    for line in input:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield first_line, batch
+            first_line += len(batch)
+            batch = []
+    if batch:
+        yield first_line, batch
+
+
+# Like Pool.imap, but results are returned in order and no more than max_pending tasks are queued at a time,
+# so the input is not read faster than the workers can process it
+def imap_ordered(pool, func, iterable, max_pending):
+    pending = collections.deque()
+    for item in iterable:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (item,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+# Columns of the input rows of a tool, given as the names of their arguments (the positions of the columns, starting
+# in 1): sentence_columns are (argument, segment key) pairs, with the key of the fixed sentence of that column in the
+# segments returned by the engine, and deferred_columns and paragraph_columns the deferred standoff annotations and
+# paragraph identifications of the sentences, that are only used if all of them are given
+class RowFormat:
+    def __init__(self, args, sentence_columns, deferred_columns=(), paragraph_columns=()):
+        # Indexes start in 0 from here on
+        self.sentence_columns = [getattr(args, name) - 1 for name, _ in sentence_columns]
+        self.segment_keys = [key for _, key in sentence_columns]
+        self.deferred_columns = []
+        if all(getattr(args, name) for name in deferred_columns):
+            self.deferred_columns = [getattr(args, name) - 1 for name in deferred_columns]
+        self.paragraph_columns = []
+        if all(getattr(args, name) for name in paragraph_columns):
+            self.paragraph_columns = [getattr(args, name) - 1 for name in paragraph_columns]
+
+        # Columns that are read or rewritten when fixing a row
+        self.text_columns = sorted(set(self.sentence_columns + self.deferred_columns + self.paragraph_columns))
+
+        self.ignore_empty = args.ignore_empty
+        self.dedup = args.dedup
+        self.near_dedup = getattr(args, "near_dedup", False)
+        self.annotated_output = args.annotated_output
+
+    def read_row(self, line, line_num):
+        # Splits an input row into its columns, returning them with its sentences, or None if it does not have the
+        # columns that are needed.
+        # Rows read as bytes are only split up to the last column that is needed, and only the needed columns are
+        # decoded, the rest of them are written back as they were read
+        binary = isinstance(line, bytes)
+        if binary:
+            parts = line.split(b"\t", self.text_columns[-1] + 1)
+        else:
+            parts = line.split("\t")
+
+        try:
+            if binary:
+                for column in self.text_columns:
+                    parts[column] = parts[column].decode("utf-8")
+            sentences = tuple(parts[column] for column in self.sentence_columns)
+
+            # Check optional indexes
+            for column in self.deferred_columns + self.paragraph_columns:
+                parts[column]
+        except IndexError:
+            logging.error(traceback.format_exc())
+            logging.error("Wrong column index on line " + str(line_num))
+            return None
+
+        return parts, sentences
+
+    def get_output_rows(self, line, parts, sentences, segments):
+        # Output rows of the fixed segments of an input row
+        output = []
+        binary = isinstance(line, bytes)
+        newline = b"\n" if binary and isinstance(parts[-1], bytes) else "\n"
+
+        sent_num = 0
+        for segment in segments:
+            # Output row: the original columns with the fixed segments, plus hash, ranking, MinHash bands (replaced by
+            # the cluster in the main process) and annotation at the end
+            row = parts.copy()
+            for column, key in zip(self.sentence_columns, self.segment_keys):
+                row[column] = segment[key]
+
+            if len(segments) > 1:
+                sent_num += 1
+
+                if self.deferred_columns:
+                    deferred = [parts[column] for column in self.deferred_columns if "#" in parts[column]]
+                    if deferred:
+                        # Reconstruction
+                        if sent_num != int(deferred[0].split('#')[1]):
+                            continue
+                    else:
+                        for column in self.deferred_columns:
+                            row[column] = parts[column].rstrip("\n") + "#" + str(sent_num)
+                for column in self.paragraph_columns:
+                    row[column] = parts[column].rstrip("\n") + "#" + str(sent_num)
+
+            # sentences may be empty now because they contained only spaces or similar weird thing
+            # for sentences containing only spaces but not normalized, strip them
+            if not (self.ignore_empty or all(row[column].strip() for column in self.sentence_columns)):
+                continue
+
+            # Remove the "/n" at the end of the last item
+            row[-1] = row[-1].strip(newline)
+
+            extra = []
+            if self.dedup:
+                extra.append(segment["hash"])
+                extra.append(str(segment["ranking"]))
+                if self.near_dedup:
+                    extra.append(",".join("{:x}".format(band_key) for band_key in segment["bands"]))
+
+            if self.annotated_output:
+                changed = any(row[column].strip("\n") != sentence.strip("\n") for column, sentence in zip(self.sentence_columns, sentences))
+                extra.append("Yes" if changed else "No")
+
+            if binary:
+                # Only the decoded columns and the ones added at the end have to be encoded again
+                for column in self.text_columns:
+                    row[column] = row[column].encode("utf-8")
+                if extra:
+                    row.append("\t".join(extra).encode("utf-8"))
+                output.append(b"\t".join(row) + b"\n")
+            else:
+                row.extend(extra)
+                output.append("\t".join(row) + "\n")
+
+        return output
+
+
+# Fixes a batch of input rows, returning the number of rows, their output rows and the stats of the batch
+# The sentences of all the rows are fixed at once, so the long ones are segmented in a single batch
+def fix_lines(row_format, engine, batch):
+    first_line, lines = batch
+    output = []
+    stats = collections.Counter()
+
+    rows = []
+    for line_num, line in enumerate(lines, first_line):
+        row = row_format.read_row(line, line_num)
+        if row is not None:
+            rows.append((line, row))
+
+    # Engines with a single sentence per row take the sentences themselves instead of tuples
+    single = len(row_format.sentence_columns) == 1
+    fixed = engine.fix_batch([sentences[0] if single else sentences for _, (_, sentences) in rows], stats)
+    for (line, (parts, sentences)), segments in zip(rows, fixed):
+        output.extend(row_format.get_output_rows(line, parts, sentences, segments))
+
+    return len(lines), output, stats
+
+
+# Each worker process creates its own engine, so the language resources are loaded once per worker
+def init_worker(engine_class, args, row_format):
+    global worker_engine
+    global worker_row_format
+
+    worker_engine = engine_class.from_args(args)
+    worker_row_format = row_format
+
+
+# Fixes a batch of input rows in a worker process
+def process_batch(batch):
+    return fix_lines(worker_row_format, worker_engine, batch)
+
+
+# Streaming mode: the input is read and the output is written by their own threads, connected to the fixing
+# by bounded queues of batches, so a slow input or output does not leave the fixing idle (and the other way around).
+# Each stage measures the time spent doing its work and the time spent waiting for the other stages
+class Pipeline:
+    queue_size = 8
+
+    def __init__(self):
+        self.input_queue = queue.Queue(self.queue_size)
+        self.output_queue = queue.Queue(self.queue_size)
+        self.stopped = threading.Event()
+        self.times = collections.Counter()
+        self.reader_thread = None
+        self.writer_thread = None
+        self.writer_error = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and self.writer_thread is not None:
+            self.put(self.output_queue, None)
+            self.writer_thread.join()
+        else:
+            self.stopped.set()
+            try:
+                self.output_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self.times["pipeline_fix"] = time.perf_counter() - self.start - self.times["pipeline_fix_wait_input"] - self.times["pipeline_fix_wait_output"]
+        if exc_type is None and self.writer_error is not None:
+            raise self.writer_error
+
+    # Blocking put that gives up when the pipeline is stopped because of an error
+    def put(self, q, item):
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def reader(self, batches):
+        # Reader stage: iterates the batches in a thread, and returns an iterator over them
+        batches = iter(batches)
+
+        def run():
+            try:
+                while True:
+                    start = time.perf_counter()
+                    batch = next(batches, None)
+                    self.times["pipeline_read"] += time.perf_counter() - start
+                    start = time.perf_counter()
+                    self.put(self.input_queue, batch)
+                    self.times["pipeline_read_wait"] += time.perf_counter() - start
+                    if batch is None:
+                        break
+            except BaseException as e:
+                self.put(self.input_queue, e)
+
+        self.reader_thread = threading.Thread(target=run, daemon=True)
+        self.reader_thread.start()
+
+        while True:
+            start = time.perf_counter()
+            batch = self.input_queue.get()
+            self.times["pipeline_fix_wait_input"] += time.perf_counter() - start
+            if batch is None:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+
+    def writer(self, write):
+        # Writer stage: returns a function that queues the output rows, to be written by a thread with write
+        def run():
+            while True:
+                start = time.perf_counter()
+                output = self.output_queue.get()
+                self.times["pipeline_write_wait"] += time.perf_counter() - start
+                if output is None:
+                    break
+                if self.writer_error is None:
+                    start = time.perf_counter()
+                    try:
+                        write(output)
+                    except BaseException as e:
+                        # Keep consuming the queue, the error is raised in the fixing stage
+                        self.writer_error = e
+                    self.times["pipeline_write"] += time.perf_counter() - start
+
+        def queue_output(output):
+            if self.writer_error is not None:
+                raise self.writer_error
+            start = time.perf_counter()
+            self.put(self.output_queue, output)
+            self.times["pipeline_fix_wait_output"] += time.perf_counter() - start
+
+        self.writer_thread = threading.Thread(target=run, daemon=True)
+        self.writer_thread.start()
+        return queue_output
+
+
+# Log the time split of each stage of the streaming mode
+def log_pipeline_times(stats):
+    logging.info("Reading stage: {0:.2f} s reading the input, {1:.2f} s waiting for the fixing".format(stats["pipeline_read"], stats["pipeline_read_wait"]))
+    logging.info("Fixing stage: {0:.2f} s fixing, {1:.2f} s waiting for the input, {2:.2f} s waiting for the output".format(stats["pipeline_fix"], stats["pipeline_fix_wait_input"], stats["pipeline_fix_wait_output"]))
+    logging.info("Writing stage: {0:.2f} s writing the output, {1:.2f} s waiting for the fixing".format(stats["pipeline_write"], stats["pipeline_write_wait"]))
+
+
+# Fixes the rows of args.input with the engines of a tool (see RowFormat for the columns), writing the output rows to
+# args.output. The number of input and output rows is returned in the stats, along with the rest of the counters
+def fix_rows(args, engine_class, sentence_columns, deferred_columns=(), paragraph_columns=()):
+    processes = getattr(args, "processes", 1)
+    threads = getattr(args, "threads", 1)
+    pipeline = getattr(args, "pipeline", False)
+    profile = getattr(args, "profile", False)
+    stats = collections.Counter()
+    ilines = 0
+    olines = 0
+
+    # Duplicated rows are dropped and near-duplicates clustered in the main process, after the fixing, so the kept rows
+    # and the clusters don't depend on the batches
+    clustered = getattr(args, "near_dedup", False)
+    clusters = None
+    if clustered:
+        clusters = near_dedup.ClusterIndex(args.annotated_output, getattr(args, "near_dedup_window", 500000))
+    deduplicator = None
+    if getattr(args, "drop_duplicates", False):
+        # Hashes of earlier runs, memory-mapped from the index file
+        index = dedup.HashIndex(args.hash_index) if getattr(args, "hash_index", None) else None
+        deduplicator = dedup.Deduplicator(getattr(args, "keep_best", False), args.annotated_output, getattr(args, "tmp_dir", None), getattr(args, "batch_size", 1000),
+                                          clustered, index, not getattr(args, "hash_index_readonly", False))
+
+    # Files opened in binary mode are read in large blocks, and their rows are written back as bytes
+    binary = fileio.is_binary(args.input)
+    lines = fileio.read_lines(args.input) if binary else args.input
+
+    # Reading and writing are profiled apart, as they may run in their own threads
+    io_stats = collections.Counter()
+    write = args.output.writelines
+    if profile:
+        lines = util.profile_read(lines, io_stats)
+        write = util.profile_write(write, io_stats)
+
+    if args.header:
+        header = next(lines)
+        if binary:
+            header = header.decode("utf-8")
+        header = header.strip().split("\t")
+
+        # Transform fields to idxs
+        for name in [name for name, _ in sentence_columns] + list(deferred_columns) + list(paragraph_columns):
+            field = getattr(args, name)
+            if field:
+                if field not in header:
+                    raise Exception(f"The provided --{name} '{field}' is not in the input header")
+                setattr(args, name, header.index(field) + 1)
+
+        # Write the output header once
+        header_line = "\t".join(header)
+
+        if args.dedup:
+            header_line += "\tbifixer_hash\tbifixer_score"
+            if clustered:
+                header_line += "\tbifixer_cluster"
+        if args.annotated_output:
+            header_line += "\tbifixed"
+        header_line += "\n"
+        args.output.write(header_line.encode("utf-8") if binary else header_line)
+
+    row_format = RowFormat(args, sentence_columns, deferred_columns, paragraph_columns)
+
+    # Rows are fixed in batches, even in a single process, so the long sentences of each batch are segmented together
+    batches = read_batches(lines, getattr(args, "batch_size", 1000))
+
+    with contextlib.ExitStack() as stack:
+        if pipeline:
+            # Reading and writing run in their own threads, connected to the fixing by bounded queues
+            pipe = stack.enter_context(Pipeline())
+            batches = pipe.reader(batches)
+            write = pipe.writer(write)
+
+        if processes > 1:
+            # Input rows are sent in batches to long-lived workers, and their output is written back in input order
+            pool = stack.enter_context(multiprocessing.Pool(processes, initializer=init_worker, initargs=(engine_class, picklable_args(args), row_format)))
+            results = imap_ordered(pool, process_batch, batches, 2 * processes)
+        elif threads > 1:
+            # Same as with processes, but all the threads share one engine and nothing has to be pickled
+            engine = engine_class.from_args(args)
+            pool = stack.enter_context(multiprocessing.pool.ThreadPool(threads))
+            results = imap_ordered(pool, functools.partial(fix_lines, row_format, engine), batches, 2 * threads)
+        else:
+            engine = engine_class.from_args(args)
+            results = map(functools.partial(fix_lines, row_format, engine), batches)
+
+        for batch_lines, output, batch_stats in results:
+            ilines += batch_lines
+            if clusters:
+                output = clusters.assign(output)
+            if deduplicator:
+                output = deduplicator.filter(output)
+            olines += len(output)
+            write(output)
+            stats.update(batch_stats)
+
+        if deduplicator:
+            olines += deduplicator.finish(write)
+
+    if pipeline:
+        stats.update(pipe.times)
+
+    if clusters:
+        stats.update(clusters.stats)
+    if deduplicator:
+        stats.update(deduplicator.stats)
+    stats.update(io_stats)
+    stats["input_rows"] = ilines
+    stats["output_rows"] = olines
+    return stats
+
+
+# Fixes the input of a tool with its fix_sentences function, logging the stats at the end
+def perform_fixing(args, fix_sentences):
+    time_start = time.perf_counter()
+    logging.info("Starting fixing text")
+    stats = fix_sentences(args)
+    logging.info("Text fixing finished")
+
+    # Stats
+    logging.info("Finished")
+    elapsed_time = time.perf_counter() - time_start
+    logging.info("Input lines: {0} rows".format(stats["input_rows"]))
+    logging.info("Output lines: {0} rows".format(stats["output_rows"]))
+    logging.info("Elapsed time {0:.2f} s".format(elapsed_time))
+    logging.info("Troughput: {0} rows/s".format(int((stats["input_rows"] * 1.0) / elapsed_time)))
+    if stats["fix"]:
+        logging.info("Character fixing fast path: {0} of {1} sentences ({2:.2f}%)".format(stats["fix_fast_path"], stats["fix"], 100.0 * stats["fix_fast_path"] / stats["fix"]))
+    util.log_cache_stats(stats, "cache", "Sentence cache")
+    util.log_cache_stats(stats, "segmentation_cache", "Segmentation cache")
+    if stats["segmentation_avoided"]:
+        logging.info("Segmentation prescreen: {0} segmenter calls avoided".format(stats["segmentation_avoided"]))
+    if stats["dedup_rows"]:
+        dedup.log_dedup_stats(stats)
+    if stats["near_dedup_rows"]:
+        near_dedup.log_near_dedup_stats(stats)
+    if "pipeline_fix" in stats:
+        log_pipeline_times(stats)
+    if getattr(args, "profile", False):
+        util.report_profile(args, stats)
+
+    logging.info("Output file: {0}".format(os.path.abspath(args.output.name)))
@@ -4,57 +4,129 @@ __author__ = "Marta Bañón (mbanon)"
 __version__ = "Version 0.1 # 03/07/2019 # Initial release # Marta Bañón"
 __version__ = "Version 0.2 # 23/08/2019 # Included NLTK segmenter # Marta Bañón"
 
-import signal
-import json
 import os
+import collections
+import re
 import nltk
 import sys
+import pickle
 import logging
+import functools
+import threading
 
-from nltk import load
+from timeit import default_timer
+from nltk.tokenize.punkt import PunktParameters, PunktSentenceTokenizer, load_punkt_params
+
+try:
+    from . import util
+except (ImportError, SystemError):
+    import util
 
 try:
     from loomchild.segmenter import LoomchildSegmenter
 except ImportError:
     pass
 
-class myTimeout(Exception):
-    pass
+# Seconds that downloading the NLTK Punkt data can take before giving up
+PUNKT_DOWNLOAD_TIMEOUT = 120
 
-def timeout(signum, frame):
-    raise myTimeout
+# Only one thread downloads the NLTK Punkt data at a time
+punkt_download_lock = threading.Lock()
 
-class NLTKSegmenter:
-    def __init__(self, lang):
+
+# Downloads the NLTK Punkt data if it isn't installed yet. nltk.download has no timeout of its own, so it runs in another
+# thread that is given up after PUNKT_DOWNLOAD_TIMEOUT seconds (signals only work in the main thread)
+def download_punkt(timeout=PUNKT_DOWNLOAD_TIMEOUT):
+    with punkt_download_lock:
         try:
             nltk.data.find('tokenizers/punkt_tab')
+            return
         except LookupError:
-            for i in range(3):
-                signal.signal(signal.SIGALRM, timeout)
-                signal.alarm(120)
-                try:
-                    result = nltk.download('punkt_tab')#, quiet=True)
-                    signal.alarm(0)
-                    break
-                except myTimeout:
-                    pass
-            else:
-                raise Exception("Unable to download 'punkt_tab' NLTK data after 3 retries: try to download it manually or check your internet connection.")
+            pass
+
+        result = []
+        thread = threading.Thread(target=lambda: result.append(nltk.download('punkt_tab', raise_on_error=False)), daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if not result or not result[0]:
+            raise Exception("Unable to download 'punkt_tab' NLTK data (giving up after {} seconds): try to download it manually, check your internet connection, or copy the Punkt cache files written by bifixer-punkt-cache to {}".format(timeout, util.get_cache_dir()))
+
+
+# Punkt parameters of a language (its NLTK name) read from the NLTK data, downloading it if needed.
+# Raises LookupError if the language is not in the NLTK data
+def load_punkt_tab(langname):
+    download_punkt()
+    return load_punkt_params(nltk.data.find('tokenizers/punkt_tab/{}/'.format(langname)))
+
 
+# Unpickler of the Punkt cache files, that only hold sets, tuples, dicts and strings: anything else is refused
+class PunktUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("Unexpected object in a Punkt cache file: {}.{}".format(module, name))
+
+
+def dump_punkt_parameters(params):
+    return pickle.dumps({"abbrev_types": params.abbrev_types, "collocations": params.collocations,
+                         "sent_starters": params.sent_starters, "ortho_context": dict(params.ortho_context)}, pickle.HIGHEST_PROTOCOL)
+
+
+def read_punkt_parameters(punkt_file):
+    data = PunktUnpickler(punkt_file).load()
+    params = PunktParameters()
+    params.abbrev_types = data["abbrev_types"]
+    params.collocations = data["collocations"]
+    params.sent_starters = data["sent_starters"]
+    params.ortho_context = collections.defaultdict(int, data["ortho_context"])
+    return params
+
+
+def get_punkt_cache_file(langname):
+    return os.path.join(util.get_cache_dir(), "punkt.{}.pickle".format(langname))
+
+
+# Punkt parameters of a language (its NLTK name), shared by all the segmenters of the process.
+# Parsing the NLTK data takes much longer than unpickling it, so the parameters are cached on disk the first time,
+# and later runs (or workers with the cache files copied, even without NLTK data or internet) read them from there.
+# Raises LookupError if the language is neither cached nor in the NLTK data
+@functools.lru_cache(maxsize=None)
+def get_punkt_parameters(langname):
+    start = default_timer()
+    cache_file = get_punkt_cache_file(langname)
+    try:
+        with open(cache_file, "rb") as punkt_file:
+            params = read_punkt_parameters(punkt_file)
+        source = cache_file
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        params = load_punkt_tab(langname)
+        util.save_cache_file(cache_file, dump_punkt_parameters(params))
+        source = "NLTK data"
+    logging.debug("Punkt parameters for '{}' loaded from {} in {:.3f} seconds".format(langname, source, default_timer() - start))
+    return params
+
+
+class NLTKSegmenter:
+    def __init__(self, lang):
         langname = self.getLanguageName(lang.lower())
 
         try:
-            #self.segmenter = load('tokenizers/punkt/{0}.pickle'.format(langname))
-            self.segmenter = nltk.PunktTokenizer(langname)
-        except:
-            #self.segmenter = load('tokenizers/punkt/english.pickle')
-            self.segmenter = nltk.PunktTokenizer("english")
+            params = get_punkt_parameters(langname)
+        except LookupError:
+            params = get_punkt_parameters("english")
+        self.segmenter = PunktSentenceTokenizer(params)
+
+        # Punkt only splits after the sentence endings matched by this regex
+        self.boundaries = self.segmenter._lang_vars.period_context_re()
 
     def get_segmentation(self, sentence):
-        sentence_segments = json.loads(json.dumps(self.segmenter.tokenize(sentence)))
-        return sentence_segments
+        return self.segmenter.tokenize(sentence)
 
-    def getLanguageName(self, lang):
+    def get_segmentations(self, sentences):
+        # Punkt spans, sliced here instead of going through tokenize and its generators for each sentence
+        span_tokenize = self.segmenter.span_tokenize
+        return [[sentence[start:end] for start, end in span_tokenize(sentence)] for sentence in sentences]
+
+    @staticmethod
+    def getLanguageName(lang):
         # Returns NLTK *.pickle file for the language, if exists. If not, returns the default (english.pickle)
 
         if lang == "cs":
@@ -118,8 +190,88 @@ class NLTKSegmenter:
             return "english"
 
 
+# Non-breaking prefixes of a language, as a set of the prefixes and a set of the prefixes that are only
+# non-breaking before a number. The English ones are used for the languages without a list.
+def getNonbreakingPrefixes(lang):
+    lang = {"nn": "nb", "no": "nb"}.get(lang.lower(), lang.lower())
+    path = os.path.dirname(os.path.realpath(__file__)) + "/nonbreaking_prefixes/nonbreaking_prefixes."
+    if not os.path.exists(path + lang):
+        lang = "en"
+
+    prefixes, numeric_prefixes = set(), set()
+    with open(path + lang, "r") as input_prefixes:
+        for line in input_prefixes:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            if line.endswith(" #NUMERIC_ONLY#"):
+                numeric_prefixes.add(line.split(" ")[0])
+            else:
+                prefixes.add(line)
+
+    return prefixes, numeric_prefixes
+
+
+# Rule-based segmenter: a single compiled regex finds the possible sentence endings (a period, question or exclamation
+# mark followed by whitespace, or a full-width ending), and the word before each period is checked against the
+# non-breaking prefixes of the language. Much faster than Punkt, and close to it.
+class RegexSegmenter:
+    boundaries = re.compile(r"""
+        (?=[.?!。！？])                  # lets re skip quickly to the next ending
+        (?:(?P<end>[.?!]+)|(?P<wide>[。！？]+))
+        (?P<close>["'”’»)\]」』）]*)     # closing punctuation
+        (?(end)\s+(?:(?P<realign>["')\]}]+)\s+)?|\s*)
+        (?=["'“‘«„(\[¿¡–—-]*(?P<next>\S))
+        """, re.VERBOSE)
+    acronym = re.compile(r"(?:[^\W\d_]\.)+[^\W\d_]")
+
+    def __init__(self, lang):
+        self.prefixes, self.numeric_prefixes = getNonbreakingPrefixes(lang)
+
+    def get_segmentation(self, sentence):
+        segments = []
+        start = 0
+        for match in self.boundaries.finditer(sentence):
+            if self.is_boundary(sentence, match):
+                # Like Punkt, closing quotes and brackets alone after the ending belong to the previous segment
+                segments.append(sentence[start:match.end("realign" if match.group("realign") else "close")])
+                start = match.end()
+        # Like Punkt, the last segment has no trailing whitespace and empty segments are dropped
+        last = sentence[start:len(sentence.rstrip())]
+        if last:
+            segments.append(last)
+        return segments
+
+    def get_segmentations(self, sentences):
+        get_segmentation = self.get_segmentation
+        return [get_segmentation(sentence) for sentence in sentences]
+
+    def is_boundary(self, sentence, match):
+        end = match.group("end")
+        if end is None or "?" in end or "!" in end:
+            return True
+
+        if len(end) > 1:
+            # Ellipsis
+            return False
+
+        end_start = match.start()
+        word = sentence[sentence.rfind(" ", 0, end_start) + 1:end_start].lstrip("\"'“‘«„([¿¡")
+        if word in self.prefixes or word.lower() in self.prefixes:
+            return False
+        if word in self.numeric_prefixes and match.group("next").isdigit():
+            return False
+        # Initials and acronyms like U.S.
+        if (len(word) == 1 and word.isalpha()) or self.acronym.fullmatch(word):
+            return False
+        return True
+
+
+# Segmenter of a language. With a cache_size, the segments of the last sentences seen are kept, as boilerplate
+# paragraphs are segmented over and over again. The cached lists are returned as they are, so they must not be modified.
 class NaiveSegmenter:
-    def __init__(self, lang, module="nltk"):
+    def __init__(self, lang, module="nltk", cache_size=0):
+        self.cache = util.LRUCache(cache_size) if cache_size > 0 else None
         if module == "loomchild":
             if "loomchild.segmenter" in sys.modules:
                 self.segmenter = LoomchildSegmenter(lang)
@@ -128,20 +280,125 @@ class NaiveSegmenter:
                 self.segmenter = NLTKSegmenter(lang)
         elif module == "nltk":
             self.segmenter = NLTKSegmenter(lang)
+        elif module == "regex":
+            self.segmenter = RegexSegmenter(lang)
         else:
             self.segmenter = NLTKSegmenter(lang)
+        self.boundaries = getattr(self.segmenter, "boundaries", None)
+
+    # Whether the segmentation of a sentence is known to be the sentence itself without segmenting it: it has no
+    # possible sentence boundary (and no trailing spaces, that are stripped from the last segment)
+    def is_one_segment(self, sentence):
+        return self.boundaries is not None and sentence != "" and not sentence[-1].isspace() and self.boundaries.search(sentence) is None
+
+    def __call__(self, sentence, stats=None):
+        if self.cache is None:
+            return self.segmenter.get_segmentation(sentence)
+
+        segments = self.cache.get(sentence)
+        if segments is not None:
+            if stats is not None:
+                stats["segmentation_cache_hit"] += 1
+            return segments
+
+        segments = self.segmenter.get_segmentation(sentence)
+        evicted = self.cache.put(sentence, segments)
+        if stats is not None:
+            stats["segmentation_cache_miss"] += 1
+            stats["segmentation_cache_eviction"] += evicted
+        return segments
 
-    def __call__(self, sentence):
-        return self.segmenter.get_segmentation(sentence)
+    # Segments a list of sentences at once, returning the list of segments of each one. The sentences that are not in
+    # the cache are segmented in a single call to the backend (only once if they are repeated in the list), so
+    # backends that support it can share their setup between all of them.
+    def segment_batch(self, sentences, stats=None):
+        if stats is None:
+            stats = collections.Counter()
+
+        segmented = {}
+        pending = []
+        for sentence in sentences:
+            if sentence in segmented:
+                stats["segmentation_cache_hit"] += self.cache is not None
+                continue
+            segments = self.cache.get(sentence) if self.cache is not None else None
+            if segments is not None:
+                stats["segmentation_cache_hit"] += 1
+            elif self.cache is not None:
+                stats["segmentation_cache_miss"] += 1
+            segmented[sentence] = segments
+            if segments is None:
+                pending.append(sentence)
+
+        if pending:
+            get_segmentations = getattr(self.segmenter, "get_segmentations", None)
+            if get_segmentations is not None:
+                results = get_segmentations(pending)
+            else:
+                results = [self.segmenter.get_segmentation(sentence) for sentence in pending]
+            for sentence, segments in zip(pending, results):
+                segmented[sentence] = segments
+                if self.cache is not None:
+                    stats["segmentation_cache_eviction"] += self.cache.put(sentence, segments)
+
+        return [segmented[sentence] for sentence in sentences]
 
 def naive_segmenter_mono(segmenter, sentence):
     segments = segmenter(sentence)
     return segments
 
+# Same as naive_segmenter_mono for a list of sentences, with a NaiveSegmenter: they are segmented in one batch, and the
+# sentences that is_one_segment knows would be kept as they are are not segmented at all
+def naive_segmenter_mono_batch(segmenter, sentences, stats=None):
+    if stats is None:
+        stats = collections.Counter()
+
+    kept = [segmenter.is_one_segment(sentence) for sentence in sentences]
+    pending = [sentence for sentence, keep in zip(sentences, kept) if not keep]
+    stats["segmentation_avoided"] += len(sentences) - len(pending)
+    segmented = iter(segmenter.segment_batch(pending, stats))
+    return [[sentence] if keep else next(segmented) for sentence, keep in zip(sentences, kept)]
+
+# Whether naive_segmenter would keep a pair as it is, known without segmenting it: one of its sides has no possible
+# sentence boundary, so both sides cannot be split into the same number of segments, and if the other side is not
+# split either, its only segment is itself as long as it has no trailing spaces
+def keeps_pair(source_segmenter, target_segmenter, source, target):
+    if source_segmenter.is_one_segment(source):
+        other = target
+    elif target_segmenter.is_one_segment(target):
+        other = source
+    else:
+        return False
+    return other == "" or not other[-1].isspace()
+
 def naive_segmenter(source_segmenter, target_segmenter, source, target):
     source_segments = source_segmenter(source)
     target_segments = target_segmenter(target)
+    return pair_segments(source_segments, target_segments, source, target)
+
+# Same as naive_segmenter for a list of (source, target) pairs, with NaiveSegmenters: all the sides are segmented in
+# one batch per language, and the pairs that keeps_pair knows would be kept as they are are not segmented at all
+def naive_segmenter_batch(source_segmenter, target_segmenter, pairs, stats=None):
+    if stats is None:
+        stats = collections.Counter()
+
+    kept = [keeps_pair(source_segmenter, target_segmenter, source, target) for source, target in pairs]
+    pending = [pair for pair, keep in zip(pairs, kept) if not keep]
+    stats["segmentation_avoided"] += 2 * (len(pairs) - len(pending))
+    source_batch = source_segmenter.segment_batch([source for source, _ in pending], stats)
+    target_batch = target_segmenter.segment_batch([target for _, target in pending], stats)
+
+    results = []
+    segmented = zip(pending, source_batch, target_batch)
+    for (source, target), keep in zip(pairs, kept):
+        if keep:
+            results.append([{"source_segment": source, "target_segment": target}])
+        else:
+            _, source_segments, target_segments = next(segmented)
+            results.append(pair_segments(source_segments, target_segments, source, target))
+    return results
 
+def pair_segments(source_segments, target_segments, source, target):
     if len(source_segments) == len(target_segments):
         segments = []
         for segment_pair in zip(source_segments, target_segments):
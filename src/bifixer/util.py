@@ -1,8 +1,17 @@
 #!/usr/bin/env python
 
+import json
+import os
 import sys
 import argparse
 import logging
+import tempfile
+import functools
+import collections
+import threading
+import time
+import unicodedata
+
 
 
 # Logging config
@@ -33,3 +42,160 @@ def check_positive(value):
     if ivalue <= 0:
         raise argparse.ArgumentTypeError("%s is an invalid positive int value" % value)
     return ivalue
+
+
+def check_positive_or_zero(value):
+    ivalue = int(value)
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError("%s is an invalid non-negative int value" % value)
+    return ivalue
+
+
+# Directory for the files that can be reused between runs (set BIFIXER_CACHE_DIR to change it)
+def get_cache_dir():
+    cache_dir = os.environ.get("BIFIXER_CACHE_DIR")
+    if not cache_dir:
+        cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "bifixer")
+    return cache_dir
+
+
+# Write a cache file atomically, so concurrent runs never read a partially written file.
+# The cache is just an optimization: if it cannot be written, it is silently skipped
+def save_cache_file(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.debug("Unable to write cache file {}: {}".format(path, e))
+
+
+# Translate table to remove non alphabetic characters, used by aggressive deduplication.
+# Checking the category of every code point is slow, so the table is built only the first time it is needed,
+# and the removed characters are cached on disk for each Unicode version
+@functools.lru_cache(maxsize=None)
+def get_remove_non_alpha():
+    cache_file = os.path.join(get_cache_dir(), "remove_non_alpha.unicode-{}.txt".format(unicodedata.unidata_version))
+    try:
+        with open(cache_file, "rb") as f:
+            non_alpha = f.read().decode("utf-8", "surrogatepass")
+    except (OSError, UnicodeDecodeError):
+        non_alpha = "".join(chr(i) for i in range(sys.maxunicode) if not unicodedata.category(chr(i)).startswith('L'))
+        save_cache_file(cache_file, non_alpha.encode("utf-8", "surrogatepass"))
+
+    return str.maketrans('', '', non_alpha)
+
+
+# Bounded mapping that forgets the least recently used entries, and can be shared between threads
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return default
+            return self.data[key]
+
+    # Returns True if the least recently used entry was evicted to make room
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                return True
+        return False
+
+
+# Logs the hits, misses and evictions of the cache whose stats start with prefix, if it was used
+def log_cache_stats(stats, prefix, name):
+    hits, misses = stats[prefix + "_hit"], stats[prefix + "_miss"]
+    if hits or misses:
+        logging.info("{0}: {1} hits, {2} misses ({3:.2f}% hit rate), {4} evictions".format(name, hits, misses, 100.0 * hits / (hits + misses), stats[prefix + "_eviction"]))
+
+
+# Profiling (--profile): each stage adds its time, number of calls and number of sentences it changed to the stats,
+# for each side separately. The stages are reported in this order
+PROFILE_STAGES = ["read", "characters", "html", "normalization", "orthography", "segmentation", "hash", "write"]
+
+
+def profile_stage(stats, stage, side, start, changed):
+    stats[("profile", stage, side, "time")] += time.perf_counter() - start
+    stats[("profile", stage, side, "calls")] += 1
+    if changed:
+        stats[("profile", stage, side, "changed")] += 1
+
+
+# Runs one of the cleaning functions as a profiled stage. The text counts as changed if the result is not the
+# same as unchanged (the text itself by default)
+def profile_call(stats, stage, side, func, text, *args, unchanged=None):
+    start = time.perf_counter()
+    result = func(text, *args)
+    profile_stage(stats, stage, side, start, result != (text if unchanged is None else unchanged))
+    return result
+
+
+# What fix() returns for a sentence it doesn't change: the sentence of the last column still ends in the newline
+# of the row, that fix() turns into a space
+def get_unfixed(sentence):
+    return sentence[:-1] + " " if sentence.endswith("\n") else sentence
+
+
+# Iterates the input lines, profiling the time spent reading them
+def profile_read(lines, stats):
+    lines = iter(lines)
+    while True:
+        start = time.perf_counter()
+        line = next(lines, None)
+        if line is None:
+            return
+        profile_stage(stats, "read", "", start, False)
+        yield line
+
+
+# Returns a write function that profiles the time spent writing the output
+def profile_write(write, stats):
+    def profiled_write(output):
+        start = time.perf_counter()
+        write(output)
+        profile_stage(stats, "write", "", start, False)
+    return profiled_write
+
+
+# The profile of each stage and side, in the order they are run
+def get_profile(stats):
+    stages = {}
+    for key, value in stats.items():
+        if isinstance(key, tuple) and key[0] == "profile":
+            _, stage, side, field = key
+            stages.setdefault((stage, side), {"stage": stage, "side": side, "calls": 0, "changed": 0, "time": 0.0})[field] += value
+    order = {stage: i for i, stage in enumerate(PROFILE_STAGES)}
+    return sorted(stages.values(), key=lambda s: (order.get(s["stage"], len(order)), s["side"]))
+
+
+def format_profile(profile):
+    lines = ["{:<14} {:<8} {:>10} {:>10} {:>10} {:>10}".format("Stage", "Side", "Calls", "Changed", "Time (s)", "us/call")]
+    for s in profile:
+        lines.append("{:<14} {:<8} {:>10} {:>10} {:>10.3f} {:>10.2f}".format(
+            s["stage"], s["side"] or "-", s["calls"], s["changed"], s["time"], 1e6 * s["time"] / s["calls"] if s["calls"] else 0.0))
+    return "\n".join(lines)
+
+
+# Print the profile table to the log file, or write it to a JSON file
+def report_profile(args, stats):
+    profile = get_profile(stats)
+    if getattr(args, "profile_json", None):
+        with open(args.profile_json, "w") as f:
+            json.dump(profile, f, indent=2)
+    else:
+        args.logfile.write(format_profile(profile) + "\n")
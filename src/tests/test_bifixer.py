@@ -9,13 +9,28 @@ import pytest
 import sys
 import argparse
 import io
+import os
+import collections
+import gzip
+import lzma
+import pickle
+import time
+import threading
+import multiprocessing.pool
 
 sys.path.append('..')
 
 import bifixer
 from bifixer import bifixer
+from bifixer import monofixer
 from bifixer import restorative_cleaning
 from bifixer import segmenter
+from bifixer import util
+from bifixer import fileio
+from bifixer import rows
+from bifixer import dedup
+from bifixer import near_dedup
+from bifixer.benchmark import corpus, micro, end_to_end
 
 
 class TestEmptySpaces():
@@ -53,6 +68,74 @@ class TestEmptySpaces():
                 assert e == t
 
 
+class TestEngine:
+    engine = bifixer.BifixerEngine("es", "en", ignore_segmentation=True)
+
+    def test_fix_pair(self):
+        segments = self.engine.fix_pair("Â¿La cigÃ¼eÃ±a bebÃ­a cafÃ©?", "  Did the stork   drink coffee ?")
+        assert len(segments) == 1
+        assert segments[0]["source_segment"] == "¿La cigüeña bebía café?"
+        assert segments[0]["target_segment"] == "Did the stork drink coffee?"
+        assert segments[0]["ranking"] == 1
+
+        same_segments = self.engine.fix_pair("¿La cigüeña bebía café?", "Did the stork drink coffee?")
+        assert same_segments[0]["hash"] == segments[0]["hash"]
+
+    def test_empty(self):
+        assert self.engine.fix_pair("", "Target") == []
+        assert self.engine.fix_pair("Source", "") == []
+
+    def test_fix_batch(self):
+        pairs = [("Hola  mundo", "Hello world"), ("", "Target"), ("Qu&eacute; tal", "How are you ?")]
+        assert self.engine.fix_batch(pairs) == [self.engine.fix_pair(s, t) for s, t in pairs]
+
+    def test_profile(self):
+        engine = bifixer.BifixerEngine("en", "es", profile=True, words_before_segmenting=2)
+        stats = collections.Counter()
+        segments = engine.fix_pair("Hello <b>world</b>. How are you?", "Hola <b>mundo</b>. ¿Cómo estás?", stats)
+        assert [s["source_segment"] for s in segments] == ["Hello world.", "How are you?"]
+
+        profile = {(s["stage"], s["side"]): s for s in util.get_profile(stats)}
+        assert profile[("html", "source")]["calls"] == 1
+        assert profile[("html", "target")]["changed"] == 1
+        assert profile[("segmentation", "source")]["changed"] == 1
+        assert profile[("hash", "pair")]["calls"] == 2
+        assert "segmentation" in util.format_profile(util.get_profile(stats))
+
+        # Profiling does not change the result
+        assert bifixer.BifixerEngine("en", "es", words_before_segmenting=2).fix_pair("Hello <b>world</b>. How are you?", "Hola <b>mundo</b>. ¿Cómo estás?") == segments
+
+        # The newline at the end of the target column is not a change
+        stats = collections.Counter()
+        engine.fix_pair("A clean sentence.", "Una frase limpia.\n", stats)
+        engine.fix_pair("A clean sentence.", "Una frase   sucia.\t\n", stats)
+        profile = {(s["stage"], s["side"]): s for s in util.get_profile(stats)}
+        assert profile[("characters", "target")]["calls"] == 2
+        assert profile[("characters", "target")]["changed"] == 1
+
+    def test_unknown_option(self):
+        with pytest.raises(TypeError):
+            bifixer.BifixerEngine("es", "en", ignore_everything=True)
+
+    def test_cache(self):
+        engine = bifixer.BifixerEngine("es", "en", ignore_segmentation=True, cache_size=2)
+        pairs = [("Hola  mundo", "Hello world"), ("Hola  mundo", "Hi world"), ("Qu&eacute; tal", "Hello world"), ("Adi&oacute;s", "Bye")]
+        assert engine.fix_batch(pairs) == self.engine.fix_batch(pairs)
+        assert engine.stats["cache_hit"] == 1
+        assert engine.stats["cache_miss"] == 7
+        assert engine.stats["cache_eviction"] == 5
+        assert len(engine.cache) == 2
+
+    def test_lru_cache(self):
+        cache = util.LRUCache(2)
+        assert not cache.put("a", 1)
+        assert not cache.put("b", 2)
+        assert cache.get("a") == 1
+        assert cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+
+
 class TestCharReplacements:
     chars_en, charsRe_en = restorative_cleaning.getCharsReplacements("en")
     chars_ru, charsRe_ru = restorative_cleaning.getCharsReplacements("ru")
@@ -137,6 +220,61 @@ class TestCharReplacements:
         fixed_2 = restorative_cleaning.fix(text_2, "en", self.chars_en, self.charsRe_en)
         assert fixed_2 == correct_2
 
+    def test_fast_path(self):
+        stats = collections.Counter()
+        text_1 = "A clean sentence\twith a tab\n"
+        text_2 = "¿La cigüeña bebía café?"
+        text_3 = "Â¿La cigÃ¼eÃ±a bebÃ­a cafÃ©?"
+        text_4 = "Caf&eacute;"
+        assert restorative_cleaning.fix(text_1, "en", self.chars_en, self.charsRe_en, stats) == "A clean sentence with a tab "
+        assert restorative_cleaning.fix(text_2, "es", self.chars_es, self.charsRe_es, stats) == text_2
+        assert restorative_cleaning.fix(text_3, "es", self.chars_es, self.charsRe_es, stats) == text_2
+        assert restorative_cleaning.fix(text_4, "es", self.chars_es, self.charsRe_es, stats) == "Café"
+        assert stats["fix"] == 4
+        assert stats["fix_fast_path"] == 2
+
+        # The pattern of the fast path is kept by its replacements table, built only once
+        assert self.charsRe_es.fix_unsafe_patterns.keys() == {False}
+        assert self.charsRe_es.get_fix_unsafe_pattern(False) is self.charsRe_es.fix_unsafe_patterns[False]
+
+    def test_normalize_chars(self):
+        text_1 = " Privateuse, em  space\x85and  Don''t  & # 39 ; \n"
+        fixed_1 = restorative_cleaning.normalize(text_1, "en", self.punct_en, self.punctRe_en)
+        fixed_zh = restorative_cleaning.normalize("你好！  ！", "zh", self.punct_zh, self.punctRe_zh)
+        assert fixed_1 == "Privateuse, em spaceand Don't &#39;"
+        assert fixed_zh == "你好！ ！"
+        assert restorative_cleaning.collapse_spaces(" \t a \n\n b　") == " a b "
+
+    def test_language_profile(self):
+        profile = restorative_cleaning.get_language_profile("ru")
+        assert restorative_cleaning.get_language_profile("ru") is profile
+        assert profile.is_cyrillic and not profile.is_cjk and not profile.has_carons
+        assert restorative_cleaning.get_language_profile("zh").is_cjk
+        assert restorative_cleaning.get_language_profile("cs").has_carons
+
+        text = "  Ð¡Ñ‚Ð°Ñ‚ÑŒÑ &amp; текст  , ok  "
+        fixed = restorative_cleaning.fix(text, "ru", self.chars_ru, self.charsRe_ru)
+        assert profile.fix(text) == fixed
+        assert profile.normalize(fixed) == restorative_cleaning.normalize(fixed, "ru", self.punct_ru, self.punctRe_ru)
+
+    def test_chars_replacer(self):
+        # The first key of the table wins when several of them match at the same position
+        replacer = restorative_cleaning.CharsReplacer({"ab": "1", "a": "2", "b": "3", "abc": "4"})
+        assert replacer.replace("abcab ba") == "1c1 32"
+
+        # Same as trying every key of the table in order at each position
+        def replace_chars(chars, text):
+            replaced, i = [], 0
+            while i < len(text):
+                key = next((key for key in chars if text.startswith(key, i)), text[i])
+                replaced.append(chars.get(key, key))
+                i += len(key)
+            return "".join(replaced)
+
+        text = "ЕЎ &amp; Ã© Е Ã ©" * 3
+        assert self.charsRe_en.replace(text) == replace_chars(self.chars_en, text)
+        assert self.charsRe_es.replace(text) == replace_chars(self.chars_es, text)
+
     def test_punct(self):
         text_1 = "  Did I pass  the     acid test  ?  "
         correct = "Did I pass the acid test?"
@@ -180,6 +318,14 @@ class TestDetokFix:
         fixed_1 = restorative_cleaning.ortho_detok_fix(text_1, {}, self.detoks_mt)
         assert fixed_1 == correct_1
 
+    def test_detokenization_edges(self):
+        # Detokenizations next to the start and the end of the sentence
+        assert restorative_cleaning.ortho_detok_fix(" L - aqwa", {}, self.detoks_mt) == " L-aqwa"
+        assert restorative_cleaning.ortho_detok_fix("l - ", {}, self.detoks_mt) == "l- "
+        assert restorative_cleaning.ortho_detok_fix("l - x", {}, self.detoks_mt) == "l-x"
+        text_2 = "Xejn x'jaqbel hawn, 123 !"
+        assert restorative_cleaning.ortho_detok_fix(text_2, {}, self.detoks_mt) is text_2
+
 
 class TestSegmenters:
     text_src = "En un lugar de la Mancha, de cuyo nombre no quiero acordarme, no ha mucho tiempo que vivía un hidalgo de los de lanza en astillero, adarga antigua, rocín flaco y galgo corredor. Una olla de algo más vaca que carnero, salpicón las más noches, duelos y quebrantos los sábados, lantejas los viernes, algún palomino de añadidura los domingos, consumían las tres partes de su hacienda. El resto della concluían sayo de velarte, calzas de velludo para las fiestas, con sus pantuflos de lo mesmo, y los días de entresemana se honraba con su vellorí de lo más fino. Tenía en su casa una ama que pasaba de los cuarenta, y una sobrina que no llegaba a los veinte, y un mozo de campo y plaza, que así ensillaba el rocín como tomaba la podadera. Frisaba la edad de nuestro hidalgo con los cincuenta años, era de complexión recia, seco de carnes, enjuto de rostro, gran madrugador y amigo de la caza. Quieren decir que tenía el sobrenombre de Quijada, o Quesada, que en esto hay alguna diferencia en los autores que deste caso escriben, aunque, por conjeturas verosímiles, se deja entender que se llamaba Quejana. Pero esto importa poco a nuestro cuento, basta que en la narración dél no se salga un punto de la verdad."
@@ -193,6 +339,126 @@ class TestSegmenters:
 
         assert len(segments) == 7
 
+    def test_regex(self):
+        segmenter_es = segmenter.NaiveSegmenter("es", "regex")
+        segmenter_en = segmenter.NaiveSegmenter("en", "regex")
+
+        segments = segmenter.naive_segmenter(segmenter_es, segmenter_en, self.text_src, self.text_trg)
+        assert len(segments) == 7
+        assert segments == segmenter.naive_segmenter(segmenter.NaiveSegmenter("es", "nltk"), segmenter.NaiveSegmenter("en", "nltk"), self.text_src, self.text_trg)
+
+        assert segmenter_en("Hello Mr. Smith. How are you? I'm fine!! Bye.  ") == ["Hello Mr. Smith.", "How are you?", "I'm fine!!", "Bye."]
+        assert segmenter_en("He met J. R. R. Tolkien in the U.S. last year. See p. 5. Then wait... Really?") == ["He met J. R. R. Tolkien in the U.S. last year.", "See p. 5.", "Then wait... Really?"]
+        assert segmenter_en("He said \"yes.\" Then (and only then.) he left. \"No ' she said.") == ["He said \"yes.\"", "Then (and only then.)", "he left.", "\"No ' she said."]
+        assert segmenter_es("Ya está. ' Sí. Etc. Hola") == ["Ya está. '", "Sí.", "Etc. Hola"]
+        assert segmenter.NaiveSegmenter("zh", "regex")("你好。我是中国人！谢谢") == ["你好。", "我是中国人！", "谢谢"]
+        assert segmenter_en("") == [] and segmenter_en(" ") == []
+
+        # Languages without a list of their own use the English one
+        assert segmenter.getNonbreakingPrefixes("xx") == segmenter.getNonbreakingPrefixes("en")
+        assert segmenter.getNonbreakingPrefixes("nn") == segmenter.getNonbreakingPrefixes("nb")
+        prefixes, numeric_prefixes = segmenter.getNonbreakingPrefixes("en")
+        assert "Mr" in prefixes and "No" in numeric_prefixes and "No" not in prefixes
+
+    def test_cache(self):
+        uncached = segmenter.NaiveSegmenter("es", "nltk")
+        cached = segmenter.NaiveSegmenter("es", "nltk", cache_size=1)
+        stats = collections.Counter()
+        sentences = [self.text_src, self.text_src, "Hola. Adiós.", self.text_src]
+        assert [cached(sentence, stats) for sentence in sentences] == [uncached(sentence) for sentence in sentences]
+        assert stats == {"segmentation_cache_hit": 1, "segmentation_cache_miss": 3, "segmentation_cache_eviction": 2}
+
+        engine = bifixer.BifixerEngine("es", "en", words_before_segmenting=2, segmentation_cache_size=10)
+        engine.fix_batch([(self.text_src, self.text_trg)] * 2)
+        assert engine.stats["segmentation_cache_hit"] == 2
+        assert engine.stats["segmentation_cache_miss"] == 2
+
+    def test_batch(self):
+        short_src, short_trg = "En un lugar de la Mancha. Vivía un hidalgo.", "In a village of La Mancha"
+        pairs = [(self.text_src, self.text_trg), (short_src, short_trg), ("Hola. Adiós.", "Hello. Bye."), (self.text_src, self.text_trg), ("", "")]
+        for module in ("nltk", "regex"):
+            segmenter_es = segmenter.NaiveSegmenter("es", module, cache_size=10)
+            segmenter_en = segmenter.NaiveSegmenter("en", module)
+            sources = [source for source, _ in pairs]
+            assert segmenter_es.segment_batch(sources) == [segmenter_es(source) for source in sources]
+
+            stats = collections.Counter()
+            assert segmenter.naive_segmenter_batch(segmenter_es, segmenter_en, pairs, stats) == [segmenter.naive_segmenter(segmenter_es, segmenter_en, source, target) for source, target in pairs]
+            assert stats["segmentation_avoided"] == 2
+            # The repeated sentence is only segmented once, and all of them were cached by the first segment_batch
+            assert stats["segmentation_cache_hit"] == 4 and stats["segmentation_cache_miss"] == 0
+
+            sentences = [self.text_src, short_trg, "Hola. Adiós."]
+            assert segmenter.naive_segmenter_mono_batch(segmenter_es, sentences) == [segmenter_es(sentence) for sentence in sentences]
+
+        engine = bifixer.BifixerEngine("es", "en", words_before_segmenting=2)
+        batch_stats = collections.Counter()
+        assert engine.fix_batch(pairs, batch_stats) == [engine.fix_pair(source, target) for source, target in pairs]
+        assert batch_stats["segmentation_avoided"] == engine.stats["segmentation_avoided"] == 2
+
+        mono_engine = monofixer.MonofixerEngine("es", words_before_segmenting=2)
+        sentences = [self.text_src, short_src, "Hola. Adiós.", "", self.text_src]
+        assert mono_engine.fix_batch(sentences, collections.Counter()) == [mono_engine.fix_sentence(sentence) for sentence in sentences]
+
+    def test_prescreen(self):
+        segmenter_es = segmenter.NaiveSegmenter("es", "nltk")
+        segmenter_en = segmenter.NaiveSegmenter("en", "nltk")
+        sentences = ["Hola mundo", "Hola mundo.", "Hola mundo. ", "Hola. Mundo", "¿Hola? Mundo", "Hola mundo (sí.)", "Hola Sr. Pérez", "x.y.z", "Ya.\"Bien\"", "Hola mundo.)", ""]
+        for sentence in sentences:
+            if segmenter_es.is_one_segment(sentence):
+                assert segmenter_es(sentence) == [sentence]
+        assert segmenter_es.is_one_segment("Hola mundo.") and segmenter_es.is_one_segment("x.y.z")
+        assert not segmenter_es.is_one_segment("Hola mundo. ") and not segmenter_es.is_one_segment("Hola Sr. Pérez")
+
+        for source in sentences:
+            for target in sentences:
+                if segmenter.keeps_pair(segmenter_es, segmenter_en, source, target):
+                    assert segmenter.naive_segmenter(segmenter_es, segmenter_en, source, target) == [{"source_segment": source, "target_segment": target}]
+        assert segmenter.keeps_pair(segmenter_es, segmenter_en, "Hola mundo", "Hello. World")
+        assert not segmenter.keeps_pair(segmenter_es, segmenter_en, "Hola mundo", "Hello world. ")
+        assert not segmenter.keeps_pair(segmenter_es, segmenter_en, "Hola. Mundo", "Hello. World")
+
+        engine = bifixer.BifixerEngine("es", "en", words_before_segmenting=2)
+        engine.fix_batch([(self.text_src, self.text_trg), (self.text_src, "In a village of La Mancha, the name of which I have no desire to call to mind")])
+        assert engine.stats["segmentation_avoided"] == 2
+        assert engine.stats["segmentation_cache_miss"] == 2
+
+    def test_punkt_cache(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("BIFIXER_CACHE_DIR", str(tmp_path))
+        segmenter.get_punkt_parameters.cache_clear()
+        expected = segmenter.NaiveSegmenter("es", "nltk")(self.text_src)
+        assert os.listdir(tmp_path) == ["punkt.spanish.pickle"]
+
+        # Once cached, neither the NLTK data nor the main thread are needed
+        segmenter.get_punkt_parameters.cache_clear()
+        monkeypatch.setattr(segmenter, "load_punkt_tab", None)
+        segments = []
+        thread = threading.Thread(target=lambda: segments.append(segmenter.NaiveSegmenter("es", "nltk")(self.text_src)))
+        thread.start()
+        thread.join()
+        assert segments == [expected]
+        monkeypatch.undo()
+
+        # Cache files with anything else than plain data are refused and replaced
+        monkeypatch.setenv("BIFIXER_CACHE_DIR", str(tmp_path))
+        with open(tmp_path / "punkt.spanish.pickle", "wb") as punkt_file:
+            punkt_file.write(pickle.dumps(collections.Counter()))
+        segmenter.get_punkt_parameters.cache_clear()
+        assert segmenter.NaiveSegmenter("es", "nltk")(self.text_src) == expected
+        with open(tmp_path / "punkt.spanish.pickle", "rb") as punkt_file:
+            assert segmenter.read_punkt_parameters(punkt_file).abbrev_types == segmenter.load_punkt_tab("spanish").abbrev_types
+        segmenter.get_punkt_parameters.cache_clear()
+
+    def test_punkt_download_timeout(self, monkeypatch):
+        def find(resource):
+            raise LookupError(resource)
+        monkeypatch.setattr(segmenter.nltk.data, "find", find)
+        monkeypatch.setattr(segmenter.nltk, "download", lambda *args, **kwargs: time.sleep(10))
+        start = time.perf_counter()
+        with pytest.raises(Exception, match="Unable to download 'punkt_tab'"):
+            segmenter.download_punkt(timeout=0.1)
+        assert time.perf_counter() - start < 5
+
     def test_Loomchild(self, capsys):
 
         if "loomchild.segmenter" not in sys.modules:
@@ -292,6 +558,525 @@ class TestAggressiveDedup:
             assert hashes[2] == hashes[3]
             assert hashes[4] == hashes[5]
 
+class TestDropDuplicates:
+    def get_args(self):
+        parser = argparse.ArgumentParser()
+        args = parser.parse_args()
+
+        args.srclang = "en"
+        args.trglang = "es"
+        args.scol = 3
+        args.tcol = 4
+        args.ignore_characters = False
+        args.ignore_normalization = False
+        args.ignore_orthography = False
+        args.ignore_detokenization = False
+        args.ignore_segmentation = True
+        args.sdeferredcol = None
+        args.tdeferredcol = None
+        args.sparagraphid = None
+        args.tparagraphid = None
+        args.header = None
+        args.ignore_empty = False
+        args.ignore_long = False
+        args.ignore_html = False
+        args.dedup = True
+        args.aggressive_dedup = True
+        args.annotated_output = True
+        args.batch_size = 3
+        return args
+
+    def test_hash_set(self):
+        hashes = dedup.HashSet(capacity=4, value_type="d")
+        keys = [0, 1, 2**64 - 1] + [i * 0x9E3779B97F4A7C15 % 2**64 for i in range(2, 100)]
+        for i, key in enumerate(keys):
+            slot, added = hashes.add(key)
+            assert added
+            hashes.values[slot] = i
+        assert len(hashes) == len(keys)
+        assert len(hashes.keys) == 257
+        assert all(key in hashes for key in keys) and 12345 not in hashes
+        assert hashes.add(2**64 - 1) == (hashes.find(2**64 - 1), False)
+        assert hashes.values[hashes.find(keys[50])] == 50
+        assert hashes.values[hashes.find(0)] == 0 and hashes.values[hashes.find(1)] == 1
+
+        # The hash 0 is not mistaken for the hash 1
+        hashes = dedup.HashSet(capacity=4)
+        assert hashes.add(0)[1] and 0 in hashes and 1 not in hashes
+        assert hashes.add(1)[1] and hashes.add(0) == (hashes.find(0), False)
+
+    def test_fix_sentences(self):
+        args = self.get_args()
+        lines = ["url\turl\tThe dog's bone.\tEl hueso del perro.\n",
+                 "url\turl\tthe dogs bone\tel hueso del perro\n",
+                 "url\turl\tA cat.\tUn gato.\n",
+                 "url\turl\tThe dog's bone.\tEl hueso del perro.\n",
+                 "url\turl\tTHE DOG'S BONE!\tEL HUESO DEL PERRO!\n",
+                 "url\turl\tA cat.\tUn gato.\n"]
+        args.input = io.StringIO("".join(lines))
+        args.output = io.StringIO()
+        bifixer.fix_sentences(args)
+        rows = args.output.getvalue().splitlines(True)
+        rankings = [float(row.split("\t")[5]) for row in rows]
+        assert len({row.split("\t")[4] for row in rows}) == 2
+
+        args.drop_duplicates = True
+        for keep_best, kept in ((False, [0, 2]), (True, [rankings.index(max(rankings[:2] + rankings[3:5])), 2])):
+            args.keep_best = keep_best
+            outputs = []
+            for threads, pipeline in ((1, False), (2, True)):
+                args.threads = threads
+                args.pipeline = pipeline
+                args.input = io.StringIO("".join(lines))
+                args.output = io.StringIO()
+                stats = bifixer.fix_sentences(args)
+                assert stats["dedup_dropped"] == 4
+                outputs.append(args.output.getvalue())
+            assert outputs[0] == outputs[1] == "".join(rows[i] for i in sorted(kept))
+
+
+    def test_hash_index(self, tmp_path):
+        path = str(tmp_path / "index")
+        index = dedup.HashIndex(path)
+        assert len(index) == 0 and 5 not in index
+        # Fits in the initial table, then doubles it, then doubles it again from the memory-mapped file
+        for keys, added, capacity in ((range(0, 40000), 40000, 1 << 16), (range(30000, 60000), 20000, 1 << 17), (range(60000, 100000), 40000, 1 << 18)):
+            assert index.update(keys) == added
+            assert len(index) == keys.stop and len(index.keys) == capacity + 1
+            assert os.path.getsize(path) == dedup.HASH_INDEX_HEADER.size + 8 * (capacity + 1)
+        index.close()
+
+        index = dedup.HashIndex(path)
+        assert all(key in index for key in (0, 1, 59999, 99999)) and 100000 not in index
+        assert index.update([5, 6]) == 0
+        index.close()
+        assert os.listdir(tmp_path) == ["index"]
+
+        with open(path, "r+b") as f:
+            f.write(b"NOTINDEX")
+        with pytest.raises(ValueError):
+            dedup.HashIndex(path)
+
+    def test_fix_sentences_hash_index(self, tmp_path):
+        args = self.get_args()
+        args.drop_duplicates = True
+        args.hash_index = str(tmp_path / "index")
+        lines = ["url\turl\tThe dog's bone.\tEl hueso del perro.\n",
+                 "url\turl\tA cat.\tUn gato.\n",
+                 "url\turl\tA cat.\tUn gato.\n"]
+        new_lines = ["url\turl\tA CAT!\tUN GATO!\n",
+                     "url\turl\tA bird.\tUn pájaro.\n"]
+
+        for keep_best in (False, True):
+            if os.path.exists(args.hash_index):
+                os.remove(args.hash_index)
+            args.keep_best = keep_best
+            args.hash_index_readonly = False
+            args.input = io.StringIO("".join(lines))
+            args.output = io.StringIO()
+            stats = bifixer.fix_sentences(args)
+            assert stats["dedup_dropped"] == 1 and stats["hash_index_added"] == 2 and stats["hash_index_size"] == 2
+
+            # Rows already in the index are dropped, and only the new hashes are added, unless it is read-only
+            for readonly, size in ((True, 2), (False, 3)):
+                args.hash_index_readonly = readonly
+                args.input = io.StringIO("".join(lines + new_lines))
+                args.output = io.StringIO()
+                stats = bifixer.fix_sentences(args)
+                assert args.output.getvalue().splitlines()[0].split("\t")[2] == "A bird."
+                assert stats["dedup_known"] == 4 and stats["dedup_dropped"] == 4 and stats["hash_index_size"] == size
+
+
+class TestDedupBest:
+    rows = [b"url\tsrc %d\ttrg %d\t%016x\t%d\n" % (i, i, (i * 0x9E3779B97F4A7C15 % 2**64) * (i % 7 != 0) + i % 3, i % 5) for i in range(200)]
+
+    def expected(self):
+        best = {}
+        for row in self.rows:
+            fields = row.split(b"\t")
+            key, ranking = int(fields[3], 16), float(fields[4])
+            if key not in best or ranking > best[key]:
+                best[key] = ranking
+        kept = []
+        for row in self.rows:
+            fields = row.split(b"\t")
+            key, ranking = int(fields[3], 16), float(fields[4])
+            if best[key] == ranking:
+                best[key] = None
+                kept.append(row)
+        return kept
+
+    @pytest.mark.parametrize("partitions", [1, 4, 300])
+    def test_dedup_best(self, tmp_path, partitions):
+        output = []
+        stats = dedup.dedup_best(iter(self.rows + [b"short row\n"]), output.extend, -2, -1, str(tmp_path), partitions, batch_size=16)
+        assert output == self.expected()
+        assert stats["dedup_rows"] == 200 and stats["dedup_dropped"] == 200 - len(output)
+        assert os.listdir(tmp_path) == []
+
+    def test_header(self, tmp_path):
+        args = argparse.Namespace(header=True, hcol="bifixer_hash", rcol="bifixer_score", tmp_dir=str(tmp_path), partitions=2, batch_size=10)
+        args.input = io.BytesIO(b"url\tsrc\ttrg\tbifixer_hash\tbifixer_score\n" + b"".join(self.rows))
+        args.output = io.BytesIO()
+        dedup.perform_dedup(args)
+        assert args.output.getvalue() == b"url\tsrc\ttrg\tbifixer_hash\tbifixer_score\n" + b"".join(self.expected())
+
+
+class TestNearDedup:
+    lines = ["url\turl\tThe European Commission adopted the proposal for the Council yesterday.\tLa Comisión Europea adoptó ayer la propuesta para el Consejo.\n",
+             "url\turl\tA cat sleeps on the mat.\tUn gato duerme en la alfombra.\n",
+             "url\turl\tThe European Commission adopted the proposal for the Parliament yesterday.\tLa Comisión Europea adoptó ayer la propuesta para el Parlamento.\n",
+             "url\turl\tClick here to download the file.\tHaga clic aquí para descargar el archivo.\n",
+             "url\turl\ta cat sleeps on the mat\tun gato duerme en la alfombra\n",
+             "url\turl\tClick here to download the PDF file.\tHaga clic aquí para descargar el archivo PDF.\n",
+             "url\turl\tCompletely unrelated sentence about mountains.\tFrase completamente distinta sobre montañas.\n"]
+
+    def get_args(self):
+        args = TestDropDuplicates().get_args()
+        args.aggressive_dedup = False
+        args.annotated_output = False
+        args.near_dedup = True
+        args.near_dedup_window = 100
+        return args
+
+    def test_band_keys(self):
+        text = "theeuropeancommissionadoptedtheproposalforthecouncil\tlacomisioneuropeaadoptolapropuestaparaelconsejo"
+        bands = near_dedup.get_band_keys(text)
+        assert len(bands) == near_dedup.NEAR_DEDUP_BANDS and bands == near_dedup.get_band_keys(text)
+        assert set(bands) & set(near_dedup.get_band_keys(text.replace("council", "counsel")))
+        assert not set(bands) & set(near_dedup.get_band_keys("clickheretodownloadthefile\thagaclicaquiparadescargarelarchivo"))
+        # Short texts leave most of the bins empty
+        assert len(set(near_dedup.get_band_keys("ab\t"))) == near_dedup.NEAR_DEDUP_BANDS
+
+    def test_cluster_index(self):
+        index = near_dedup.ClusterIndex()
+        # Two bands per row, so each generation holds the bands of two rows
+        index.max_keys = 4
+        assert index.get_cluster(1, [10, 11]) == 1
+        assert index.get_cluster(2, [20, 21]) == 2
+        assert index.previous is not None and len(index.current) == 0
+        # Bands found in the previous generation are copied to the current one, with their cluster
+        assert index.get_cluster(3, [30, 11]) == 1
+        assert 11 in index.current and 10 not in index.current
+        assert index.get_cluster(4, [10, 40]) == 1
+        assert index.get_cluster(5, [50, 51]) == 5
+        # The generation of the second row was dropped
+        assert index.get_cluster(6, [20, 60]) == 6
+        assert index.stats["near_dedup_joined"] == 2 and index.stats["near_dedup_rotations"] == 3
+
+    def test_fix_sentences(self):
+        args = self.get_args()
+        outputs = []
+        for threads, pipeline in ((1, False), (2, True)):
+            args.threads = threads
+            args.pipeline = pipeline
+            args.input = io.StringIO("".join(self.lines))
+            args.output = io.StringIO()
+            stats = bifixer.fix_sentences(args)
+            outputs.append(args.output.getvalue())
+        assert outputs[0] == outputs[1]
+        assert stats["near_dedup_rows"] == 7 and stats["near_dedup_joined"] == 3
+
+        rows = [row.rstrip("\n").split("\t") for row in outputs[0].splitlines()]
+        hashes = [row[4] for row in rows]
+        assert [row[6] for row in rows] == [hashes[0], hashes[1], hashes[0], hashes[3], hashes[1], hashes[3], hashes[6]]
+
+    def test_drop_duplicates(self):
+        args = self.get_args()
+        args.aggressive_dedup = True
+        args.annotated_output = True
+        args.drop_duplicates = True
+        args.keep_best = True
+        args.input = io.StringIO("".join(self.lines))
+        args.output = io.StringIO()
+        stats = bifixer.fix_sentences(args)
+        rows = [row.split("\t") for row in args.output.getvalue().splitlines(True)]
+        assert stats["dedup_dropped"] == 1 and len(rows) == 6
+        assert rows[3][2] == "a cat sleeps on the mat" and rows[3][6] == rows[3][4]
+        assert all(row[-1] == "No\n" for row in rows)
+
+
+class TestThreads:
+    langs =["en", "es", "ru", "ja", "el", "mt"]
+    texts = ["Â¿La cigÃ¼eÃ±a bebÃ­a cafÃ©  ?", "Ð¡Ñ‚Ð°Ñ‚ÑŒÑ &amp; текст , ok", "ｈｅｌｌｏ、ｗｏｒｌｄ！", "The  dog ''s bone ... ", "Ma ' l-ħin ta ' Ħadd"]
+
+    def clean(self, job):
+        lang, text = job
+        chars, charsRe = restorative_cleaning.getCharsReplacements(lang)
+        punct, punctRe = restorative_cleaning.getNormalizedPunctReplacements(lang)
+        fixed = restorative_cleaning.fix(text, lang, chars, charsRe)
+        fixed = restorative_cleaning.normalize(fixed, lang, punct, punctRe)
+        return restorative_cleaning.ortho_detok_fix(fixed, restorative_cleaning.getReplacements(lang), restorative_cleaning.getDetokenizations(lang))
+
+    def test_mixed_languages(self):
+        jobs = [(lang, text) for i in range(10) for lang in self.langs for text in self.texts]
+        serial = [self.clean(job) for job in jobs]
+        with multiprocessing.pool.ThreadPool(8) as pool:
+            assert pool.map(self.clean, jobs, chunksize=1) == serial
+
+    def test_fix_sentences(self):
+        parser = argparse.ArgumentParser()
+        args = parser.parse_args()
+
+        args.srclang = "en"
+        args.trglang = "es"
+        args.scol = 3
+        args.tcol = 4
+        args.ignore_characters = False
+        args.ignore_normalization = False
+        args.ignore_orthography = False
+        args.ignore_detokenization = False
+        args.ignore_segmentation = True
+        args.sdeferredcol = None
+        args.tdeferredcol = None
+        args.sparagraphid = None
+        args.tparagraphid = None
+        args.header = None
+        args.ignore_empty = False
+        args.ignore_long = False
+        args.ignore_html = False
+        args.dedup = True
+        args.aggressive_dedup = False
+        args.annotated_output = True
+        args.batch_size = 7
+
+        lines = ["url1\turl2\t{0} {1}\t{1} {0}\n".format(text, i) for i in range(30) for text in self.texts]
+        outputs = []
+        for threads, pipeline in ((1, False), (4, False), (1, True), (4, True)):
+            args.threads = threads
+            args.pipeline = pipeline
+            args.input = io.StringIO("".join(lines))
+            args.output = io.StringIO()
+            stats = bifixer.fix_sentences(args)
+            if pipeline:
+                assert stats["pipeline_fix"] > 0
+                stats = collections.Counter({k: v for k, v in stats.items() if not k.startswith("pipeline_")})
+            outputs.append((args.output.getvalue(), stats))
+
+        assert outputs[0] == outputs[1] == outputs[2] == outputs[3]
+
+    def test_processes(self):
+        # Batches fixed by worker processes give the same output and stats as a serial run, also when dropping the
+        # duplicated rows and when reading and writing in their own threads. Only the caches differ, as each worker has
+        # its own ones
+        args = argparse.Namespace(srclang="en", trglang="es", scol=3, tcol=4, sdeferredcol=None, tdeferredcol=None,
+                                  sparagraphid=None, tparagraphid=None, header=None, ignore_characters=False,
+                                  ignore_normalization=False, ignore_orthography=False, ignore_detokenization=False,
+                                  ignore_segmentation=False, words_before_segmenting=3, segmenter="regex", ignore_empty=False,
+                                  ignore_long=False, ignore_html=False, dedup=True, aggressive_dedup=True,
+                                  annotated_output=True, batch_size=4)
+        lines = ["url1\turl2\t{0} {1}. {0}\t{1} {0}. The second one\n".format(text, i % 7) for i in range(20) for text in self.texts]
+
+        for drop_duplicates, pipeline in ((False, False), (True, False), (True, True)):
+            args.drop_duplicates = drop_duplicates
+            args.pipeline = pipeline
+            outputs = []
+            for processes in (1, 2):
+                args.processes = processes
+                args.input = io.StringIO("".join(lines))
+                args.output = io.StringIO()
+                stats = bifixer.fix_sentences(args)
+                stats = collections.Counter({k: v for k, v in stats.items() if not k.startswith("pipeline_") and "cache" not in k})
+                outputs.append((args.output.getvalue(), stats))
+
+            assert outputs[0] == outputs[1]
+            assert outputs[0][1]["input_rows"] == len(lines)
+            if drop_duplicates:
+                assert outputs[0][1]["dedup_dropped"] > 0
+
+    def test_imap_ordered(self):
+        # Later items finish first, but the results come in the order of the input
+        def work(i):
+            time.sleep(0.002 * (4 - i % 5))
+            return i
+
+        with multiprocessing.pool.ThreadPool(4) as pool:
+            assert list(rows.imap_ordered(pool, work, range(30), 8)) == list(range(30))
+
+    def test_pipeline_errors(self):
+        def batches():
+            yield 1
+            raise ValueError("broken input")
+
+        with pytest.raises(ValueError):
+            with rows.Pipeline() as pipe:
+                list(pipe.reader(batches()))
+
+        def write(output):
+            raise OSError("broken output")
+
+        with pytest.raises(OSError):
+            with rows.Pipeline() as pipe:
+                write = pipe.writer(write)
+                write(["row\n"])
+
+class TestRemoveNonAlpha:
+    def test_cached_table(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("BIFIXER_CACHE_DIR", str(tmp_path))
+        util.get_remove_non_alpha.cache_clear()
+        table = util.get_remove_non_alpha()
+        assert "Ça, 2 cafés!".translate(table) == "Çacafés"
+        assert len(os.listdir(tmp_path)) == 1
+
+        # Second load comes from the cache file
+        util.get_remove_non_alpha.cache_clear()
+        assert util.get_remove_non_alpha() == table
+        util.get_remove_non_alpha.cache_clear()
+
+class TestCompressedFiles:
+    lines = ["url{0}\tline {0} with ñ\n".format(i) for i in range(20000)]
+
+    @pytest.mark.parametrize("extension", [".gz", ".xz"])
+    def test_round_trip(self, tmp_path, extension):
+        path = str(tmp_path / ("corpus.tsv" + extension))
+        output = fileio.open_output(path, 1)
+        output.writelines(self.lines)
+        output.close()
+        with open(path, "rb") as f:
+            assert fileio.detect_compression(f.read(8)) is not None
+
+        input = fileio.open_input(path)
+        assert input.name == path
+        assert list(input) == self.lines
+        input.close()
+
+    def test_plain_file(self, tmp_path):
+        path = str(tmp_path / "corpus.tsv")
+        output = fileio.open_output(path)
+        output.writelines(self.lines[:10])
+        output.close()
+        input = fileio.open_input(path)
+        assert input.readlines() == self.lines[:10]
+        input.close()
+
+    def test_early_close(self, tmp_path):
+        path = str(tmp_path / "corpus.tsv.gz")
+        with fileio.open_output(path) as output:
+            output.writelines(self.lines)
+        input = fileio.open_input(path)
+        assert next(input) == self.lines[0]
+        input.close()
+
+    def test_pipe(self, monkeypatch):
+        # Reads from a pipe can return a single byte, which is not enough to detect the compression
+        class OneByteReader(io.RawIOBase):
+            def __init__(self, data):
+                self.data = data
+
+            def readable(self):
+                return True
+
+            def readinto(self, b):
+                if not self.data:
+                    return 0
+                b[:1], self.data = self.data[:1], self.data[1:]
+                return 1
+
+        lines = self.lines[:100]
+        data = "".join(lines).encode("utf-8")
+        for compressed in (gzip.compress(data), lzma.compress(data), data):
+            for binary in (False, True):
+                stdin = io.TextIOWrapper(io.BufferedReader(OneByteReader(compressed)), encoding="utf-8")
+                monkeypatch.setattr(sys, "stdin", stdin)
+                input = fileio.open_input("-", binary)
+                assert input.readlines() == [line.encode("utf-8") if binary else line for line in lines]
+                input.close()
+                assert not stdin.closed
+
+    def test_read_lines(self):
+        data = b"a\tb\r\nc\rd\n\xff\tno newline"
+        lines = list(fileio.read_lines(io.BufferedReader(io.BytesIO(data))))
+        assert lines == [b"a\tb\n", b"c\n", b"d\n", b"\xff\tno newline"]
+
+    def test_binary_rows(self):
+        # Rows read as bytes give the same output as text rows, and the columns that are not fixed are kept as they are
+        args = argparse.Namespace(srclang="en", trglang="es", scol=3, tcol=4, sdeferredcol=None, tdeferredcol=None,
+                                  sparagraphid=None, tparagraphid=None, header=None, ignore_characters=False,
+                                  ignore_normalization=False, ignore_orthography=False, ignore_detokenization=False,
+                                  ignore_segmentation=True, ignore_empty=False, ignore_long=False, ignore_html=False,
+                                  dedup=True, aggressive_dedup=False, annotated_output=True)
+        lines = ["http://u{0}\thttp://v{0}\tcafÃ© {0}\tThe  dog ''s bone\textra {0}\n".format(i) for i in range(10)]
+
+        args.input = io.StringIO("".join(lines))
+        args.output = io.StringIO()
+        bifixer.fix_sentences(args)
+        text_output = args.output.getvalue()
+
+        args.input = io.BufferedReader(io.BytesIO("".join(lines).encode("utf-8")))
+        args.output = io.BytesIO()
+        bifixer.fix_sentences(args)
+        assert args.output.getvalue().decode("utf-8") == text_output
+
+        args.input = io.BufferedReader(io.BytesIO(b"\xffurl\turl\tcaf\xc3\xa9\tdog\t\xfe\n"))
+        args.output = io.BytesIO()
+        bifixer.fix_sentences(args)
+        assert args.output.getvalue().startswith(b"\xffurl\turl\tcaf\xc3\xa9\tdog\t\xfe\t")
+
+    def test_wrong_level(self, tmp_path):
+        with pytest.raises(ValueError):
+            fileio.open_output(str(tmp_path / "corpus.tsv.gz"), 10)
+
+
+class TestMonofixer:
+    def test_fix_sentences(self):
+        # Segmented sentences get the number of each segment in their paragraph and deferred columns, and rows with the
+        # number of a segment in the deferred column only keep that segment
+        args = argparse.Namespace(lang="en", scol=2, sdeferredcol=3, sparagraphid=1, header=None, ignore_characters=False,
+                                  ignore_normalization=False, ignore_orthography=False, ignore_detokenization=False,
+                                  ignore_segmentation=False, words_before_segmenting=2, segmenter="regex", ignore_empty=False,
+                                  ignore_long=False, ignore_html=False, dedup=False, aggressive_dedup=False, annotated_output=True)
+        args.input = io.StringIO("p1\tThe first  sentence. The second sentence.\tref\n"
+                                 "p2\tThe first sentence. The second sentence.\tref#2\n"
+                                 "p3\tUna frase\tref\n"
+                                 "p4\t   \tref\n")
+        args.output = io.StringIO()
+        stats = monofixer.fix_sentences(args)
+        assert args.output.getvalue() == ("p1#1\tThe first sentence.\tref#1\tYes\n"
+                                          "p1#2\tThe second sentence.\tref#2\tYes\n"
+                                          "p2#2\tThe second sentence.\tref#2\tYes\n"
+                                          "p3\tUna frase\tref\tNo\n")
+        assert stats["input_rows"] == 4
+        assert stats["output_rows"] == 4
+
+class TestBenchmark:
+    def test_corpus(self):
+        rows = list(corpus.CorpusGenerator("en", "mt", seed=3).rows(500))
+        assert rows == list(corpus.CorpusGenerator("en", "mt", seed=3).rows(500))
+        assert all(row.count("\t") == 3 for row in rows)
+        pairs = [tuple(row.split("\t")[2:]) for row in rows]
+        assert len(set(pairs)) < len(pairs)  # duplicates
+        text = "".join(rows)
+        assert "Ä" in text and "</" in text and "&" in text and " - " in text
+
+        # Without noise there is nothing to fix but the duplicates
+        clean = corpus.CorpusGenerator("en", "es", **dict.fromkeys(corpus.DEFAULT_RATES, 0))
+        profile = restorative_cleaning.get_language_profile("es")
+        for source, target in clean.pairs(100):
+            assert profile.normalize(profile.fix(target)) == target
+
+    def test_micro(self):
+        results = micro.run_micro("en", "es", n=40, repeat=1)
+        assert {result["function"] for result in results} >= {"fix", "normalize", "ortho_detok_fix", "NaiveSegmenter", "get_hash"}
+        assert all(result["time"] > 0 for result in results)
+
+    def test_segmenters(self):
+        results = micro.run_segmenters("en", "es", n=200, repeat=1)
+        assert [(result["segmenter"], result["lang"]) for result in results] == [("nltk", "en"), ("regex", "en"), ("nltk", "es"), ("regex", "es")]
+        assert all(result["time"] > 0 for result in results)
+        assert results[0]["agreement"] == 1 and results[1]["agreement"] > 0.9
+
+    def test_startup(self):
+        results = micro.run_startup(["en", "xx"], repeat=1)
+        assert [(result["lang"], result["source"]) for result in results] == [(lang, source) for lang in ("en", "xx") for source in ("NLTK data", "cache file", "loaded")]
+        assert all(result["time"] > 0 for result in results)
+
+    def test_end_to_end(self, tmp_path):
+        results = end_to_end.run_end_to_end([("en", "es")], str(tmp_path), n=50)
+        assert [(result["tool"], result["langs"]) for result in results] == [("bifixer", "en-es"), ("monofixer", "en"), ("monofixer", "es")]
+        assert all(result["peak_rss"] > 0 for result in results)
+        with open(tmp_path / "fixed.en-es.tsv") as fixed:
+            assert len(fixed.readlines()) >= 50
+
 '''
 class TestMulti:
     parser = argparse.ArgumentParser()